@@ -1,2 +1,15 @@
 from __future__ import absolute_import
-from .htchirp import HTChirp, condor_chirp
+from .htchirp import (
+    HTChirp,
+    ChirpStat,
+    ChirpStatFS,
+    ChirpDirEntry,
+    ChirpDirColumns,
+    ChirpBlockCache,
+    ChirpFileCache,
+    ChirpPrefetcher,
+    ChirpLogShipper,
+    ChirpRateLimiter,
+    ChirpConcurrency,
+    condor_chirp,
+)
@@ -0,0 +1,318 @@
+"""fsspec filesystem backed by HTChirp
+
+Requires the optional ``fsspec`` package. Once htchirp is installed, fsspec
+finds this filesystem for ``chirp://`` URLs, e.g.
+
+    >>> import pandas
+    >>> df = pandas.read_parquet("chirp://results/output.parquet")
+
+URLs are either ``chirp://host:port/path`` to name a Chirp server, or
+``chirp://path`` (``chirp:///path`` for absolute paths) to use the server in
+``$_CONDOR_CHIRP_CONFIG`` of the current HTCondor job.
+"""
+
+from __future__ import absolute_import
+
+import datetime
+import io
+import os
+import stat
+import threading
+from contextlib import contextmanager
+
+from fsspec.spec import AbstractBufferedFile, AbstractFileSystem
+
+from .htchirp import HTChirp
+
+
+class ChirpFileSystem(AbstractFileSystem):
+    """fsspec filesystem for files on a Chirp server
+
+    Directory listings and metadata come from getlongdir and stat, ranged
+    reads use pread on a remote file descriptor that is kept open by each
+    file object, and whole-file transfers use getfile and putfile.
+    """
+
+    protocol = "chirp"
+    root_marker = ""
+
+    def __init__(
+        self,
+        host=None,
+        port=None,
+        cookie=None,
+        auth=["cookie"],
+        timeout=10,
+        block_cache=None,
+        **kwargs
+    ):
+        """
+        :param host: the hostname or ip of the Chirp server
+        :param port: the port of the Chirp server
+        :param cookie: the cookie string, if trying cookie authentication
+        :param auth: a list of authentication methods to try
+        :param timeout: socket timeout, in seconds
+        :param block_cache: a ChirpBlockCache used to serve cat_file() calls
+        """
+
+        super(ChirpFileSystem, self).__init__(**kwargs)
+        self.chirp = HTChirp(host, port, auth, cookie, timeout, block_cache=block_cache)
+        self.chirp.connect()
+        self.lock = threading.RLock()  # the client is shared by all files
+
+    @classmethod
+    def _strip_protocol(cls, path):
+        path = str(path)
+        if path.startswith("chirp://"):
+            path = path[len("chirp://") :]
+            netloc = path.split("/", 1)[0]
+            if ":" in netloc:  # drop host:port
+                path = path[len(netloc) :] or "/"
+        if len(path) > 1:
+            path = path.rstrip("/")
+        return path
+
+    @staticmethod
+    def _get_kwargs_from_urls(path):
+        path = str(path)
+        if path.startswith("chirp://"):
+            netloc = path[len("chirp://") :].split("/", 1)[0]
+            if ":" in netloc:
+                (host, port) = netloc.rsplit(":", 1)
+                return {"host": host, "port": int(port)}
+        return {}
+
+    @contextmanager
+    def _chirp(self, path=None):
+        """Use the client, translating Chirp errors to OSErrors"""
+
+        with self.lock:
+            try:
+                yield self.chirp
+            except HTChirp.DoesntExist:
+                raise FileNotFoundError(path)
+            except HTChirp.AlreadyExists:
+                raise FileExistsError(path)
+            except HTChirp.NotAuthorized:
+                raise PermissionError(path)
+            except HTChirp.IsDir:
+                raise IsADirectoryError(path)
+            except HTChirp.NotDir:
+                raise NotADirectoryError(path)
+
+    def _info(self, path, stats):
+        """Convert Chirp stat results to an fsspec info dict"""
+
+        if stat.S_ISDIR(stats["mode"]):
+            kind = "directory"
+        elif stat.S_ISREG(stats["mode"]):
+            kind = "file"
+        else:
+            kind = "other"
+        info = {"name": path, "size": stats["size"], "type": kind}
+        info.update(stats)
+        return info
+
+    def ls(self, path, detail=True, **kwargs):
+        path = self._strip_protocol(path)
+        with self._chirp(path) as chirp:
+            listing = chirp.getlongdir(path)
+        entries = [
+            self._info(path.rstrip("/") + "/" + name, stats)
+            for (name, stats) in listing.items()
+            if name not in (".", "..")
+        ]
+        entries.sort(key=lambda entry: entry["name"])
+        if detail:
+            return entries
+        return [entry["name"] for entry in entries]
+
+    def info(self, path, **kwargs):
+        path = self._strip_protocol(path)
+        with self._chirp(path) as chirp:
+            return self._info(path, chirp.stat(path))
+
+    def modified(self, path):
+        return datetime.datetime.utcfromtimestamp(self.info(path)["mtime"])
+
+    def cat_file(self, path, start=None, end=None, **kwargs):
+        path = self._strip_protocol(path)
+        if start is None and end is None:
+            data = io.BytesIO()
+            with self._chirp(path) as chirp:
+                chirp.getfile(path, data)
+            return data.getvalue()
+
+        if (start is not None and start < 0) or (end is not None and end < 0):
+            size = self.size(path)
+            if start is not None and start < 0:
+                start = max(0, size + start)
+            if end is not None and end < 0:
+                end = max(0, size + end)
+        start = start or 0
+        if end is None:
+            end = self.size(path)
+        if end <= start:
+            return b""
+        with self._chirp(path) as chirp:
+            return chirp.read(path, end - start, start)
+
+    def pipe_file(self, path, value, **kwargs):
+        path = self._strip_protocol(path)
+        with self._chirp(path) as chirp:
+            chirp.write(io.BytesIO(value), path, "wct")
+
+    def put_file(self, lpath, rpath, callback=None, **kwargs):
+        rpath = self._strip_protocol(rpath)
+        if os.path.isdir(lpath):
+            self.makedirs(rpath, exist_ok=True)
+            return
+        with self._chirp(rpath) as chirp:
+            chirp.putfile(lpath, rpath)
+
+    def get_file(self, rpath, lpath, callback=None, outfile=None, **kwargs):
+        rpath = self._strip_protocol(rpath)
+        if self.isdir(rpath):
+            os.makedirs(lpath, exist_ok=True)
+            return
+        with self._chirp(rpath) as chirp:
+            chirp.getfile(rpath, outfile if outfile is not None else lpath)
+
+    def rm_file(self, path):
+        path = self._strip_protocol(path)
+        with self._chirp(path) as chirp:
+            chirp.unlink(path)
+
+    def rm(self, path, recursive=False, maxdepth=None):
+        if isinstance(path, (list, tuple)):
+            for p in path:
+                self.rm(p, recursive, maxdepth)
+            return
+        path = self._strip_protocol(path)
+        if self.isdir(path):
+            with self._chirp(path) as chirp:
+                chirp.rmdir(path, recursive=recursive)
+        else:
+            self.rm_file(path)
+        self.invalidate_cache(path)
+
+    def rmdir(self, path):
+        path = self._strip_protocol(path)
+        with self._chirp(path) as chirp:
+            chirp.rmdir(path)
+        self.invalidate_cache(path)
+
+    def mkdir(self, path, create_parents=True, **kwargs):
+        path = self._strip_protocol(path)
+        if create_parents:
+            self.makedirs(path, exist_ok=True)
+        else:
+            with self._chirp(path) as chirp:
+                chirp.mkdir(path)
+
+    def makedirs(self, path, exist_ok=False):
+        path = self._strip_protocol(path)
+        parts = path.split("/")
+        for i in range(1, len(parts) + 1):
+            parent = "/".join(parts[:i])
+            if not parent:
+                continue  # root of an absolute path
+            try:
+                with self._chirp(parent) as chirp:
+                    chirp.mkdir(parent)
+            except FileExistsError:
+                if parent == path and not exist_ok:
+                    raise
+
+    def mv(self, path1, path2, recursive=False, maxdepth=None, **kwargs):
+        path1 = self._strip_protocol(path1)
+        path2 = self._strip_protocol(path2)
+        with self._chirp(path1) as chirp:
+            chirp.rename(path1, path2)
+        self.invalidate_cache(path1)
+        self.invalidate_cache(path2)
+
+    def _open(
+        self,
+        path,
+        mode="rb",
+        block_size=None,
+        autocommit=True,
+        cache_options=None,
+        **kwargs
+    ):
+        return ChirpFile(
+            self,
+            path,
+            mode,
+            block_size=block_size or "default",
+            autocommit=autocommit,
+            cache_options=cache_options,
+            **kwargs
+        )
+
+
+class ChirpFile(AbstractBufferedFile):
+    """File object for a file on a Chirp server
+
+    A single remote file descriptor is opened on first use and kept open
+    until the file object is closed. Reads are served by pread through
+    fsspec's block caching, writes are streamed with sequential writes.
+    """
+
+    # Chirp open flags for each file mode
+    FLAGS = {"rb": "r", "wb": "wct", "ab": "wca", "xb": "wcx"}
+
+    def __init__(self, fs, path, mode="rb", **kwargs):
+        super(ChirpFile, self).__init__(fs, path, mode, **kwargs)
+        self.fd = None
+
+    def _remote_fd(self):
+        if self.fd is None:
+            with self.fs._chirp(self.path) as chirp:
+                if self.mode != "rb":
+                    chirp._invalidate(self.path)
+                self.fd = chirp._open(self.path, self.FLAGS[self.mode])
+        return self.fd
+
+    def _fetch_range(self, start, end):
+        if end <= start:
+            return b""
+        fd = self._remote_fd()
+        data = []
+        with self.fs._chirp(self.path) as chirp:
+            while start < end:
+                chunk = chirp._read(fd, end - start, start)
+                if not chunk:
+                    break
+                data.append(chunk)
+                start += len(chunk)
+        return b"".join(data)
+
+    def _initiate_upload(self):
+        self._remote_fd()
+
+    def _upload_chunk(self, final=False):
+        data = self.buffer.getvalue()
+        with self.fs._chirp(self.path) as chirp:
+            while data:  # the server may write less than it was sent
+                wb = chirp._write(self.fd, data, len(data))
+                if wb <= 0:
+                    raise IOError(
+                        "Could not write {0} bytes to {1}".format(len(data), self.path)
+                    )
+                data = data[wb:]
+            if final:
+                chirp._fsync(self.fd)
+        return True
+
+    def close(self):
+        try:
+            super(ChirpFile, self).close()
+        finally:
+            if self.fd is not None:
+                with self.fs._chirp(self.path) as chirp:
+                    if chirp.is_connected():
+                        chirp._close(self.fd)
+                self.fd = None
+            self.fs.invalidate_cache(self.path)
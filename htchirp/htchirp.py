@@ -1,54 +1,2374 @@
 import re
 import os
+import errno
+import functools
 import stat
 import socket
 import sys
 import argparse
+import hashlib
+import heapq
+import io
+import json
+import operator
+import posixpath
+import queue
 import shlex
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import weakref
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
 
 # In the HTCondor implementation, this quoting method is used
 def quote(chirp_string):
     """
     Prepares a string to be used in a Chirp simple command
 
-    :param chirp_string: the string to prepare
-    :returns: escaped string
+    :param chirp_string: the string to prepare
+    :returns: escaped string
+
+    """
+
+    # '\\', ' ', '\n', '\t', '\r' must be escaped
+    escape_chars = ["\\", " ", "\n", "\t", "\r"]
+    escape_re = "(" + "|".join([re.escape(x) for x in escape_chars]) + ")"
+    escape = re.compile(escape_re)
+
+    # prepend escaped characters with \\
+    replace = lambda matchobj: "\\" + matchobj.group(0)
+    return escape.sub(replace, chirp_string)
+
+
+def _env_option(value, name, default):
+    """Get an option from an argument, an environment variable or a default
+
+    :param value: Value passed as an argument, used unless it is None
+    :param name: Name of an environment variable holding an integer
+    :param default: Value used if neither is set
+    :returns: The option value
+
+    """
+
+    if value is not None:
+        return value
+    env = os.environ.get(name, "").strip()
+    if env:
+        try:
+            return int(env)
+        except ValueError:
+            raise ValueError("${0} must be an integer, not '{1}'".format(name, env))
+    return default
+
+
+# Helper recursive function to print output like condor_chirp
+def _condor_chirp_print(data, indent=0):
+    nested = (list, dict)
+    if data is None:
+        return
+    elif isinstance(data, list):
+        for d in data:
+            if isinstance(d, nested):
+                _condor_chirp_print(d, indent + 1)
+            else:
+                print(indent * "\t" + str(d))
+    elif isinstance(data, dict):
+        for key, value in data.items():
+            if isinstance(value, nested):
+                print(indent * "\t" + str(key))
+                _condor_chirp_print(value, indent + 1)
+            else:
+                if key in ["atime", "mtime", "ctime"]:
+                    value = datetime.fromtimestamp(int(value)).ctime()
+                print(indent * "\t" + "{0}: {1}".format(str(key), str(value)))
+    else:
+        print(indent * "\t" + str(data))
+
+
+class _StatFields(dict):
+    """Dict of the fields of a stat result, also available as attributes
+
+    Stays compatible with the dicts that stat(), lstat(), statfs() and
+    getlongdir() returned before, while also allowing ``stats.size``. For
+    huge directories, see getlongdir(columnar=True).
+    """
+
+    __slots__ = ()
+    _fields = ()  # field names, in the order sent by the Chirp server
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(
+                "'{0}' object has no attribute '{1}'".format(
+                    self.__class__.__name__, name
+                )
+            )
+
+    def __repr__(self):
+        return "{0}({1})".format(
+            self.__class__.__name__,
+            ", ".join("{0}={1!r}".format(key, value) for (key, value) in self.items()),
+        )
+
+    @classmethod
+    def _make(cls, values):
+        """Make a result from the values of _fields, in order"""
+        return cls(zip(cls._fields, values))
+
+    @classmethod
+    def from_line(cls, line):
+        """Parse a line of integers sent by the Chirp server"""
+        return cls._make(int(x) for x in line.split())
+
+
+class ChirpStat(_StatFields):
+    """File metadata from stat(), lstat() and getlongdir()
+
+    Fields are available by the Chirp names (``stats["size"]``,
+    ``stats.size``) and by the names used by os.stat_result
+    (``stats.st_size``).
+    """
+
+    __slots__ = ()
+    _fields = (
+        "device",
+        "inode",
+        "mode",
+        "nlink",
+        "uid",
+        "gid",
+        "rdevice",
+        "size",
+        "blksize",
+        "blocks",
+        "atime",
+        "mtime",
+        "ctime",
+    )
+
+    st_dev = property(operator.itemgetter("device"))
+    st_ino = property(operator.itemgetter("inode"))
+    st_mode = property(operator.itemgetter("mode"))
+    st_nlink = property(operator.itemgetter("nlink"))
+    st_uid = property(operator.itemgetter("uid"))
+    st_gid = property(operator.itemgetter("gid"))
+    st_rdev = property(operator.itemgetter("rdevice"))
+    st_size = property(operator.itemgetter("size"))
+    st_blksize = property(operator.itemgetter("blksize"))
+    st_blocks = property(operator.itemgetter("blocks"))
+    st_atime = property(operator.itemgetter("atime"))
+    st_mtime = property(operator.itemgetter("mtime"))
+    st_ctime = property(operator.itemgetter("ctime"))
+
+
+class ChirpStatFS(_StatFields):
+    """File system metadata from statfs()
+
+    Fields are available by the Chirp names (``stats["f_bavail"]``,
+    ``stats.f_bavail``), f_ffree is an alias of f_free as used by
+    os.statvfs_result.
+    """
+
+    __slots__ = ()
+    _fields = (
+        "f_type",
+        "f_bsize",
+        "f_blocks",
+        "f_bfree",
+        "f_bavail",
+        "f_files",
+        "f_free",
+    )
+
+    f_ffree = property(operator.itemgetter("f_free"))
+
+
+class ChirpDirEntry(object):
+    """Directory entry from scandir(), similar to os.DirEntry
+
+    The metadata comes with the directory listing, so the methods do not
+    send any commands to the Chirp server.
+    """
+
+    __slots__ = ("name", "path", "_stat")
+
+    def __init__(self, directory, name, stats):
+        self.name = name
+        self.path = posixpath.join(directory, name)
+        self._stat = stats
+
+    def __repr__(self):
+        return "<{0} {1!r}>".format(self.__class__.__name__, self.name)
+
+    def __fspath__(self):
+        return self.path
+
+    def inode(self):
+        return self._stat.inode
+
+    def is_dir(self, follow_symlinks=True):
+        return stat.S_ISDIR(self._stat.mode)
+
+    def is_file(self, follow_symlinks=True):
+        return stat.S_ISREG(self._stat.mode)
+
+    def is_symlink(self):
+        return stat.S_ISLNK(self._stat.mode)
+
+    def stat(self, follow_symlinks=True):
+        return self._stat
+
+
+class ChirpDirColumns(object):
+    """Columnar directory listing from getlongdir(columnar=True)
+
+    Holds the entry names in a list and each ChirpStat field in an
+    array('q') column, e.g. ``listing.size[i]`` is the size of
+    ``listing.names[i]``. This takes a fraction of the memory of a dict of
+    ChirpStat for large directories.
+    """
+
+    def __init__(self):
+        self.names = []
+        for field in ChirpStat._fields:
+            setattr(self, field, array("q"))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        """Iterate over (name, ChirpStat) tuples"""
+        for i in range(len(self.names)):
+            yield (self.names[i], self.stat(i))
+
+    def __repr__(self):
+        return "{0}({1} entries)".format(self.__class__.__name__, len(self))
+
+    def append(self, name, line):
+        """Add an entry from a name and a line of stat integers"""
+
+        self.names.append(name)
+        for (field, value) in zip(ChirpStat._fields, line.split()):
+            getattr(self, field).append(int(value))
+
+    def stat(self, i):
+        """Get the ChirpStat of the i-th entry"""
+        return ChirpStat._make(getattr(self, field)[i] for field in ChirpStat._fields)
+
+    def to_numpy(self):
+        """Get the stat columns as NumPy arrays (without copying them)
+
+        :returns: Dict of field names and int64 arrays
+        :raises ImportError: If NumPy is not installed
+
+        """
+
+        if numpy is None:
+            raise ImportError("NumPy is required for to_numpy()")
+        return dict(
+            (field, numpy.frombuffer(getattr(self, field), dtype=numpy.int64))
+            for field in ChirpStat._fields
+        )
+
+
+# Helper function to find the parts of a (sparse) local file that hold data
+def _data_extents(path, length):
+    """List the byte ranges of a local file that contain data
+
+    Holes are found with SEEK_DATA/SEEK_HOLE. If those are not supported by
+    the platform or file system, the whole file is a single extent.
+
+    :param path: Path to local file
+    :param length: Size of the file
+    :returns: List of (start, end) tuples
+
+    """
+
+    if not (hasattr(os, "SEEK_DATA") and hasattr(os, "SEEK_HOLE")):
+        return [(0, length)] if length > 0 else []
+
+    extents = []
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        pos = 0
+        while pos < length:
+            try:
+                start = os.lseek(fd, pos, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:  # no more data past pos
+                    break
+                raise
+            end = min(os.lseek(fd, start, os.SEEK_HOLE), length)
+            if start >= end:
+                break
+            extents.append((start, end))
+            pos = end
+    except OSError:
+        return [(0, length)] if length > 0 else []
+    finally:
+        os.close(fd)
+
+    return extents
+
+
+# Helper function to place a local copy of a file as cheaply as possible
+def _link_or_copy(src, dst, link=True):
+    """Hard link src to dst, or copy it if linking is not possible
+
+    :param src: Path to existing file
+    :param dst: Path to new file, replaced if it exists
+    :param link: If False, always copy
+
+    """
+
+    if link:
+        try:
+            if os.path.lexists(dst):
+                os.unlink(dst)
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+class _SparseWriter(object):
+    """File-like sink that seeks over blocks of zeros instead of writing them
+
+    Call finish() after the last write to set the final size of the file.
+    """
+
+    BLOCK_SIZE = 4096
+    ZEROS = bytes(bytearray(BLOCK_SIZE))
+
+    def __init__(self, fobj):
+        self.fobj = fobj
+        self.offset = fobj.tell()
+        self.skipped = False  # if the last block was skipped
+
+    def write(self, data):
+        view = memoryview(data)
+        pos = 0
+        while pos < len(view):
+            # find a run of blocks, aligned to the position in the file, that
+            # are either all zeros or all data
+            start = pos
+            zeros = None
+            while pos < len(view):
+                n = min(
+                    self.BLOCK_SIZE - (self.offset + pos) % self.BLOCK_SIZE,
+                    len(view) - pos,
+                )
+                is_zero = bytes(view[pos : pos + n]) == self.ZEROS[:n]
+                if zeros is None:
+                    zeros = is_zero
+                elif zeros != is_zero:
+                    break
+                pos += n
+            if zeros:
+                self.fobj.seek(pos - start, os.SEEK_CUR)
+            else:
+                self.fobj.write(view[start:pos])
+            self.skipped = zeros
+        self.offset += len(view)
+        return len(view)
+
+    def finish(self):
+        if self.skipped:
+            # not every file object can be extended with truncate()
+            self.fobj.seek(self.offset - 1)
+            self.fobj.write(b"\0")
+        self.fobj.truncate(self.offset)
+
+
+# Streaming compression, for put(), write() and fetch()
+
+COMPRESSION_METHODS = ["gzip", "zlib", "zstd", "lz4"]
+
+
+class _LZ4Compressor(object):
+    """lz4.frame compressor with the interface of zlib compressors"""
+
+    def __init__(self, level=None):
+        self.compressor = lz4.frame.LZ4FrameCompressor(compression_level=level or 0)
+        self.header = self.compressor.begin()
+
+    def compress(self, data):
+        (data, self.header) = (self.header + self.compressor.compress(data), b"")
+        return data
+
+    def flush(self):
+        (data, self.header) = (self.header + self.compressor.flush(), b"")
+        return data
+
+
+def _compressor(method, level=None):
+    """Get a streaming compressor with compress() and flush() methods
+
+    :param method: One of COMPRESSION_METHODS, 'zstd' needs the zstandard
+        package and 'lz4' needs the lz4 package
+    :param level: Compression level [default: the method's default]
+    :returns: A compressor object
+
+    """
+
+    if method in ("gzip", "zlib"):
+        wbits = 31 if method == "gzip" else 15
+        if level is None:
+            level = zlib.Z_DEFAULT_COMPRESSION
+        return zlib.compressobj(level, zlib.DEFLATED, wbits)
+    elif (method == "zstd") and (zstandard is not None):
+        return zstandard.ZstdCompressor(
+            level=3 if level is None else level
+        ).compressobj()
+    elif (method == "lz4") and (lz4 is not None):
+        return _LZ4Compressor(level)
+    elif method in COMPRESSION_METHODS:
+        raise ValueError("Compression method '{0}' is not installed".format(method))
+    raise ValueError(
+        "Unknown compression method '{0}', not in {1}".format(
+            method, COMPRESSION_METHODS
+        )
+    )
+
+
+class _ZstdDecompressor(object):
+    """Streaming zstd decompressor that hands its output to sink in chunks
+
+    zstandard's decompressobj() returns all the output of each input at
+    once, which has no bound for highly compressible data, so a stream_writer
+    is used instead. It decompresses concatenated frames by itself, and the
+    frame boundaries are tracked here to tell if the data ended early.
+    """
+
+    def __init__(self, sink, chunk_size):
+        """
+        :param sink: Callable that accepts each chunk of decompressed data
+        :param chunk_size: Maximum size of each chunk
+        """
+
+        self.sink = sink
+        self.stream = zstandard.ZstdDecompressor().stream_writer(
+            self, write_size=chunk_size, closefd=False
+        )
+        self.step = "magic"  # next part of the frame format to parse
+        self.need = 4  # bytes needed to parse it
+        self.pending = bytearray()
+        self.skip = 0  # bytes of block contents to skip
+        self.checksum = False
+
+    @property
+    def eof(self):
+        """If the data so far ends with a complete frame"""
+        return (self.step == "magic") and not (self.pending or self.skip)
+
+    def write(self, data):
+        """Receive decompressed data from the stream_writer"""
+        self.sink(bytes(data))
+        return len(data)
+
+    def decompress(self, data):
+        """Decompress data, passing the output to sink"""
+        self._track(data)
+        self.stream.write(data)
+
+    def _track(self, data):
+        """Follow the frame headers and block headers of the data"""
+
+        pos = 0
+        while (pos < len(data)) and (self.step is not None):
+            if self.skip:
+                skipped = min(self.skip, len(data) - pos)
+                self.skip -= skipped
+                pos += skipped
+                continue
+            wanted = min(self.need - len(self.pending), len(data) - pos)
+            self.pending += data[pos : pos + wanted]
+            pos += wanted
+            if len(self.pending) == self.need:
+                header = bytes(self.pending)
+                del self.pending[:]
+                self._parse(header)
+
+    def _parse(self, header):
+        """Parse a complete part of the frame format (see RFC 8878)"""
+
+        value = int.from_bytes(header, "little")
+        (step, self.need) = (self.step, 4)
+        if step == "magic":
+            if value == 0xFD2FB528:
+                (self.step, self.need) = ("descriptor", 1)
+            elif (value & 0xFFFFFFF0) == 0x184D2A50:
+                self.step = "skippable"
+            else:
+                self.step = None  # not zstd, the stream_writer raises
+        elif step == "skippable":
+            (self.step, self.skip) = ("magic", value)
+        elif step == "descriptor":
+            single_segment = (value >> 5) & 1
+            self.checksum = bool((value >> 2) & 1)
+            size = (
+                (1 - single_segment)  # window descriptor
+                + (0, 1, 2, 4)[value & 3]  # dictionary id
+                + (single_segment, 2, 4, 8)[value >> 6]  # frame content size
+            )
+            (self.step, self.need) = ("header", size) if size else ("block", 3)
+        elif step == "header":
+            (self.step, self.need) = ("block", 3)
+        elif step == "block":
+            block_type = (value >> 1) & 3
+            self.skip = 1 if block_type == 1 else value >> 3  # RLE: one byte
+            if not value & 1:  # not the last block
+                self.need = 3
+            elif self.checksum:
+                self.step = "checksum"
+            else:
+                self.step = "magic"
+        elif step == "checksum":
+            self.step = "magic"
+
+
+def _decompressor(method, sink, chunk_size):
+    """Get a streaming decompressor for one gzip member or lz4 frame
+
+    zstd decompressors (see _ZstdDecompressor) pass their output to sink
+    instead of returning it, and decompress concatenated frames.
+    """
+
+    if method in ("gzip", "zlib"):
+        return zlib.decompressobj(31 if method == "gzip" else 15)
+    elif (method == "zstd") and (zstandard is not None):
+        return _ZstdDecompressor(sink, chunk_size)
+    elif (method == "lz4") and (lz4 is not None):
+        return lz4.frame.LZ4FrameDecompressor()
+    _compressor(method)  # raise the same errors as for compression
+
+
+def _detect_compression(header):
+    """Guess the compression method from the first four bytes of a file
+
+    :returns: A method in COMPRESSION_METHODS, or None if unknown
+
+    """
+
+    if header[:2] == b"\x1f\x8b":
+        return "gzip"
+    elif header[:4] == b"\x28\xb5\x2f\xfd":
+        return "zstd"
+    elif header[:4] == b"\x04\x22\x4d\x18":
+        return "lz4"
+    return None
+
+
+class _CompressingReader(object):
+    """Readable file-like object of the compressed contents of another one
+
+    Only about CHUNK_SIZE bytes of input are compressed at a time, so memory
+    use does not depend on the size of the input.
+    """
+
+    CHUNK_SIZE = 1048576
+
+    def __init__(self, rfd, method, level=None, length=None, meter=None):
+        """
+        :param rfd: Readable binary file object with the data to compress
+        :param method: Compression method (see _compressor())
+        :param level: Compression level
+        :param length: Compress at most this many bytes [default: until EOF]
+        :param meter: A _TransferMeter updated with the bytes read from rfd
+        """
+
+        self.rfd = rfd
+        self.compressor = _compressor(method, level)
+        self.length = length
+        self.meter = meter
+        self.buffer = bytearray()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.done = False
+
+    def read(self, size=-1):
+        while ((size is None) or (size < 0) or (len(self.buffer) < size)) and not (
+            self.done
+        ):
+            chunk_size = self.CHUNK_SIZE
+            if self.length is not None:
+                chunk_size = min(chunk_size, self.length - self.bytes_in)
+            data = self.rfd.read(chunk_size) if chunk_size > 0 else b""
+            if data:
+                self.bytes_in += len(data)
+                self.buffer += self.compressor.compress(data)
+                if self.meter is not None:
+                    self.meter.update(len(data))
+            else:
+                self.buffer += self.compressor.flush()
+                self.done = True
+                if self.meter is not None:
+                    self.meter.finish()
+
+        if (size is None) or (size < 0):
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.bytes_out += len(data)
+        return data
+
+
+class _DecompressingWriter(object):
+    """Writable file-like object that decompresses data into another one
+
+    The method is detected from the data unless given. Data in an unknown
+    format is passed through unchanged. Concatenated gzip members and
+    zstd/lz4 frames are decompressed one after another.
+    """
+
+    CHUNK_SIZE = 1048576
+
+    def __init__(self, output_file, method=None):
+        """
+        :param output_file: Path to a local file, a writable file-like
+            object, or a callable that accepts each chunk of data
+        :param method: Compression method [default: detect]
+        """
+
+        self.fd = None
+        if hasattr(output_file, "write"):
+            self.sink = output_file.write
+        elif callable(output_file):
+            self.sink = output_file
+        else:
+            self.fd = open(output_file, "wb")
+            self.sink = self.fd.write
+        self.method = method
+        self.decompressor = None
+        if method is not None:
+            self.decompressor = _decompressor(method, self._emit, self.CHUNK_SIZE)
+        self.header = b""
+        self.started = False  # if the current member got any data
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _emit(self, data):
+        if data:
+            self.sink(data)
+            self.bytes_out += len(data)
+
+    def write(self, data):
+        data = bytes(data)
+        size = len(data)
+        self.bytes_in += size
+
+        if (self.method is None) and (self.decompressor is None):
+            self.header += data
+            if len(self.header) < 4:
+                return size
+            self.method = _detect_compression(self.header) or False
+            if self.method:
+                self.decompressor = _decompressor(
+                    self.method, self._emit, self.CHUNK_SIZE
+                )
+            (data, self.header) = (self.header, b"")
+
+        if not self.method:
+            self._emit(data)  # not compressed
+            return size
+
+        # each step emits at most CHUNK_SIZE bytes
+        while data:
+            decompressor = self.decompressor
+            self.started = True
+            if self.method == "zstd":  # emits by itself, and reads all frames
+                decompressor.decompress(data)
+                break
+            elif self.method == "lz4":
+                self._emit(decompressor.decompress(data, max_length=self.CHUNK_SIZE))
+                while not (decompressor.eof or decompressor.needs_input):
+                    self._emit(decompressor.decompress(b"", max_length=self.CHUNK_SIZE))
+                data = b""
+            else:
+                self._emit(decompressor.decompress(data, self.CHUNK_SIZE))
+                data = decompressor.unconsumed_tail
+            if decompressor.eof:
+                # start over on the next member or frame (for zlib, the
+                # unconsumed_tail is then also part of unused_data)
+                data = decompressor.unused_data or b""
+                self.decompressor = _decompressor(
+                    self.method, self._emit, self.CHUNK_SIZE
+                )
+                self.started = False
+        return size
+
+    def finish(self):
+        """Write out the rest of the data
+
+        :raises RuntimeWarning: If the compressed data ended early
+
+        """
+
+        if self.header:  # too short to detect, pass through
+            self._emit(self.header)
+            self.header = b""
+        if self.started:
+            if hasattr(self.decompressor, "flush"):
+                self._emit(self.decompressor.flush())
+            if not getattr(self.decompressor, "eof", True):
+                raise RuntimeWarning(
+                    "The {0} data ended early, only {1} B were received".format(
+                        self.method, self.bytes_in
+                    )
+                )
+
+    def close(self):
+        if self.fd is not None:
+            self.fd.close()
+
+
+class _ChunkReader(object):
+    """Readable file-like object of an iterator of chunks of data
+
+    Used to hand data streamed from the server to readers such as tarfile,
+    optionally decompressing it first (see _DecompressingWriter).
+    """
+
+    def __init__(self, chunks, decompress=False):
+        self.chunks = iter(chunks)
+        self.buffer = bytearray()
+        self.writer = None
+        if decompress:
+            self.writer = _DecompressingWriter(
+                self.buffer.extend, None if decompress is True else decompress
+            )
+
+    def read(self, size=-1):
+        while ((size is None) or (size < 0) or (len(self.buffer) < size)) and (
+            self.chunks is not None
+        ):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.chunks = None
+                if self.writer is not None:
+                    self.writer.finish()
+            elif self.writer is not None:
+                self.writer.write(chunk)
+            else:
+                self.buffer += chunk
+
+        if (size is None) or (size < 0):
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def drain(self):
+        """Skip the rest of the data, e.g. the padding after a tar archive"""
+
+        if self.chunks is not None:
+            for chunk in self.chunks:
+                pass
+            self.chunks = None
+        del self.buffer[:]
+
+    def close(self):
+        """Stop reading, abandoning the rest of the data
+
+        Closing an unfinished iter_file() stream resets its connection.
+        """
+
+        if self.chunks is not None:
+            if hasattr(self.chunks, "close"):
+                self.chunks.close()
+            self.chunks = None
+        del self.buffer[:]
+
+
+class _RemoteFileWriter(object):
+    """Writable file-like object that streams to an open remote file
+
+    Data is optionally compressed, and sent in writes of chirp.chunk_size
+    bytes, so streams of unknown length (e.g. from tarfile) can be sent
+    without staging them on disk.
+    """
+
+    def __init__(self, chirp, fd, compress=None, compress_level=None, meter=None):
+        """
+        :param chirp: Connected HTChirp client
+        :param fd: Remote file descriptor opened for writing
+        :param compress: Compression method (see _compressor())
+        :param compress_level: Compression level
+        :param meter: A _TransferMeter updated with the bytes sent
+        """
+
+        self.chirp = chirp
+        self.fd = fd
+        self.compressor = None
+        if compress:
+            self.compressor = _compressor(compress, compress_level)
+        self.meter = meter
+        self.buffer = bytearray()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _send(self, final=False):
+        chunk_size = self.chirp.chunk_size
+        while (len(self.buffer) >= chunk_size) or (final and self.buffer):
+            data = bytes(self.buffer[:chunk_size])
+            del self.buffer[:chunk_size]
+            wb = self.chirp._write(self.fd, data, len(data))
+            if wb < len(data):
+                raise UserWarning(
+                    "Only {0} bytes of {1} bytes were written".format(wb, len(data))
+                )
+            self.bytes_out += wb
+            if self.meter is not None:
+                self.meter.update(wb)
+
+    def write(self, data):
+        size = len(data)
+        self.bytes_in += size
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.buffer += data
+        self._send()
+        return size
+
+    def close(self):
+        """Send the rest of the data"""
+
+        if self.compressor is not None:
+            self.buffer += self.compressor.flush()
+            self.compressor = None
+        self._send(final=True)
+        if self.meter is not None:
+            self.meter.finish()
+
+
+class ChirpRateLimiter(object):
+    """Token bucket that limits the rate of bulk transfers
+
+    Each byte sent or received takes one token. Tokens are added at rate
+    bytes per second, up to burst tokens. A transfer that runs out of tokens
+    sleeps until the bucket has refilled.
+
+    A limiter may be shared by several HTChirp clients (and threads) to cap
+    their combined rate, pass it to each as ``HTChirp(rate_limit=limiter)``.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: Maximum average rate, in bytes per second
+        :param burst: Maximum number of bytes that may be transferred at once
+            without waiting [default: rate/10, at least 64 KiB]
+        """
+
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if burst is None:
+            burst = max(65536, rate / 10.0)
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "{0}({1}, {2})".format(self.__class__.__name__, self.rate, self.burst)
+
+    def consume(self, n):
+        """Take n tokens, sleeping until the bucket has caught up
+
+        Tokens may be taken before they are available, later transfers wait
+        for the debt to be paid off, so chunks larger than burst are allowed.
+
+        :param n: Number of bytes transferred
+        :returns: Time slept, in seconds
+
+        """
+
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            delay = -self.tokens / self.rate
+        if delay > 0:
+            time.sleep(delay)
+            return delay
+        return 0.0
+
+
+class ChirpConcurrency(object):
+    """Adaptive limits on parallel transfers and pipelined commands
+
+    Tasks that copytree(), walk() and prefetch() run in parallel each take a
+    worker slot, and pipelined commands (e.g. stat_many()) are sent in
+    windows. Both limits are adjusted by additive increase, multiplicative
+    decrease (AIMD): every `interval` seconds of activity, a limit grows by
+    one step if throughput improved, steps back if throughput fell after it
+    grew, and is cut by `backoff` at once when the server is overloaded
+    (TryAgain, Busy or TooManyOpen errors).
+
+    Throughput is measured in bytes per second when parallel tasks report
+    the bytes they moved (see transferred()), and in operations (tasks or
+    commands) per second otherwise. The last decisions, with the rate and
+    its unit, are kept in `decisions` and reported by stats(). A controller
+    may be shared by several clients, pass it to each as
+    ``HTChirp(concurrency=controller)``.
+    """
+
+    TOLERANCE = 0.05  # relative change in throughput that counts as a change
+
+    def __init__(
+        self,
+        max_workers=8,
+        max_window=256,
+        min_workers=1,
+        min_window=8,
+        interval=1.0,
+        backoff=0.5,
+        retries=3,
+    ):
+        """
+        :param max_workers: Maximum number of tasks run at once
+        :param max_window: Maximum number of pipelined commands
+        :param min_workers: Minimum number of tasks run at once
+        :param min_window: Minimum number of pipelined commands, and the step
+            by which the window grows and shrinks
+        :param interval: Seconds of activity between adjustments
+        :param backoff: Factor applied to a limit when the server is
+            overloaded
+        :param retries: Number of times a task or pipelined command that
+            the overloaded server refused is tried again
+        """
+
+        if not (1 <= min_workers <= max_workers and 1 <= min_window <= max_window):
+            raise ValueError("Minimum limits must be between 1 and the maximum")
+        self.min_workers = int(min_workers)
+        self.max_workers = int(max_workers)
+        self.min_window = int(min_window)
+        self.max_window = int(max_window)
+        self.interval = float(interval)
+        self.backoff = float(backoff)
+        self.retries = int(retries)
+
+        # start from the usual fixed limits
+        self.workers = max(self.min_workers, min(4, self.max_workers))
+        self.window = max(self.min_window, min(64, self.max_window))
+
+        self.decisions = deque(maxlen=100)
+        self.overloads = 0
+        self._cond = threading.Condition()
+        self._active = 0
+        self._busy_since = 0.0  # when the running tasks started
+        self._meters = {}
+        for limit in ("workers", "window"):
+            self._meters[limit] = {
+                "busy": 0.0,  # seconds of activity measured, not idle time
+                "amount": 0,  # bytes moved in that time
+                "count": 0,  # tasks (or commands) done in that time
+                # throughput of the previous measurement, per unit
+                "rates": {"bytes": None, "operations": None},
+                "step": 0,  # last adjustment
+                "cut": 0.0,  # time of the last cut
+            }
+
+    def __repr__(self):
+        return "{0}(workers={1}, window={2})".format(
+            self.__class__.__name__, self.workers, self.window
+        )
+
+    def __getstate__(self):
+        return dict(
+            (name, getattr(self, name))
+            for name in (
+                "max_workers",
+                "max_window",
+                "min_workers",
+                "min_window",
+                "interval",
+                "backoff",
+                "retries",
+            )
+        )
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @contextmanager
+    def task(self):
+        """Run a task in a worker slot, waiting until a slot is free
+
+        Errors raised by the task are recorded, see done().
+
+        """
+
+        with self._cond:
+            while self._active >= self.workers:
+                self._cond.wait()
+            if self._active == 0:
+                self._busy_since = time.time()
+            self._active += 1
+        try:
+            yield
+        except Exception as e:
+            self.done(error=e)
+            raise
+        else:
+            self.done()
+        finally:
+            with self._cond:
+                self._active -= 1
+                if self._active == 0:
+                    self._meters["workers"]["busy"] += time.time() - self._busy_since
+                self._cond.notify_all()
+
+    def run(self, function, *args):
+        """Run function(*args) in a worker slot (see task())
+
+        If the server is overloaded, the call is tried again after the limit
+        was cut, up to `retries` times, so function must be safe to repeat.
+
+        :returns: The result of function
+
+        """
+
+        attempt = 0
+        while True:
+            try:
+                with self.task():
+                    return function(*args)
+            except Exception as e:
+                if (attempt >= self.retries) or not self._overloaded([e]):
+                    raise
+                attempt += 1
+                time.sleep(min(self.interval, 0.05 * 2**attempt))
+
+    def transferred(self, nbytes):
+        """Record bytes moved by parallel tasks
+
+        The byte rate and the rate of completed tasks are measured
+        separately. While bytes are recorded, the worker limit compares byte
+        rates, otherwise it compares task rates, never one with the other.
+
+        """
+
+        with self._cond:
+            self._observe("workers", nbytes, 0)
+
+    def done(self, error=None):
+        """Record a completed (or failed) parallel task"""
+
+        with self._cond:
+            if self._overloaded([error]):
+                self._cut("workers")
+            elif error is None:
+                self._observe("workers", 0, 1)
+
+    def pipelined(self, results, seconds):
+        """Record the results of a window of pipelined commands
+
+        :param results: List of results or ChirpErrors, one per command
+        :param seconds: Time taken to send the window and read the results
+
+        """
+
+        with self._cond:
+            if self._overloaded(results):
+                self._cut("window")
+            else:
+                self._observe("window", 0, len(results), seconds)
+
+    @staticmethod
+    def _overloaded(errors):
+        overload = (HTChirp.TryAgain, HTChirp.Busy, HTChirp.TooManyOpen)
+        return any(isinstance(error, overload) for error in errors)
+
+    def _cut(self, limit):
+        now = time.time()
+        meter = self._meters[limit]
+        self.overloads += 1
+        if now - meter["cut"] < self.interval:
+            return  # already cut for this overload
+        meter.update(cut=now, rates={"bytes": None, "operations": None}, step=0)
+        self._restart(limit, now)
+        value = max(self._bounds(limit)[0], int(getattr(self, limit) * self.backoff))
+        self._decide(limit, value, "overloaded", None)
+
+    def _restart(self, limit, now):
+        """Start a new throughput measurement"""
+        self._meters[limit].update(busy=0.0, amount=0, count=0)
+        if limit == "workers":
+            self._busy_since = now
+
+    def _observe(self, limit, amount, count, seconds=0.0):
+        now = time.time()
+        meter = self._meters[limit]
+        meter["amount"] += amount
+        meter["count"] += count
+        meter["busy"] += seconds
+        elapsed = meter["busy"]
+        if (limit == "workers") and self._active:
+            elapsed += now - self._busy_since
+        if elapsed < self.interval:
+            return
+
+        rates = {
+            "bytes": (meter["amount"] / elapsed) if meter["amount"] else None,
+            "operations": meter["count"] / elapsed,
+        }
+        unit = "bytes" if rates["bytes"] is not None else "operations"
+        rate = rates[unit]
+        previous = meter["rates"][unit]
+        measured = any(r is not None for r in meter["rates"].values())
+        meter["rates"] = rates
+        self._restart(limit, now)
+        if (previous is None) and measured:
+            (step, reason) = (0, "throughput unit changed")
+        elif (previous is None) or (rate > previous * (1 + self.TOLERANCE)):
+            (step, reason) = (1, "throughput increased")
+        elif (rate < previous * (1 - self.TOLERANCE)) and (meter["step"] > 0):
+            (step, reason) = (-1, "throughput decreased")
+        else:
+            (step, reason) = (0, "throughput unchanged")
+        meter["step"] = step
+
+        (minimum, maximum, size) = self._bounds(limit)
+        value = min(maximum, max(minimum, getattr(self, limit) + step * size))
+        self._decide(limit, value, reason, rate, unit)
+
+    def _bounds(self, limit):
+        if limit == "workers":
+            return (self.min_workers, self.max_workers, 1)
+        return (self.min_window, self.max_window, self.min_window)
+
+    def _decide(self, limit, value, reason, rate, unit=None):
+        self.decisions.append(
+            {
+                "time": time.time(),
+                "limit": limit,
+                "from": getattr(self, limit),
+                "to": value,
+                "reason": reason,
+                "rate": rate,
+                "unit": unit,
+            }
+        )
+        setattr(self, limit, value)
+        self._cond.notify_all()
+
+    def stats(self):
+        """Get the current limits and the last decisions
+
+        :returns: Dict of controller statistics
+
+        """
+
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "window": self.window,
+                "active": self._active,
+                "overloads": self.overloads,
+                "decisions": list(self.decisions),
+            }
+
+
+class _TransferMeter(object):
+    """Throttle a transfer and report its progress
+
+    progress is called as progress(bytes_done, total, rate) at most every
+    INTERVAL seconds and once more when the transfer is done, where rate is
+    the transfer rate (bytes per second) since the previous call.
+    """
+
+    INTERVAL = 0.1
+
+    def __init__(self, total, limiters=(), progress=None):
+        self.total = total
+        self.limiters = [limiter for limiter in limiters if limiter is not None]
+        self.progress = progress
+        self.bytes_done = 0
+        self.last_time = time.time()
+        self.last_bytes = 0
+        self.reported = False
+
+    def update(self, n):
+        for limiter in self.limiters:
+            limiter.consume(n)
+        self.bytes_done += n
+        if self.progress is None:
+            return
+        done = (self.total is not None) and (self.bytes_done >= self.total)
+        if done or (time.time() - self.last_time >= self.INTERVAL):
+            self._report()
+
+    def finish(self):
+        """Report the final progress, if it has not been reported yet"""
+        if (self.progress is not None) and (
+            (self.bytes_done != self.last_bytes) or not self.reported
+        ):
+            self._report()
+
+    def _report(self):
+        now = time.time()
+        elapsed = now - self.last_time
+        if elapsed > 0:
+            rate = (self.bytes_done - self.last_bytes) / elapsed
+        else:
+            rate = 0.0
+        self.last_time = now
+        self.last_bytes = self.bytes_done
+        self.reported = True
+        self.progress(self.bytes_done, self.total, rate)
+
+
+class ChirpBlockCache(object):
+    """Client-side cache of remote file blocks
+
+    Remote files are cached in fixed-size blocks aligned to multiples of
+    block_size. Blocks are keyed by the remote path and the size and mtime of
+    the file, so blocks of a file that changed on the remote machine are no
+    longer used. The least recently used blocks are evicted once the cache
+    holds more than max_size bytes.
+
+    A cache may be shared by several HTChirp clients (and threads), pass it
+    to each as ``HTChirp(block_cache=cache)``.
+    """
+
+    def __init__(self, max_size=67108864, block_size=65536, validate_interval=0):
+        """
+        :param max_size: Maximum number of bytes to cache
+        :param block_size: Size of each cached block, in bytes
+        :param validate_interval: Seconds to trust the size and mtime of a
+            remote file before checking them again with stat [default: 0,
+            check on every read]
+        """
+
+        self.max_size = int(max_size)
+        self.block_size = int(block_size)
+        self.validate_interval = validate_interval
+
+        self._lock = threading.Lock()
+        self._blocks = OrderedDict()  # (path, size, mtime, generation, index)
+        self._versions = {}  # path: (size, mtime, generation, time checked)
+        self._generations = {}  # path: times invalidated by a client
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.validations = 0
+
+    def __repr__(self):
+        return "{0}({1} of {2} bytes, {3:.1%} hit rate)".format(
+            self.__class__.__name__, self.size, self.max_size, self.hit_rate
+        )
+
+    @property
+    def hit_rate(self):
+        """Fraction of block lookups that were served from the cache"""
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        """Get the cache statistics
+
+        :returns: Dict of cache statistics
+
+        """
+
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate,
+                "evictions": self.evictions,
+                "validations": self.validations,
+                "blocks": len(self._blocks),
+                "size": self.size,
+                "max_size": self.max_size,
+            }
+
+    def version(self, remote_path):
+        """Get the trusted (size, mtime, generation) of a remote file
+
+        :param remote_path: Path to file
+        :returns: Version tuple, or None if it needs to be checked again
+
+        """
+
+        with self._lock:
+            version = self._versions.get(remote_path)
+            if version is None:
+                return None
+            if time.time() - version[3] >= self.validate_interval:
+                return None
+            return version[:3]
+
+    def validate(self, remote_path, size, mtime):
+        """Record the size and mtime of a remote file from a fresh stat
+
+        :param remote_path: Path to file
+        :param size: Size of file
+        :param mtime: Modification time of file
+        :returns: Version tuple of the file
+
+        """
+
+        with self._lock:
+            self.validations += 1
+            generation = self._generations.get(remote_path, 0)
+            self._versions[remote_path] = (size, mtime, generation, time.time())
+            return (size, mtime, generation)
+
+    def invalidate(self, remote_path=None):
+        """Stop using cached blocks of a remote file
+
+        Clients call this when they change a file themselves, in case its size
+        and mtime did not change.
+
+        :param remote_path: Path to file [default: invalidate all files]
+
+        """
+
+        with self._lock:
+            if remote_path is None:
+                self._blocks.clear()
+                self._versions.clear()
+                self.size = 0
+            else:
+                self._versions.pop(remote_path, None)
+                self._generations[remote_path] = (
+                    self._generations.get(remote_path, 0) + 1
+                )
+
+    def get(self, remote_path, version, index):
+        """Look up a block
+
+        :param remote_path: Path to file
+        :param version: Version tuple of the file
+        :param index: Block number
+        :returns: Block data, or None if the block is not cached
+
+        """
+
+        key = (remote_path,) + tuple(version) + (index,)
+        with self._lock:
+            data = self._blocks.get(key)
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._blocks.move_to_end(key)
+            return data
+
+    def put(self, remote_path, version, index, data):
+        """Store a block
 
+        :param remote_path: Path to file
+        :param version: Version tuple of the file
+        :param index: Block number
+        :param data: Block data
+
+        """
+
+        if len(data) > self.max_size:
+            return
+
+        key = (remote_path,) + tuple(version) + (index,)
+        with self._lock:
+            old = self._blocks.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._blocks[key] = data
+            self.size += len(data)
+            while self.size > self.max_size:
+                (_, old) = self._blocks.popitem(last=False)
+                self.size -= len(old)
+                self.evictions += 1
+
+
+class ChirpFileCache(object):
+    """Node-local on-disk cache of remote files for fetch()
+
+    Files are cached in directory, keyed by their remote path and their
+    size, mtime, device and inode from stat, so each fetch costs one stat
+    when the file is already cached. Concurrent fetches of the same file
+    (e.g. by other jobs on the same machine using the same directory) wait
+    for a single download, and downloads are published atomically. Once the
+    cache holds more than max_size bytes, the least recently used files that
+    are not being fetched are removed together with their lock files, along
+    with partial downloads and lock files left behind by processes that died.
+
+    Cached files are read-only and, when link is True, are hard linked into
+    place, so fetched files should not be modified in place.
     """
 
-    # '\\', ' ', '\n', '\t', '\r' must be escaped
-    escape_chars = ["\\", " ", "\n", "\t", "\r"]
-    escape_re = "(" + "|".join([re.escape(x) for x in escape_chars]) + ")"
-    escape = re.compile(escape_re)
+    def __init__(self, directory, max_size=10737418240, link=True, tmp_max_age=3600):
+        """
+        :param directory: Path to cache directory, created if needed
+        :param max_size: Maximum number of bytes to cache
+        :param link: If True, hard link cached files into place instead of
+            copying them (falls back to copying)
+        :param tmp_max_age: Remove partial downloads that have not been
+            written to for this many seconds
+        """
 
-    # prepend escaped characters with \\
-    replace = lambda matchobj: "\\" + matchobj.group(0)
-    return escape.sub(replace, chirp_string)
+        self.directory = os.path.abspath(directory)
+        self.max_size = int(max_size)
+        self.link = link
+        self.tmp_max_age = tmp_max_age
 
+        self.hits = 0
+        self.misses = 0
 
-# Helper recursive function to print output like condor_chirp
-def _condor_chirp_print(data, indent=0):
-    if data is None:
-        return
-    elif isinstance(data, list):
-        for d in data:
-            if isinstance(d, (list, dict)):
-                _condor_chirp_print(d, indent + 1)
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+
+    def __repr__(self):
+        return "{0}({1})".format(self.__class__.__name__, self.directory)
+
+    def _key(self, remote_path, stats):
+        """Name of the cache entry for a remote file"""
+
+        ident = "{0}\0{1}\0{2}\0{3}\0{4}".format(
+            remote_path,
+            stats["size"],
+            stats["mtime"],
+            stats["device"],
+            stats["inode"],
+        )
+        return hashlib.sha256(ident.encode()).hexdigest()
+
+    def _lock(self, name, blocking=True, shared=False):
+        """Take a lock on a lock file in the cache directory
+
+        :param shared: If True, take a shared lock instead of an exclusive one
+        :returns: Open lock file (close it to release the lock), or None if
+            not blocking and the lock is held elsewhere
+
+        """
+
+        path = os.path.join(self.directory, name + ".lock")
+        while True:
+            lock = open(path, "a")
+            if fcntl is None:
+                return lock
+            flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock.fileno(), flags)
+            except (IOError, OSError):
+                lock.close()
+                if blocking:
+                    raise
+                return None
+            # evict() removes lock files while holding them, so the lock is
+            # only valid if the file is still the one at path
+            try:
+                if os.stat(path).st_ino == os.fstat(lock.fileno()).st_ino:
+                    return lock
+            except OSError:
+                pass
+            lock.close()
+
+    def entries(self):
+        """List the cached files
+
+        :returns: List of (path, size, last use time) tuples
+
+        """
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith(".") or name.endswith(".lock"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stats = os.stat(path)
+            except OSError:
+                continue  # evicted meanwhile
+            entries.append((path, stats.st_size, stats.st_mtime))
+        return entries
+
+    def evict(self, keep=None):
+        """Remove least recently used files until max_size is respected
+
+        :param keep: Path to a cache entry that must not be removed
+
+        """
+
+        lock = self._lock(".evict", blocking=False)
+        if lock is None:
+            return  # someone else is already evicting
+        try:
+            self._remove_stale_files()
+            entries = sorted(self.entries(), key=lambda entry: entry[2])
+            total = sum(entry[1] for entry in entries)
+            for (path, size, _) in entries:
+                if total <= self.max_size:
+                    break
+                if path == keep:
+                    continue
+                entry_lock = self._lock(os.path.basename(path), blocking=False)
+                if entry_lock is None:
+                    continue  # being fetched
+                try:
+                    os.unlink(path)
+                    os.unlink(entry_lock.name)
+                except OSError:
+                    continue
+                finally:
+                    entry_lock.close()
+                total -= size
+        finally:
+            lock.close()
+
+    def _remove_stale_files(self):
+        """Remove partial downloads that are no longer being written, and
+        unused lock files of entries that are not cached
+
+        """
+
+        cutoff = time.time() - self.tmp_max_age
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".tmp-"):
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.unlink(path)
+                except OSError:
+                    continue  # finished or removed meanwhile
+            elif name.endswith(".lock") and not name.startswith("."):
+                entry = path[: -len(".lock")]
+                if os.path.exists(entry):
+                    continue
+                entry_lock = self._lock(name[: -len(".lock")], blocking=False)
+                if entry_lock is None:
+                    continue  # being fetched
+                try:
+                    if not os.path.exists(entry):
+                        os.unlink(path)
+                except OSError:
+                    pass
+                finally:
+                    entry_lock.close()
+
+    def _use(self, entry, local_file):
+        """Link or copy a cache entry into place and mark it as recently used
+
+        :returns: False if the entry does not exist (e.g. it was evicted)
+
+        """
+
+        try:
+            os.utime(entry, None)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return False
+        try:
+            _link_or_copy(entry, local_file, self.link)
+        except (IOError, OSError) as e:
+            if (e.errno == errno.ENOENT) and not os.path.exists(entry):
+                return False
+            raise
+        return True
+
+    def fetch(self, chirp, remote_file, local_file, **kwargs):
+        """Copy a file from the submit machine through the cache.
+
+        Unlike chirp.getfile(), local_file is a hard link to the cache entry
+        when link is True, so it is read-only (mode 0444) and must be copied
+        before being modified. It is a writable copy when link is False or
+        linking fails (e.g. across filesystems), or when the remote file
+        changed during the transfer and was not cached.
+
+        :param chirp: Connected HTChirp client
+        :param remote_file: Path to file to be sent from the submit machine
+        :param local_file: Path to file to be written to on the execute machine
+        :param kwargs: Options for chirp.getfile() on a cache miss
+        :returns: Size of file
+
+        """
+
+        stats = chirp.stat(remote_file)
+        key = self._key(remote_file, stats)
+        entry = os.path.join(self.directory, key)
+
+        # entries are only evicted while nobody holds their lock
+        lock = self._lock(key, shared=True)
+        try:
+            if self._use(entry, local_file):
+                self.hits += 1
+                return stats["size"]
+        finally:
+            lock.close()
+
+        lock = self._lock(key)
+        try:
+            if self._use(entry, local_file):  # fetched while waiting for lock
+                self.hits += 1
+                return stats["size"]
+            self.misses += 1
+            (tmp_fd, tmp_file) = tempfile.mkstemp(prefix=".tmp-", dir=self.directory)
+            os.close(tmp_fd)
+            try:
+                length = chirp.getfile(remote_file, tmp_file, **kwargs)
+                if length != stats["size"]:
+                    # changed during the transfer, don't cache it
+                    shutil.move(tmp_file, local_file)
+                    return length
+                os.chmod(tmp_file, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                os.rename(tmp_file, entry)
+            finally:
+                if os.path.exists(tmp_file):
+                    os.unlink(tmp_file)
+            _link_or_copy(entry, local_file, self.link)
+        finally:
+            lock.close()
+        self.evict(keep=entry)
+
+        return stats["size"]
+
+
+class ChirpPrefetcher(object):
+    """Download a manifest of remote files in background threads
+
+    Files are downloaded in manifest order by worker threads, each with its
+    own connection to the Chirp server. Downloads only start while the total
+    size of the files being downloaded stays under max_inflight bytes (a file
+    larger than that is downloaded on its own). Use HTChirp.prefetch() to
+    create one, fetch() and read() on that client then wait for the
+    prefetched copy.
+    """
+
+    def __init__(
+        self, chirp, manifest, directory=None, workers=None, max_inflight=268435456
+    ):
+        """
+        :param chirp: HTChirp client to copy connection parameters from
+        :param manifest: List of remote paths or (remote path, local path)
+            tuples, highest priority first
+        :param directory: Where to store files that have no local path
+            [default: a new temporary directory]
+        :param workers: Number of worker threads (and connections) [default:
+            2, or the maximum of the client's concurrency controller, which
+            then limits how many of them download at once]
+        :param max_inflight: Maximum number of bytes downloading at once
+        """
+
+        self.chirp = chirp
+        self.max_inflight = int(max_inflight)
+        self._own_directory = directory is None
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="htchirp-prefetch-")
+        self.directory = directory
+
+        self._cond = threading.Condition()
+        self._queue = []  # heap of (priority, remote path)
+        self._entries = {}  # remote path: dict of file state
+        self._inflight = 0
+        self._closed = False
+
+        for (priority, item) in enumerate(manifest):
+            if isinstance(item, (tuple, list)):
+                (remote_file, local_file) = item
             else:
-                print(indent * "\t" + str(d))
-    elif isinstance(data, dict):
-        for key, value in data.items():
-            if isinstance(value, (list, dict)):
-                print(indent * "\t" + str(key))
-                _condor_chirp_print(value, indent + 1)
+                remote_file = item
+                local_file = os.path.join(
+                    self.directory,
+                    "{0}-{1}".format(priority, os.path.basename(remote_file)),
+                )
+            if remote_file in self._entries:
+                continue
+            self._entries[remote_file] = {
+                "local_file": local_file,
+                "priority": priority,
+                "state": "queued",
+                "size": None,
+                "error": None,
+                "done": threading.Event(),
+                "stale": False,  # changed by the client since
+            }
+            heapq.heappush(self._queue, (priority, remote_file))
+
+        self._threads = []
+        self._running = chirp._workers(workers, 2)  # workers not finished yet
+        for _ in range(self._running):
+            thread = threading.Thread(target=self._worker, args=(chirp._clone(),))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def __contains__(self, remote_file):
+        return remote_file in self._entries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _next(self):
+        """Get the next remote file to download, or None when done"""
+
+        with self._cond:
+            while self._queue and not self._closed:
+                (priority, remote_file) = heapq.heappop(self._queue)
+                entry = self._entries[remote_file]
+                # skip stale heap items of files that were bumped
+                if entry["state"] == "queued" and entry["priority"] == priority:
+                    entry["state"] = "running"
+                    return remote_file
+            return None
+
+    def _reserve(self, size):
+        """Wait until size bytes fit in the in-flight budget"""
+
+        with self._cond:
+            while (
+                (self._inflight > 0)
+                and (self._inflight + size > self.max_inflight)
+                and not self._closed
+            ):
+                self._cond.wait()
+            self._inflight += size
+
+    def _release(self, size):
+        """Return size bytes to the in-flight budget"""
+
+        with self._cond:
+            self._inflight -= size
+            self._cond.notify_all()
+
+    def _worker(self, chirp):
+        """Download files until the queue is empty
+
+        A worker that cannot (re)connect stops, and the last one to stop
+        marks the files left in the queue as failed.
+        """
+
+        error = None
+        try:
+            chirp.connect()
+            while True:
+                remote_file = self._next()
+                if remote_file is None:
+                    break
+                entry = self._entries[remote_file]
+                try:
+                    chirp._run(self._download, chirp, remote_file)
+                    if chirp.concurrency is not None:
+                        chirp.concurrency.transferred(entry["size"])
+                except Exception as e:
+                    entry["error"] = e
+                    if not chirp.is_connected():
+                        chirp.connect()
+                finally:
+                    entry["state"] = "done"
+                    entry["done"].set()
+        except Exception as e:
+            error = e
+        finally:
+            chirp.disconnect()
+            with self._cond:
+                self._running -= 1
+                last = self._running == 0
+            if last and (error is not None):
+                self._fail_all(error)
+
+    def _download(self, chirp, remote_file):
+        """Download one file of the manifest"""
+
+        entry = self._entries[remote_file]
+        entry["size"] = chirp.stat(remote_file)["size"]
+        self._reserve(entry["size"])
+        try:
+            chirp.fetch(remote_file, entry["local_file"])
+        finally:
+            self._release(entry["size"])
+
+    def _fail_all(self, error):
+        """Mark all queued files as failed"""
+
+        with self._cond:
+            for entry in self._entries.values():
+                if entry["state"] == "queued":
+                    entry["state"] = "done"
+                    entry["error"] = error
+                    entry["done"].set()
+            self._cond.notify_all()
+
+    def bump(self, remote_file):
+        """Move a queued file to the front of the queue
+
+        :param remote_file: Path to file in the manifest
+
+        """
+
+        with self._cond:
+            entry = self._entries[remote_file]
+            if entry["state"] == "queued":
+                entry["priority"] = (
+                    min([priority for (priority, _) in self._queue] + [0]) - 1
+                )
+                heapq.heappush(self._queue, (entry["priority"], remote_file))
+                self._cond.notify_all()
+
+    def wait(self, remote_file, timeout=None):
+        """Wait until a file has been downloaded, moving it to the front
+
+        :param remote_file: Path to file in the manifest
+        :param timeout: Maximum time to wait, in seconds
+        :returns: Path to the downloaded local file
+        :raises ChirpError: If the download failed
+
+        """
+
+        entry = self._entries[remote_file]
+        self.bump(remote_file)
+        if not entry["done"].wait(timeout):
+            raise RuntimeError(
+                "Timed out waiting for {0} to be prefetched".format(remote_file)
+            )
+        if entry["error"] is not None:
+            raise entry["error"]
+        return entry["local_file"]
+
+    def _prefetched(self, remote_file):
+        """Wait for a file in the manifest
+
+        :returns: Path to the downloaded local file, or None if the file is not
+            in the manifest, the download failed, the client changed the file
+            or the prefetcher is closed
+        """
+
+        entry = self._entries.get(remote_file)
+        if self._closed or (entry is None) or entry["stale"]:
+            return None
+        try:
+            return self.wait(remote_file)
+        except Exception:
+            return None
+
+    def _invalidate(self, remote_file):
+        """Stop using the prefetched copy of a file changed by the client"""
+
+        with self._cond:
+            entry = self._entries.get(remote_file)
+            if entry is None:
+                return
+            entry["stale"] = True
+            if entry["state"] == "queued":  # no need to download it anymore
+                entry["state"] = "done"
+                entry["error"] = HTChirp.ChirpError(
+                    "{0} was changed after it was queued".format(remote_file)
+                )
+                entry["done"].set()
+
+    def status(self):
+        """Get the state of each file in the manifest
+
+        :returns: Dict of remote paths and 'queued', 'running', 'done' or
+            'failed'
+
+        """
+
+        with self._cond:
+            return dict(
+                (
+                    remote_file,
+                    "failed" if entry["error"] is not None else entry["state"],
+                )
+                for (remote_file, entry) in self._entries.items()
+            )
+
+    def close(self):
+        """Stop downloading and remove the temporary directory, if any
+
+        Files still queued are marked as failed, and the client stops using
+        this prefetcher, so its fetch() and read() download them directly.
+        """
+
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if getattr(self.chirp, "prefetcher", None) is self:
+            self.chirp.prefetcher = None
+        for thread in self._threads:
+            thread.join()
+        self._fail_all(HTChirp.ChirpError("Prefetching was stopped"))
+        if self._own_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class _LogSource(object):
+    """A local file or pipe shipped by ChirpLogShipper
+
+    Tracks how much of the local data has been written to the remote file.
+    Local byte `offset` of the current local file is stored at remote byte
+    `base + offset`, so data can be resent after a failure without being
+    duplicated.
+    """
+
+    def __init__(self, local, remote_file):
+        self.remote_file = remote_file
+        self.fd = None  # remote file descriptor
+        self.base = None  # remote offset of the start of the local data
+        self.offset = 0  # local bytes written so far
+
+        if hasattr(local, "read"):  # pipe or other stream
+            self.path = None
+            self.stream = local
+            self.buffer = bytearray()
+            self.eof = False
+            self.lock = threading.Lock()
+        else:
+            self.path = local
+            self.stream = None
+            self.local = None
+            self.inode = None
+
+    def read_stream(self, wake):
+        """Read from the stream until EOF, run in a separate thread"""
+
+        try:
+            fileno = self.stream.fileno()
+        except (AttributeError, IOError, OSError, ValueError):
+            fileno = None
+        while True:
+            if fileno is not None:
+                data = os.read(fileno, 65536)
             else:
-                if key in ["atime", "mtime", "ctime"]:
-                    value = datetime.fromtimestamp(int(value)).ctime()
-                print(indent * "\t" + "{0}: {1}".format(str(key), str(value)))
-    else:
-        print(indent * "\t" + str(data))
+                data = self.stream.read(65536)
+            with self.lock:
+                if not data:
+                    self.eof = True
+                    break
+                self.buffer += data
+            wake.set()
+        wake.set()
+
+    def _open_local(self):
+        """Open the local file, starting a new stretch of the remote file"""
+
+        if self.local is not None:
+            self.local.close()
+            self.base += self.offset
+            self.offset = 0
+        self.local = open(self.path, "rb")
+        self.inode = os.fstat(self.local.fileno()).st_ino
+
+    def pending(self):
+        """Get the number of bytes waiting to be sent"""
+
+        if self.stream is not None:
+            with self.lock:
+                return len(self.buffer)
+        try:
+            stats = os.stat(self.path)
+        except OSError:
+            return 0
+        if (
+            (self.local is None)
+            or (stats.st_ino != self.inode)
+            or (stats.st_size < self.offset)  # truncated
+        ):
+            return max(stats.st_size, 1)  # needs to be (re)opened
+        return stats.st_size - self.offset
+
+    def peek(self, length):
+        """Get up to length bytes of data that have not been sent yet"""
+
+        if self.stream is not None:
+            with self.lock:
+                return bytes(self.buffer[:length])
+
+        if self.local is None:
+            if not os.path.exists(self.path):
+                return b""
+            self._open_local()
+        elif os.fstat(self.local.fileno()).st_size < self.offset:
+            # truncated in place (copytruncate), check before reading so data
+            # written since the truncation is not skipped
+            self._open_local()
+        self.local.seek(self.offset)
+        data = self.local.read(length)
+        if not data:
+            try:
+                stats = os.stat(self.path)
+            except OSError:
+                return b""
+            if stats.st_ino != self.inode:  # rotated, old file is done
+                self._open_local()
+                data = self.local.read(length)
+        return data
+
+    def confirm(self, length):
+        """Mark length bytes as written to the remote file"""
+
+        if self.stream is not None:
+            with self.lock:
+                del self.buffer[:length]
+        self.offset += length
+
+    def done(self):
+        """Check if a stream source has been fully sent"""
+        if self.stream is None:
+            return False
+        with self.lock:
+            return self.eof and not self.buffer
+
+
+class ChirpLogShipper(object):
+    """Append local log files or pipes to files on the Chirp server
+
+    New data is batched until there are max_batch bytes or max_delay seconds
+    have passed, then written over remote file descriptors that stay open,
+    followed by one fsync per remote file. Data is appended after the
+    existing contents of each remote file, and written with pwrite at
+    tracked offsets, so after a broken connection the shipper reconnects and
+    resends without duplicating or losing data. Local files that are
+    truncated or replaced (rotated) continue at the end of the remote file.
+
+    The shipper runs in a background thread over its own connection. Use
+    HTChirp.ship_logs() to create and start one.
+    """
+
+    def __init__(
+        self,
+        chirp,
+        files=(),
+        max_batch=1048576,
+        max_delay=1.0,
+        poll_interval=0.25,
+        retry_interval=5.0,
+    ):
+        """
+        :param chirp: HTChirp client to copy connection parameters from
+        :param files: List of (local path or readable stream, remote path)
+        :param max_batch: Send once this many bytes are waiting
+        :param max_delay: Send waiting data after this many seconds
+        :param poll_interval: Time between checks of local files, in seconds
+        :param retry_interval: Time between reconnection attempts, in seconds
+        """
+
+        self.chirp = chirp._clone()
+        self.max_batch = int(max_batch)
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+
+        self.bytes_shipped = 0
+        self.errors = 0
+        self.last_error = None
+
+        self._sources = []
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._stop_deadline = None
+        self._flush = False
+        self._thread = None
+
+        for (local, remote_file) in files:
+            self.add(local, remote_file)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def add(self, local, remote_file):
+        """Ship a local file or stream to a remote file
+
+        :param local: Path to a local file, or a readable binary stream
+            (e.g. a pipe) which is read in a separate thread until EOF
+        :param remote_file: Path to remote file to append to
+
+        """
+
+        source = _LogSource(local, remote_file)
+        with self._cond:
+            self._sources.append(source)
+        if source.stream is not None:
+            thread = threading.Thread(target=source.read_stream, args=(self._wake,))
+            thread.daemon = True
+            thread.start()
+        self._wake.set()
+
+    def start(self):
+        """Start shipping in a background thread"""
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def pending(self):
+        """Get the number of bytes waiting to be sent"""
+        with self._cond:
+            return sum(source.pending() for source in self._sources)
+
+    def flush(self, timeout=None):
+        """Send all waiting data now and wait until it has been written
+
+        :param timeout: Maximum time to wait, in seconds
+        :returns: True if all data was written, False if the timeout passed
+            or the shipper is not running (not started, or stopped)
+
+        """
+
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            self._flush = True
+            self._wake.set()
+            while sum(source.pending() for source in self._sources) > 0:
+                if (self._thread is None) or not self._thread.is_alive():
+                    return False  # nothing will send it
+                remaining = None if deadline is None else deadline - time.time()
+                if (remaining is not None) and (remaining <= 0):
+                    return False
+                # wake up now and then to notice if the thread has ended
+                self._cond.wait(
+                    self.poll_interval
+                    if remaining is None
+                    else min(remaining, self.poll_interval)
+                )
+        return True
+
+    def stop(self, timeout=None):
+        """Send any remaining data and stop shipping
+
+        :param timeout: Maximum time to keep trying to send remaining data.
+            If None, remaining data is sent once and not retried on errors.
+
+        """
+
+        if timeout is not None:
+            self._stop_deadline = time.time() + timeout
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _ship(self):
+        """Send all waiting data, then fsync the remote files written to"""
+
+        chirp = self.chirp
+        if not chirp.is_connected():
+            chirp.connect()
+            for source in self._sources:
+                source.fd = None
+
+        written = []
+        for source in list(self._sources):
+            while True:
+                data = source.peek(chirp.chunk_size)
+                if not data:
+                    break
+                if source.fd is None:
+                    if source.base is None:
+                        try:
+                            source.base = chirp.stat(source.remote_file).size
+                        except chirp.DoesntExist:
+                            source.base = 0
+                    source.fd = chirp._open(source.remote_file, "wc")
+                wb = chirp._write(
+                    source.fd, data, len(data), source.base + source.offset
+                )
+                source.confirm(wb)
+                self.bytes_shipped += wb
+                if source not in written:
+                    written.append(source)
+                if wb < len(data):
+                    break
+
+        for source in written:  # group fsync
+            chirp._fsync(source.fd)
+
+        with self._cond:
+            for source in self._sources:
+                if source.done() and (source.fd is not None):
+                    chirp._close(source.fd)
+                    source.fd = None
+            self._sources = [s for s in self._sources if not s.done()]
+            self._cond.notify_all()
+
+    def _run(self):
+        """Ship data until stopped"""
+
+        last_ship = time.time()
+        try:
+            while True:
+                stopping = self._stopping
+                pending = self.pending()
+                if pending and (
+                    stopping
+                    or self._flush
+                    or (pending >= self.max_batch)
+                    or (time.time() - last_ship >= self.max_delay)
+                ):
+                    self._flush = False
+                    try:
+                        self._ship()
+                    except (HTChirp.ChirpError, socket.error, RuntimeError) as e:
+                        self.errors += 1
+                        self.last_error = e
+                        self.chirp.disconnect()
+                        delay = self.retry_interval
+                        if stopping:  # give up once the stop timeout is spent
+                            if self._stop_deadline is None:
+                                break
+                            delay = min(delay, self._stop_deadline - time.time())
+                            if delay <= 0:
+                                break
+                        time.sleep(delay)
+                        continue
+                    last_ship = time.time()
+                elif stopping:
+                    break
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+        finally:
+            if self.chirp.is_connected():
+                for source in self._sources:
+                    if source.fd is not None:
+                        self.chirp._close(source.fd)
+            self.chirp.disconnect()
+
+
+# Clients of this process, their inherited connections are dropped in forked
+# children (see HTChirp._after_fork())
+_clients = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for client in list(_clients):
+        client._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _control_command(method):
+    """Run an HTChirp method on the client's control connection, if it has one
+
+    Short commands such as job attribute updates and ulog are then never
+    queued behind a bulk transfer on the main connection.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not getattr(self, "control_channel", False):
+            return method(self, *args, **kwargs)
+        self._check_connection()  # the control connection follows this one
+        with self._control_lock:
+            if self._control is None:
+                self._control = self._clone()
+            if not self._control.is_connected():
+                self._control.connect()
+            return method(self._control, *args, **kwargs)
+
+    return wrapper
+
+
+class _Turnstile(object):
+    """Orders requests and responses on a connection shared by threads
+
+    Requests are sent one at a time and numbered in the order they were sent.
+    The Chirp server answers them in the same order, so each thread waits
+    until all earlier responses have been read before reading its own.
+    """
+
+    def __init__(self):
+        self.send_lock = threading.RLock()
+        self.cond = threading.Condition()
+        self.generation = 0  # bumped when the connection is reset
+        self.next_ticket = 0
+        self.serving = 0
+        self.local = threading.local()
+
+    def send(self, send):
+        """Send a request and wait for the turn to read its response
+
+        :param send: Callable that sends the request
+        :raises RuntimeError: If the connection was reset while waiting
+
+        """
+
+        self.release()  # any earlier response of this thread has been read
+        with self.send_lock:
+            send()
+            with self.cond:
+                ticket = (self.generation, self.next_ticket)
+                self.next_ticket += 1
+        with self.cond:
+            while (ticket[0] == self.generation) and (ticket[1] != self.serving):
+                self.cond.wait()
+            if ticket[0] != self.generation:
+                raise RuntimeError(
+                    "Connection to the Chirp server was reset before the response."
+                )
+        self.local.ticket = ticket
+
+    def release(self):
+        """Let the next response be read, if this thread holds the turn"""
+        ticket = getattr(self.local, "ticket", None)
+        if ticket is None:
+            return
+        self.local.ticket = None
+        with self.cond:
+            if ticket[0] == self.generation:
+                self.serving += 1
+                self.cond.notify_all()
+
+    def reset(self):
+        """Forget all requests sent on the old connection"""
+        with self.cond:
+            self.generation += 1
+            self.next_ticket = 0
+            self.serving = 0
+            self.cond.notify_all()
+        self.local.ticket = None
 
 
 class HTChirp:
@@ -68,6 +2388,10 @@ class HTChirp:
     CHIRP_LINE_MAX = 5120
     CHIRP_VERSION = 2
 
+    # Default amount of data sent or received at a time by bulk transfers,
+    # independent of CHIRP_LINE_MAX
+    WRITE_CHUNK_MAX = 1048576
+
     CHIRP_AUTH_METHODS = ["cookie"]
     DEFAULT_MODE = (
         (stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
@@ -77,17 +2401,82 @@ class HTChirp:
 
     # initialize
 
-    def __init__(self, host=None, port=None, auth=["cookie"], cookie=None, timeout=10):
+    def __init__(
+        self,
+        host=None,
+        port=None,
+        auth=["cookie"],
+        cookie=None,
+        timeout=10,
+        block_cache=None,
+        file_cache=None,
+        rate_limit=None,
+        chunk_size=None,
+        tcp_nodelay=None,
+        sndbuf=None,
+        rcvbuf=None,
+        keepalive=None,
+        threadsafe=False,
+        fd_cache=0,
+        control_channel=False,
+        concurrency=None,
+    ):
         """
         :param host: the hostname or ip of the Chirp server
         :param port: the port of the Chirp server
         :param auth: a list of authentication methods to try
         :param cookie: the cookie string, if trying cookie authentication
         :param timeout: socket timeout, in seconds
+        :param block_cache: a ChirpBlockCache used to serve read() calls
+        :param file_cache: a ChirpFileCache used to serve fetch() calls
+        :param rate_limit: maximum rate of bulk transfers, in bytes per second,
+            or a ChirpRateLimiter to share with other clients
+        :param chunk_size: bytes sent or received at a time by bulk transfers
+            [default: $HTCHIRP_CHUNK_SIZE or WRITE_CHUNK_MAX]
+        :param tcp_nodelay: disable Nagle's algorithm so that short commands
+            are not delayed [default: $HTCHIRP_TCP_NODELAY or True]
+        :param sndbuf: socket send buffer size in bytes, 0 for the system
+            default [default: $HTCHIRP_SNDBUF or 0]
+        :param rcvbuf: socket receive buffer size in bytes, 0 for the system
+            default [default: $HTCHIRP_RCVBUF or 0]
+        :param keepalive: seconds of idle time before TCP keepalive probes are
+            sent, 0 to disable keepalive [default: $HTCHIRP_KEEPALIVE or 60]
+        :param threadsafe: allow several threads to share the connection, with
+            their requests pipelined (see _exchange())
+        :param fd_cache: number of remote files kept open for reuse by read()
+            and write(). Writes through a kept open file are only fsynced
+            when it is closed, see close_fds().
+        :param control_channel: send short commands (job attributes, ulog,
+            stat, access, whoami) over a second connection, opened when first
+            needed, so that they are not delayed by bulk transfers
+        :param concurrency: a ChirpConcurrency that adjusts the number of
+            parallel tasks and pipelined commands (True for a default one),
+            see stats()
         """
 
         # initialize storage variables
-        self.fds = {}  # open file descriptors
+        self.block_cache = block_cache
+        self.file_cache = file_cache
+        self.rate_limit = self._rate_limiter(rate_limit)
+        if concurrency is True:
+            concurrency = ChirpConcurrency()
+        self.concurrency = concurrency or None
+
+        # transport options
+        self.chunk_size = int(
+            _env_option(
+                chunk_size, "HTCHIRP_CHUNK_SIZE", self.__class__.WRITE_CHUNK_MAX
+            )
+        )
+        if self.chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        self.tcp_nodelay = bool(_env_option(tcp_nodelay, "HTCHIRP_TCP_NODELAY", True))
+        self.sndbuf = int(_env_option(sndbuf, "HTCHIRP_SNDBUF", 0))
+        self.rcvbuf = int(_env_option(rcvbuf, "HTCHIRP_RCVBUF", 0))
+        self.keepalive = int(_env_option(keepalive, "HTCHIRP_KEEPALIVE", 60))
+        self.fd_cache = int(fd_cache)
+        self.control_channel = bool(control_channel)
+        self._reset_state(threadsafe)
 
         chirp_config = os.environ.get("_CONDOR_CHIRP_CONFIG", ".chirp.config")
 
@@ -147,6 +2536,41 @@ class HTChirp:
         """Disconnect from the Chirp server when this object goes away"""
         self.disconnect()
 
+    def __getstate__(self):
+        """Get the connection parameters of this client, for pickling
+
+        Connections, open files and caches are not pickled. A rate limiter
+        is replaced by its rate, as it cannot be shared between processes.
+
+        """
+
+        state = dict((name, getattr(self, name)) for name in self.__class__._STATE)
+        state["rate_limit"] = None
+        if self.rate_limit is not None:
+            state["rate_limit"] = self.rate_limit.rate
+        state["threadsafe"] = self._turnstile is not None
+        state["connected"] = self.is_connected()
+        return state
+
+    def __setstate__(self, state):
+        """Restore a client from its connection parameters
+
+        The client connects when it is first used if the pickled client was
+        connected, without probing authentication methods again.
+
+        """
+
+        state = dict(state)
+        rate_limit = state.pop("rate_limit")
+        threadsafe = state.pop("threadsafe")
+        connected = state.pop("connected")
+        self.__dict__.update(state)
+        self.block_cache = None
+        self.file_cache = None
+        self.rate_limit = self._rate_limiter(rate_limit)
+        self._reset_state(threadsafe)
+        self._reconnect = connected
+
     def __repr__(self):
         """Print a representation of this object"""
         return "{0}({1}, {2}) using {3} authentication".format(
@@ -175,16 +2599,145 @@ class HTChirp:
         else:
             raise ValueError("Unknown authentication method '{0}'".format(method))
 
+    # connection parameters that are pickled and cloned
+    _STATE = [
+        "host",
+        "port",
+        "cookie",
+        "timeout",
+        "authentication",
+        "chunk_size",
+        "tcp_nodelay",
+        "sndbuf",
+        "rcvbuf",
+        "keepalive",
+        "fd_cache",
+        "control_channel",
+        "concurrency",
+    ]
+
+    def _reset_state(self, threadsafe=False):
+        """Set up the state of a new, cloned, unpickled or forked client"""
+
+        self.fds = {}  # open file descriptors
+        self.prefetcher = None
+        self._rbuf = bytearray()  # received data not read yet
+        self._turnstile = _Turnstile() if threadsafe else None
+
+        # remote files kept open, (path, flags, mode): [fd, number of users]
+        self._cached_fds = OrderedDict()
+        self._cached_fds_lock = threading.Lock()
+
+        # second connection for short commands (see _control_command())
+        self._control = None
+        self._control_lock = threading.Lock()
+
+        # process that owns the connection, and whether to connect on first
+        # use (in forked children and unpickled clients)
+        self._pid = os.getpid()
+        self._reconnect = False
+        _clients.add(self)
+
+    def _after_fork(self):
+        """Drop the connection inherited from the parent process
+
+        Closing the inherited socket only closes this process's copy of it,
+        the parent keeps using the connection. The child connects again when
+        it first uses the client.
+
+        """
+
+        connected = False
+        sock = getattr(self, "socket", None)
+        if sock is not None:
+            try:
+                sock.getsockname()
+                connected = True
+            except socket.error:
+                pass
+            sock.close()
+            self.socket = None
+        if getattr(self, "_control", None) is not None:
+            self._control._after_fork()
+        self._reset_state(getattr(self, "_turnstile", None) is not None)
+        self._reconnect = connected
+
+    def _clone(self):
+        """Create an unconnected client with the same connection parameters
+
+        Unlike the constructor, this does not probe authentication methods.
+        Unlike unpickling, the clone shares caches and the rate limiter.
+
+        """
+
+        clone = self.__class__.__new__(self.__class__)
+        clone.__setstate__(self.__getstate__())
+        clone.block_cache = self.block_cache
+        clone.file_cache = self.file_cache
+        clone.rate_limit = self.rate_limit
+        clone.concurrency = self.concurrency
+        clone.control_channel = False  # clones are for parallel transfers
+        clone._reconnect = False
+        return clone
+
+    @staticmethod
+    def _rate_limiter(rate_limit):
+        """Get a ChirpRateLimiter from a rate (in bytes per second) or limiter"""
+        if (rate_limit is None) or isinstance(rate_limit, ChirpRateLimiter):
+            return rate_limit
+        return ChirpRateLimiter(rate_limit)
+
+    def _workers(self, workers, default):
+        """Get the number of threads to start for a parallel operation
+
+        :param workers: Number of threads asked for, or None
+        :param default: Number of threads without a concurrency controller
+        :returns: workers, the controller's max_workers, or default
+
+        """
+
+        if workers is not None:
+            return max(1, int(workers))
+        elif self.concurrency is not None:
+            return self.concurrency.max_workers
+        return default
+
+    def _run(self, function, *args):
+        """Run a parallel task through the concurrency controller, if any"""
+        if self.concurrency is None:
+            return function(*args)
+        return self.concurrency.run(function, *args)
+
+    def _meter(self, total, rate_limit=None, progress=None):
+        """Get a _TransferMeter for a bulk transfer
+
+        :param total: Number of bytes to be transferred (None if unknown)
+        :param rate_limit: Rate limit for this transfer only (see __init__())
+        :param progress: Progress callback (see _TransferMeter)
+        :returns: A _TransferMeter, or None if there is nothing to meter
+
+        """
+
+        limiters = [self.rate_limit, self._rate_limiter(rate_limit)]
+        if (progress is None) and (limiters == [None, None]):
+            return None
+        return _TransferMeter(total, limiters, progress)
+
     def _check_connection(self):
+        if (not self.is_connected()) and self._reconnect:
+            self.connect()  # after a fork or unpickling
         if not self.is_connected():
             raise RuntimeError("The Chirp client is not connected to a Chirp server.")
 
-    def _simple_command(self, cmd, get_response=True):
+    def _simple_command(self, cmd, get_response=True, data=None):
         """Send a command to the Chirp server
 
         :param cmd: The command to be sent
         :param get_response: Check for a response and return it
+        :param data: Data to send right after the command, in the same write
         :returns: The response from the Chirp server (if get_response is True)
+            In threadsafe mode, get_response=False and any reads of data that
+            follow the response must be inside the caller's _exchange().
         :raises InvalidRequest: If the command is invalid
         :raises RuntimeError: If the connection is broken
 
@@ -198,20 +2751,101 @@ class HTChirp:
             raise self.InvalidRequest("The form of the request is invalid.")
         cmd = cmd.encode()
 
-        # check the command length
-        if len(cmd) > self.__class__.CHIRP_LINE_MAX:
-            raise self.TooBig("That request is too big to execute.")
+        # check the command length
+        if len(cmd) > self.__class__.CHIRP_LINE_MAX:
+            raise self.TooBig("That request is too big to execute.")
+
+        # send the command
+        buffers = (cmd,) if data is None else (cmd, data)
+        if self._turnstile is None:
+            self._send(*buffers)
+            if get_response:
+                return self._simple_response()
+            return
+
+        with self._exchange():
+            self._turnstile.send(lambda: self._send(*buffers))
+            if get_response:
+                return self._simple_response()
+
+    @contextmanager
+    def _exchange(self, exclusive=False):
+        """Keep the turn to read from the connection in threadsafe mode
+
+        Each command sent in threadsafe mode waits for its turn to read the
+        response, and the turn passes to the next thread when the command
+        returns. Commands followed by more data (or by more requests that
+        must not be interleaved with others) run inside an exchange, which
+        keeps the turn until it ends. Sending another command inside an
+        exchange gives up the turn for the earlier one.
+
+        :param exclusive: Also keep other threads from sending requests until
+            the exchange ends, e.g. while waiting for putfile's go-ahead
+
+        """
+
+        turnstile = self._turnstile
+        if turnstile is None:
+            yield
+            return
+
+        local = turnstile.local
+        depth = getattr(local, "depth", 0)
+        local.depth = depth + 1
+        if exclusive:
+            turnstile.send_lock.acquire()
+        try:
+            yield
+        finally:
+            if exclusive:
+                turnstile.send_lock.release()
+            local.depth = depth
+            if depth == 0:
+                turnstile.release()
+
+    def _send(self, *buffers):
+        """Send data to the Chirp server
 
-        # send the command
-        bytes_sent = 0
-        while bytes_sent < len(cmd):
-            sent = self.socket.send(cmd[bytes_sent:])
+        The buffers are sent with a single sendmsg where possible, so that a
+        request line and its data leave in the same packets.
+
+        :param buffers: Bytes-like objects to send in order
+        :raises RuntimeError: If the connection is broken
+
+        """
+
+        buffers = [memoryview(b).cast("B") for b in buffers]
+        buffers = [b for b in buffers if len(b)]
+        if not hasattr(self.socket, "sendmsg"):  # not available on Windows
+            if len(buffers) > 1:
+                buffers = [memoryview(b"".join(buffers))]
+            for b in buffers:
+                self.socket.sendall(b)
+            return
+
+        while buffers:
+            sent = self.socket.sendmsg(buffers)
             if sent == 0:
                 raise RuntimeError("Connection to the Chirp server is broken.")
-            bytes_sent = bytes_sent + sent
-
-        if get_response:
-            return self._simple_response()
+            while buffers and (sent >= len(buffers[0])):
+                sent -= len(buffers.pop(0))
+            if sent:
+                buffers[0] = buffers[0][sent:]
+
+    def _set_socket_options(self, sock):
+        """Apply the transport options to a new, unconnected socket"""
+
+        # buffer sizes must be set before connecting to affect the TCP window
+        if self.sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        if self.rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        if self.tcp_nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.keepalive:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, "TCP_KEEPIDLE"):  # Linux
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive)
 
     def _simple_response(self):
         """Get the response from the Chirp server after running a command
@@ -224,16 +2858,7 @@ class HTChirp:
         # check that client is connected
         self._check_connection()
 
-        # build up the response one byte at a time
-        response = b""
-        chunk = b""
-        while chunk != b"\n":  # response terminated with \n
-            chunk = self.socket.recv(1)
-            response += chunk
-            # make sure response doesn't get too large
-            if len(response) > self.__class__.CHIRP_LINE_MAX:
-                raise EnvironmentError("The server responded with too much data.")
-        response = response.decode().rstrip()
+        response = self._recv_line().decode().rstrip()
 
         # check the response code if an int is returned
         try:
@@ -245,6 +2870,37 @@ class HTChirp:
 
         return response
 
+    def _recv_line(self):
+        """Receive one line from the Chirp server
+
+        Data is received in blocks, anything after the line is kept in a
+        buffer for the next read, since it may belong to the next response.
+
+        :returns: The line, including the line terminator
+        :raises EnvironmentError: if the line is too long
+        :raises RuntimeError: If the connection is broken
+
+        """
+
+        buf = self._rbuf
+        start = 0
+        while True:
+            end = buf.find(b"\n", start)
+            if end >= 0:
+                break
+            # make sure response doesn't get too large
+            if len(buf) > self.__class__.CHIRP_LINE_MAX:
+                raise EnvironmentError("The server responded with too much data.")
+            start = len(buf)
+            data = self.socket.recv(self.__class__.CHIRP_LINE_MAX)
+            if not data:
+                raise RuntimeError("Connection to the Chirp server is broken.")
+            buf += data
+
+        line = bytes(buf[: end + 1])
+        del buf[: end + 1]
+        return line
+
     def _check_response(self, response):
         """Check the response from the Chirp server for validity
 
@@ -284,38 +2940,113 @@ class HTChirp:
         elif response < 0:
             raise self.UnknownError("An unknown error ({0}) occured.".format(response))
 
-    def _get_fixed_data(self, length, output_file=None):
+    def _get_fixed_data(self, length, output_file=None, meter=None):
         """Get a fixed amount of data from the Chirp server
 
         :param length: The amount of data (in bytes) to receive
-        :param output_file: Output file to store received data (optional)
+        :param output_file: Where to stream received data (optional). This can
+            be a path to a local file, a writable file-like object, or a
+            callable that accepts each chunk of data.
+        :param meter: A _TransferMeter to update as data is received
         :returns: Received data, unless output_file is set, then returns number
             of bytes received.
 
         """
 
+        length = int(length)
+
+        if output_file is None:  # return data to method call
+            data = bytearray()
+            for chunk in self._iter_fixed_data(length, meter=meter):
+                data += chunk
+            return bytes(data)
+
+        elif not (hasattr(output_file, "write") or callable(output_file)):
+            # stream data to a file
+            with open(output_file, "wb") as fd:
+                return self._get_fixed_data(length, fd.write, meter)
+
+        else:  # stream data to a file-like object or callback
+            if hasattr(output_file, "write"):
+                output_file = output_file.write
+            bytes_recv = 0
+            for chunk in self._iter_fixed_data(length, meter=meter):
+                output_file(chunk)
+                bytes_recv += len(chunk)
+            return bytes_recv
+
+    def _iter_fixed_data(self, length, chunk_size=None, meter=None):
+        """Iterate over a fixed amount of data from the Chirp server
+
+        Chunks are yielded as soon as they arrive. Each chunk is a memoryview
+        of a reused buffer, so it is only valid until the next chunk is
+        requested. If iteration stops early, the connection is reset so that
+        the unread data does not corrupt later commands.
+
+        :param length: The amount of data (in bytes) to receive
+        :param chunk_size: Maximum size of each chunk [default: chunk_size]
+        :param meter: A _TransferMeter to update as data is received
+        :returns: Iterator of memoryviews of received data
+
+        """
+
         # check that client is connected
         self._check_connection()
 
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+
         length = int(length)
+        buf = memoryview(bytearray(max(1, min(int(chunk_size), length))))
 
-        if output_file:  # stream data to a file
-            bytes_recv = 0
-            chunk = b""
-            with open(output_file, "wb") as fd:
-                while bytes_recv < length:
-                    chunk = self.socket.recv(self.__class__.CHIRP_LINE_MAX)
-                    fd.write(chunk)
-                    bytes_recv += len(chunk)
-            return bytes_recv
+        bytes_recv = 0
+        try:
+            if self._rbuf:  # received along with the response line
+                recv = min(len(self._rbuf), length)
+                data = bytes(self._rbuf[:recv])
+                del self._rbuf[:recv]
+                bytes_recv += recv
+                if meter is not None:
+                    meter.update(recv)
+                yield memoryview(data)
+            while bytes_recv < length:
+                recv = self.socket.recv_into(buf, min(len(buf), length - bytes_recv))
+                if recv == 0:
+                    raise RuntimeError("Connection to the Chirp server is broken.")
+                bytes_recv += recv
+                if meter is not None:
+                    meter.update(recv)
+                yield buf[:recv]
+            if meter is not None:
+                meter.finish()
+        finally:
+            if bytes_recv < length and self.is_connected():
+                # the rest of the data is still in flight, start over
+                self.connect()
+
+    def _iter_lines(self, length):
+        """Iterate over the lines in a fixed amount of data from the Chirp server
+
+        Lines are parsed as the data arrives, so only one chunk and one
+        partial line are held in memory at a time.
 
-        else:  # return data to method call
-            data = b""
-            chunk = b""
-            while len(data) < length:
-                chunk = self.socket.recv(self.__class__.CHIRP_LINE_MAX)
-                data += chunk
-            return data
+        :param length: The amount of data (in bytes) to receive
+        :returns: Iterator of decoded lines, without line terminators
+
+        """
+
+        chunks = self._iter_fixed_data(length)
+        try:
+            partial = b""
+            for chunk in chunks:
+                lines = (partial + bytes(chunk)).split(b"\n")
+                partial = lines.pop()
+                for line in lines:
+                    yield line.decode()
+            if partial:
+                yield partial.decode()
+        finally:
+            chunks.close()  # reset the connection if stopped early
 
     def _get_line_data(self):
         """Get one line of data from the Chirp server
@@ -331,12 +3062,98 @@ class HTChirp:
         # check that client is connected
         self._check_connection()
 
-        data = b""
-        while True:
-            data += self.socket.recv(self.__class__.CHIRP_LINE_MAX)
-            if data.decode()[-1] == "\n":
-                break
-        return data.decode()
+        return self._recv_line().decode()
+
+    def _get_stat_fields(self, count):
+        """Get the metadata that follows a stat, lstat or statfs response
+
+        :param count: Number of fields to expect, they may span several lines
+        :returns: A line of space-separated fields
+
+        """
+
+        result = self._get_line_data().rstrip()
+        while len(result.split()) < count:
+            result += " " + self._get_line_data().rstrip()
+        return result
+
+    def _pipeline(self, cmds, read_result, window=None):
+        """Send many commands without waiting for each response
+
+        Commands are sent in windows of up to `window` commands, then the
+        responses of the window are read in order. An error response only
+        affects its own command. Any other error (e.g. a timeout) resets the
+        connection, as the rest of the window's responses are unread.
+
+        :param cmds: List of commands
+        :param read_result: Function called with each successful response,
+            that reads any data that follows it and returns the result
+        :param window: Maximum number of commands sent before reading
+            [default: set by the concurrency controller, or 64]
+        :returns: List of results or ChirpErrors, one for each command
+
+        """
+
+        # check that client is connected
+        self._check_connection()
+
+        concurrency = self.concurrency if window is None else None
+        results = [None] * len(cmds)
+        pending = deque(range(len(cmds)))
+        retries = {}
+        with self._exchange(exclusive=True):
+            while pending:
+                if concurrency is not None:
+                    size = concurrency.window
+                else:
+                    size = max(1, int(window or 64))
+                batch = []
+                data = []
+                while pending and (len(batch) < size):
+                    i = pending.popleft()
+                    cmd = cmds[i].encode()
+                    if len(cmd) > self.__class__.CHIRP_LINE_MAX:
+                        results[i] = self.TooBig("That request is too big to execute.")
+                    else:
+                        batch.append(i)
+                        data.append(cmd)
+                if not batch:
+                    continue
+
+                data = b"".join(data)
+                sent = time.time()
+                if self._turnstile is None:
+                    self._send(data)
+                else:
+                    self._turnstile.send(lambda: self._send(data))
+
+                failed = True
+                try:
+                    for i in batch:
+                        try:
+                            results[i] = read_result(self._simple_response())
+                        except self.ChirpError as e:
+                            results[i] = e
+                    failed = False
+                finally:
+                    if failed and self.is_connected():
+                        # the rest of the window's responses are still in
+                        # flight, start over so they don't answer later commands
+                        self.connect()
+
+                if concurrency is not None:
+                    concurrency.pipelined(
+                        [results[i] for i in batch], time.time() - sent
+                    )
+                    # send commands refused by an overloaded server again
+                    for i in batch:
+                        if ChirpConcurrency._overloaded([results[i]]) and (
+                            retries.get(i, 0) < concurrency.retries
+                        ):
+                            retries[i] = retries.get(i, 0) + 1
+                            pending.append(i)
+
+        return results
 
     def _peek_buffer(self):
         """Peek in the socket buffer to see if data is waiting to be read
@@ -344,6 +3161,9 @@ class HTChirp:
         :returns: True, if bytes in buffer, False if buffer is empty
         """
 
+        if self._rbuf:
+            return True
+
         self.socket.setblocking(0)
         try:
             buf = self.socket.recv(1, socket.MSG_PEEK)
@@ -372,19 +3192,20 @@ class HTChirp:
         if not flags.issubset(valid_flags):
             raise ValueError("Flags must be one or more of 'rwatcx'")
 
-        # get file descriptor
-        fd = int(
-            self._simple_command(
-                "open {0} {1} {2}\n".format(quote(name), "".join(flags), int(mode))
+        with self._exchange():
+            # get file descriptor
+            fd = int(
+                self._simple_command(
+                    "open {0} {1} {2}\n".format(quote(name), "".join(flags), int(mode))
+                )
             )
-        )
 
-        # store file info
-        file_info = (quote(name), "".join(flags), int(mode))
-        self.fds[fd] = file_info
+            # store file info
+            file_info = (quote(name), "".join(flags), int(mode))
+            self.fds[fd] = file_info
 
-        # get stat
-        stat = self._get_line_data()
+            # get stat
+            stat = self._get_line_data()
 
         return fd
 
@@ -414,30 +3235,20 @@ class HTChirp:
 
         if (offset, stride_length, stride_skip) == (None, None, None):
             # read
-            rb = int(
-                self._simple_command("read {0} {1}\n".format(int(fd), int(length)))
-            )
+            cmd = "read {0} {1}\n".format(int(fd), int(length))
 
         elif (offset != None) and (stride_length, stride_skip) == (None, None):
             # pread
-            rb = int(
-                self._simple_command(
-                    "pread {0} {1} {2}\n".format(int(fd), int(length), int(offset))
-                )
-            )
+            cmd = "pread {0} {1} {2}\n".format(int(fd), int(length), int(offset))
 
         elif (stride_length, stride_skip) != (None, None):
             # sread
-            rb = int(
-                self._simple_command(
-                    "sread {0} {1} {2} {3} {4}\n".format(
-                        int(fd),
-                        int(length),
-                        int(offset),
-                        int(stride_length),
-                        int(stride_skip),
-                    )
-                )
+            cmd = "sread {0} {1} {2} {3} {4}\n".format(
+                int(fd),
+                int(length),
+                int(offset),
+                int(stride_length),
+                int(stride_skip),
             )
 
         else:
@@ -445,7 +3256,9 @@ class HTChirp:
                 "Both stride_length and stride_skip must be specified"
             )
 
-        return self._get_fixed_data(rb)
+        with self._exchange():
+            rb = int(self._simple_command(cmd))
+            return self._get_fixed_data(rb)
 
     def _write(
         self, fd, data, length, offset=None, stride_length=None, stride_skip=None
@@ -470,28 +3283,20 @@ class HTChirp:
 
         if (offset, stride_length, stride_skip) == (None, None, None):
             # write
-            self._simple_command(
-                "write {0} {1}\n".format(int(fd), int(length)), get_response=False
-            )
+            cmd = "write {0} {1}\n".format(int(fd), int(length))
 
         elif (offset != None) and (stride_length, stride_skip) == (None, None):
             # pwrite
-            self._simple_command(
-                "pwrite {0} {1} {2}\n".format(int(fd), int(length), int(offset)),
-                get_response=False,
-            )
+            cmd = "pwrite {0} {1} {2}\n".format(int(fd), int(length), int(offset))
 
         elif (stride_length, stride_skip) != (None, None):
             # swrite
-            wb = self._simple_command(
-                "swrite {0} {1} {2} {3} {4}\n".format(
-                    int(fd),
-                    int(length),
-                    int(offset),
-                    int(stride_length),
-                    int(stride_skip),
-                ),
-                get_response=False,
+            cmd = "swrite {0} {1} {2} {3} {4}\n".format(
+                int(fd),
+                int(length),
+                int(offset),
+                int(stride_length),
+                int(stride_skip),
             )
 
         else:
@@ -499,13 +3304,74 @@ class HTChirp:
                 "Both stride_length and stride_skip must be specified"
             )
 
-        wfd = self.socket.makefile("wb")  # open socket as a file object
-        wfd.write(data)  # write data
-        wfd.close()  # close socket file object
-
-        wb = int(self._simple_response())  # get bytes written
+        # send the command and data together, then get bytes written
+        wb = int(self._simple_command(cmd, data=data))
         return wb
 
+    def _write_stream(
+        self,
+        fd,
+        rfd,
+        length=None,
+        offset=None,
+        stride_length=None,
+        stride_skip=None,
+        meter=None,
+    ):
+        """Write the contents of a local file object to a file on the Chirp server
+
+        Data is sent in chunks of at most chunk_size bytes, so memory use
+        does not depend on the size of the local file.
+
+        :param fd: File descriptor
+        :param rfd: Readable binary file object
+        :param length: Stop after writing this many bytes [default: until EOF]
+        :param offset: Skip this many bytes when writing
+        :param stride_length: Write this many bytes every stride_skip bytes
+        :param stride_skip: Skip this many bytes between writes
+        :param meter: A _TransferMeter to update after each write
+        :returns: Number of bytes written
+
+        """
+
+        if offset is None and (stride_length, stride_skip) != (None, None):
+            offset = 0  # assume offset is 0 if stride given but not offset
+
+        chunk_size = self.chunk_size
+        if stride_length:
+            # keep every chunk aligned to whole strides
+            stride_length = int(stride_length)
+            chunk_size = max(1, chunk_size // stride_length) * stride_length
+
+        bytes_sent = 0
+        while (length is None) or (bytes_sent < length):
+            if length is None:
+                data = rfd.read(chunk_size)
+            else:
+                data = rfd.read(min(chunk_size, length - bytes_sent))
+            if not data:
+                break
+
+            if stride_length:
+                chunk_offset = int(offset) + (
+                    bytes_sent // stride_length * int(stride_skip)
+                )
+            elif offset is not None:
+                chunk_offset = int(offset) + bytes_sent
+            else:
+                chunk_offset = None
+
+            wb = self._write(
+                fd, data, len(data), chunk_offset, stride_length, stride_skip
+            )
+            bytes_sent += wb
+            if meter is not None:
+                meter.update(wb)
+            if wb < len(data):
+                break  # short write, let the caller decide what to do
+
+        return bytes_sent
+
     def _fsync(self, fd):
         """Flush unwritten data to disk
 
@@ -530,11 +3396,237 @@ class HTChirp:
         )
         return int(pos)
 
+    def _cached_read(self, remote_path, length, offset):
+        """Read from a file on the Chirp server through the block cache
+
+        Blocks missing from the cache are fetched with one pread per run of
+        adjacent missing blocks. Only complete blocks are cached, after a
+        short read the rest of the run is read again, and if that makes no
+        progress the partial data is returned uncached (a short read).
+
+        :param remote_path: Path to file
+        :param length: Number of bytes to read
+        :param offset: Number of bytes to offset from beginning of file
+        :returns: Data read from file
+
+        """
+
+        cache = self.block_cache
+        block_size = cache.block_size
+
+        version = cache.version(remote_path)
+        if version is None:
+            stats = self.stat(remote_path)
+            version = cache.validate(remote_path, stats["size"], stats["mtime"])
+
+        end = min(offset + int(length), version[0])
+        if offset >= end:
+            return b""
+        first = offset // block_size
+        last = (end - 1) // block_size
+
+        blocks = {}
+        missing = []
+        for index in range(first, last + 1):
+            block = cache.get(remote_path, version, index)
+            if block is None:
+                missing.append(index)
+            else:
+                blocks[index] = block
+
+        if missing:
+            # group adjacent missing blocks into runs
+            runs = [[missing[0], missing[0]]]
+            for index in missing[1:]:
+                if index == runs[-1][1] + 1:
+                    runs[-1][1] = index
+                else:
+                    runs.append([index, index])
+
+            (fd, key) = self._acquire_fd(remote_path, "r")
+            failed = True
+            try:
+                for (run_first, run_last) in runs:
+                    index = run_first
+                    while index <= run_last:
+                        data = self._read(
+                            fd,
+                            (run_last - index + 1) * block_size,
+                            index * block_size,
+                        )
+                        read_first = index
+                        while index <= run_last:
+                            start = (index - read_first) * block_size
+                            block = data[start : start + block_size]
+                            if len(block) < min(
+                                block_size, version[0] - index * block_size
+                            ):
+                                break  # short read, don't cache a partial block
+                            blocks[index] = block
+                            cache.put(remote_path, version, index, block)
+                            index += 1
+                        if index == read_first:  # no progress, e.g. it shrank
+                            if block:
+                                blocks[index] = block
+                            break
+                failed = False
+            finally:
+                self._release_fd(fd, key, failed)
+
+        pieces = []
+        for index in range(first, last + 1):
+            block = blocks.get(index)
+            if block is None:
+                break
+            pieces.append(block)
+            if len(block) < block_size:
+                break
+        data = b"".join(pieces)
+        start = offset - first * block_size
+        return data[start : start + (end - offset)]
+
+    def _acquire_fd(self, remote_path, flags, mode=None):
+        """Open a file on the Chirp server, or reuse one kept open
+
+        Files opened with the 't' or 'x' flags are never reused. If the server
+        has too many open files, kept open files are closed to make room.
+
+        :param remote_path: Path to file
+        :param flags: File open modes (one or more of 'rwatcx')
+        :param mode: Permission mode to set [default: 0777]
+        :returns: (fd, key), pass both to _release_fd() when done. key is
+            None if the file is not kept open.
+
+        """
+
+        flags = "".join(sorted(set(flags)))
+        if mode is None:
+            mode = self.__class__.DEFAULT_MODE
+        if (self.fd_cache <= 0) or ("t" in flags) or ("x" in flags):
+            return (self._open(remote_path, flags, mode), None)
+
+        key = (remote_path, flags, int(mode))
+        with self._cached_fds_lock:
+            entry = self._cached_fds.get(key)
+            if entry is not None:
+                self._cached_fds.move_to_end(key)
+                entry[1] += 1
+                return (entry[0], key)
+
+        self._evict_fds(self.fd_cache - 1)
+        while True:
+            try:
+                fd = self._open(remote_path, flags, mode)
+                break
+            except self.TooManyOpen:
+                if not self._evict_fds(len(self._cached_fds) - 1):
+                    raise
+
+        with self._cached_fds_lock:
+            if key in self._cached_fds:  # opened by another thread meanwhile
+                return (fd, None)
+            self._cached_fds[key] = [fd, 1]
+        return (fd, key)
+
+    def _release_fd(self, fd, key, failed=False):
+        """Close a file opened by _acquire_fd(), unless it is kept open
+
+        :param fd: File descriptor
+        :param key: Key returned by _acquire_fd()
+        :param failed: If set to True, the file is not reused
+
+        """
+
+        if key is not None:
+            with self._cached_fds_lock:
+                entry = self._cached_fds.get(key)
+                if (entry is None) or (entry[0] != fd):
+                    return
+                entry[1] -= 1
+                if not failed:
+                    return
+                del self._cached_fds[key]
+        try:
+            self._close(fd)
+        except (self.ChirpError, socket.error, RuntimeError):
+            if not failed:
+                raise
+            # else keep the error that made the file fail
+
+    def _evict_fds(self, keep, keys=None):
+        """Flush and close kept open files that are not in use
+
+        :param keep: Close least recently used files until at most this many
+            are kept open
+        :param keys: Only close files with these keys [default: any]
+        :returns: Number of files closed
+
+        """
+
+        victims = []
+        with self._cached_fds_lock:
+            for (key, (fd, users)) in list(self._cached_fds.items()):
+                if len(self._cached_fds) <= keep:
+                    break
+                if users or ((keys is not None) and (key not in keys)):
+                    continue
+                del self._cached_fds[key]
+                victims.append((key, fd))
+
+        for ((remote_path, flags, mode), fd) in victims:
+            try:
+                if "w" in flags:
+                    self._fsync(fd)
+            finally:
+                self._close(fd)
+        return len(victims)
+
+    def _forget_fds(self, *remote_paths):
+        """Close kept open files at or below paths that are being removed"""
+
+        if not self._cached_fds:
+            return
+        keys = [
+            key
+            for key in list(self._cached_fds)
+            if any(
+                (key[0] == remote_path)
+                or key[0].startswith(remote_path.rstrip("/") + "/")
+                for remote_path in remote_paths
+            )
+        ]
+        if keys:
+            self._evict_fds(0, keys)
+
+    def _invalidate(self, *remote_paths):
+        """Drop cached data and kept open files of remote files changed by us"""
+
+        self._invalidate_data(*remote_paths)
+        self._forget_fds(*remote_paths)
+
+    def _invalidate_data(self, *remote_paths):
+        """Drop cached data for remote files changed by this client
+
+        Unlike _invalidate(), kept open files stay open, e.g. for write(),
+        which writes through them.
+        """
+
+        if self.block_cache is not None:
+            for remote_path in remote_paths:
+                self.block_cache.invalidate(remote_path)
+        if self.prefetcher is not None:
+            for remote_path in remote_paths:
+                self.prefetcher._invalidate(remote_path)
+
     ## public methods
 
     def is_connected(self):
         """Check if Chirp client is connected."""
 
+        # drop a connection inherited from a parent process
+        if getattr(self, "_pid", None) not in (None, os.getpid()):
+            self._after_fork()
+
         # check if the socket is open and exists
         try:
             self.socket.getsockname()
@@ -545,6 +3637,28 @@ class HTChirp:
 
         return True
 
+    def stats(self):
+        """Get the statistics of the client's cache and concurrency controller
+
+        :returns: Dict with the stats() of block_cache and of concurrency, for
+            those that the client has
+
+        """
+
+        stats = {}
+        if self.block_cache is not None:
+            stats["block_cache"] = self.block_cache.stats()
+        if self.concurrency is not None:
+            stats["concurrency"] = self.concurrency.stats()
+        return stats
+
+    def close_fds(self):
+        """Flush and close all remote files kept open by the fd cache"""
+
+        if self._cached_fds and self.is_connected():
+            self._evict_fds(0)
+        self._cached_fds.clear()
+
     def connect(self, auth_method=None):
         """Connect to and authenticate with the Chirp server
 
@@ -554,6 +3668,7 @@ class HTChirp:
 
         if not auth_method:
             auth_method = self.authentication
+        self._reconnect = False
 
         # reconnect if already connected
         if self.is_connected():
@@ -562,6 +3677,10 @@ class HTChirp:
         # create the socket
         self.socket = socket.socket()
         self.socket.settimeout(self.timeout)
+        self._set_socket_options(self.socket)
+        self._rbuf = bytearray()  # received data not read yet
+        if self._turnstile is not None:
+            self._turnstile.reset()
 
         # connect and authenticate
         self.socket.connect((self.host, self.port))
@@ -569,39 +3688,150 @@ class HTChirp:
 
         # reset open file descriptors
         self.fds = {}
+        self._cached_fds.clear()
 
     def disconnect(self):
         """Close connection with the Chirp server"""
 
+        self._reconnect = False
+        if getattr(self, "_cached_fds", None):
+            try:
+                self.close_fds()
+            except (self.ChirpError, socket.error, RuntimeError):
+                self._cached_fds.clear()
+
         try:
             self.socket.close()
         except socket.error:
             pass
         except (NameError, AttributeError):
             pass
+        self._rbuf = bytearray()
+        if getattr(self, "_turnstile", None) is not None:
+            self._turnstile.reset()
+        if getattr(self, "_control", None) is not None:
+            self._control.disconnect()
 
         # reset open file descriptors
         self.fds = {}
 
     # HTCondor-specific methods
 
-    def fetch(self, remote_file, local_file):
+    def fetch(
+        self, remote_file, local_file, rate_limit=None, progress=None, decompress=False
+    ):
         """Copy a file from the submit machine to the execute machine.
 
+        If remote_file was given to prefetch(), wait for the prefetched copy.
+        Otherwise, if the client has a file_cache and local_file is a path,
+        the file is fetched through the cache.
+
         :param remote_file: Path to file to be sent from the submit machine
-        :param local_file: Path to file to be written to on the execute machine
-        :returns: Bytes written
+        :param local_file: Path to file to be written to on the execute machine,
+            or a writable file-like object, or a callable (see getfile())
+        :param rate_limit: Maximum rate of this transfer (see getfile())
+        :param progress: Progress callback (see getfile()), only called if the
+            file is transferred
+        :param decompress: If set to True, decompress the file on the fly,
+            detecting gzip, zstd or lz4 data and passing through anything
+            else. Or the method in COMPRESSION_METHODS to use.
+        :returns: Bytes written (decompressed bytes, if decompressing)
+
+        """
+
+        if decompress:
+            writer = _DecompressingWriter(
+                local_file, None if decompress is True else decompress
+            )
+            try:
+                self.fetch(remote_file, writer, rate_limit, progress)
+                writer.finish()
+            finally:
+                writer.close()
+            return writer.bytes_out
+
+        prefetched = None
+        if self.prefetcher is not None:
+            prefetched = self.prefetcher._prefetched(remote_file)
+        if prefetched is not None:
+            if hasattr(local_file, "write") or callable(local_file):
+                with open(prefetched, "rb") as rfd:
+                    if hasattr(local_file, "write"):
+                        local_file = local_file.write
+                    for data in iter(lambda: rfd.read(1048576), b""):
+                        local_file(data)
+            elif os.path.abspath(prefetched) != os.path.abspath(local_file):
+                _link_or_copy(prefetched, local_file)
+            return os.stat(prefetched).st_size
+
+        if self.file_cache is not None and not (
+            hasattr(local_file, "write") or callable(local_file)
+        ):
+            return self.file_cache.fetch(
+                self, remote_file, local_file, rate_limit=rate_limit, progress=progress
+            )
+
+        return self.getfile(
+            remote_file, local_file, rate_limit=rate_limit, progress=progress
+        )
+
+    def ship_logs(self, files, **kwargs):
+        """Start appending local log files or pipes to remote files.
+
+        See ChirpLogShipper for batching and delivery details.
+
+        :param files: List of (local path or readable stream, remote path)
+        :param kwargs: Options for ChirpLogShipper
+        :returns: The started ChirpLogShipper, stop() it when done
 
         """
 
-        return self.getfile(remote_file, local_file)
+        return ChirpLogShipper(self, files, **kwargs).start()
 
-    def put(self, local_file, remote_file, flags="wct", mode=None):
+    def prefetch(self, manifest, directory=None, workers=None, max_inflight=268435456):
+        """Start downloading remote files in the background.
+
+        Later fetch() and read() calls for files in the manifest wait for the
+        download of that file, moving it to the front of the queue, instead of
+        downloading it again. Files whose download failed, files changed by
+        this client since, and all files once the prefetcher is closed, are
+        downloaded directly again.
+
+        :param manifest: List of remote paths or (remote path, local path)
+            tuples, highest priority first
+        :param directory: Where to store files that have no local path
+            [default: a new temporary directory]
+        :param workers: Number of parallel downloads (and connections)
+            [default: see ChirpPrefetcher]
+        :param max_inflight: Maximum number of bytes downloading at once
+        :returns: The ChirpPrefetcher, close() it when done
+
+        """
+
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        self.prefetcher = ChirpPrefetcher(
+            self, manifest, directory, workers, max_inflight
+        )
+        return self.prefetcher
+
+    def put(
+        self,
+        local_file,
+        remote_file,
+        flags="wct",
+        mode=None,
+        rate_limit=None,
+        progress=None,
+        compress=None,
+        compress_level=None,
+    ):
         """Copy a file from the execute machine to the submit machine.
 
-        Specifying flags other than 'wct' (i.e. 'create or truncate file') when
-        putting large files is not recommended as the entire file must be read
-        into memory.
+        Flags other than 'wct' (i.e. 'create or truncate file') are less
+        efficient, the file is streamed with a series of writes instead of a
+        single putfile. So are compressed files, as putfile needs to know
+        the size of the data before sending it.
 
         To put individual bytes into a file on the submit machine instead of
         an entire file, see the write() method.
@@ -610,7 +3840,13 @@ class HTChirp:
         :param remote_file: Path to file to be written to on the submit machine
         :param flags: File open modes (one or more of 'rwatcx') [default: 'wct']
         :param mode: Permission mode to set [default: 0777]
-        :returns: Size of written file
+        :param rate_limit: Maximum rate of this transfer (see putfile())
+        :param progress: Progress callback (see putfile()), when compressing,
+            bytes_done counts the bytes read from local_file
+        :param compress: Compress the file on the fly with this method (one of
+            COMPRESSION_METHODS), the remote file holds the compressed data
+        :param compress_level: Compression level [default: method's default]
+        :returns: Size of written file (the compressed size, if compressing)
 
         """
 
@@ -620,25 +3856,227 @@ class HTChirp:
 
         flags = set(flags)
 
-        if flags == set("wct"):
+        if compress:
+            with open(local_file, "rb") as rfd:
+                return self.write(
+                    rfd,
+                    remote_file,
+                    flags,
+                    mode,
+                    rate_limit=rate_limit,
+                    progress=progress,
+                    compress=compress,
+                    compress_level=compress_level,
+                )
+
+        elif flags == set("wct"):
             # If default mode ('wct'), use putfile (efficient)
-            return self.putfile(local_file, remote_file, mode)
+            return self.putfile(
+                local_file, remote_file, mode, rate_limit=rate_limit, progress=progress
+            )
 
         else:
-            # If non-default mode, have to read entire file (inefficient)
+            # If non-default mode, stream the file through write
             with open(local_file, "rb") as rfd:
-                data = rfd.read()
-            # And then use write
-            wb = self.write(data, remote_file, flags, mode)
+                length = os.fstat(rfd.fileno()).st_size
+                wb = self.write(
+                    rfd,
+                    remote_file,
+                    flags,
+                    mode,
+                    rate_limit=rate_limit,
+                    progress=progress,
+                )
             # Better check how much data was written
-            if wb < len(data):
+            if wb < length:
                 raise UserWarning(
                     "Only {0} bytes of {1} bytes in {2} were written".format(
-                        wb, len(data), local_file
+                        wb, length, local_file
                     )
                 )
             return wb
 
+    def put_bundle(
+        self,
+        local_paths,
+        remote_archive,
+        compress=None,
+        compress_level=None,
+        mode=None,
+        rate_limit=None,
+        progress=None,
+    ):
+        """Copy many files to the submit machine as a single tar archive.
+
+        The archive is built on the fly and streamed with a series of writes
+        to one remote file, so sending many small files costs a single
+        transfer instead of a command per file, and nothing is staged on
+        local disk. Use fetch_bundle() to unpack it again.
+
+        :param local_paths: Path to a directory, whose contents are archived
+            relative to it, or a list of paths to files and directories,
+            which are archived recursively under their paths as given
+        :param remote_archive: Path to the archive on the submit machine
+        :param compress: Compress the archive with this method (one of
+            COMPRESSION_METHODS)
+        :param compress_level: Compression level [default: method's default]
+        :param mode: Permission mode to set [default: 0777]
+        :param rate_limit: Maximum rate of this transfer (see putfile())
+        :param progress: Progress callback (see putfile()), called with the
+            archive bytes sent and a total of None
+        :returns: Size of the written archive
+
+        """
+
+        if isinstance(local_paths, str) and os.path.isdir(local_paths):
+            members = [
+                (os.path.join(local_paths, name), name)
+                for name in sorted(os.listdir(local_paths))
+            ]
+        else:
+            if isinstance(local_paths, str):
+                local_paths = [local_paths]
+            members = [(path, None) for path in local_paths]
+
+        self._invalidate(remote_archive)
+
+        meter = self._meter(None, rate_limit, progress)
+        fd = self._open(remote_archive, "wct", mode)
+        try:
+            writer = _RemoteFileWriter(self, fd, compress, compress_level, meter)
+            with tarfile.open(fileobj=writer, mode="w|") as tar:
+                for (path, arcname) in members:
+                    tar.add(path, arcname)
+            writer.close()
+            self._fsync(fd)  # force the file to be written to disk
+        finally:
+            self._close(fd)
+
+        return writer.bytes_out
+
+    def fetch_bundle(
+        self, remote_archive, local_dir, decompress=True, rate_limit=None, progress=None
+    ):
+        """Unpack a tar archive from the submit machine into a local directory.
+
+        The archive is streamed from the server straight into the unpacked
+        files (see put_bundle()). Members that would be written outside of
+        local_dir are refused.
+
+        :param remote_archive: Path to the archive on the submit machine
+        :param local_dir: Directory to unpack into, created if needed
+        :param decompress: Decompress the archive on the fly (see fetch())
+        :param rate_limit: Maximum rate of this transfer (see getfile())
+        :param progress: Progress callback (see getfile())
+        :returns: List of the names of the unpacked members
+
+        """
+
+        if not os.path.isdir(local_dir):
+            os.makedirs(local_dir)
+
+        names = []
+
+        def checked_members(tar):
+            for member in tar:
+                if (not hasattr(tarfile, "data_filter")) and (
+                    os.path.isabs(member.name)
+                    or (".." in member.name.split("/"))
+                    or (
+                        (member.issym() or member.islnk())
+                        and (
+                            os.path.isabs(member.linkname)
+                            or (".." in member.linkname.split("/"))
+                        )
+                    )
+                ):
+                    raise ValueError(
+                        "Refusing to unpack {0} from {1}".format(
+                            member.name, remote_archive
+                        )
+                    )
+                names.append(member.name)
+                yield member
+
+        extract_options = {}
+        if hasattr(tarfile, "data_filter"):
+            extract_options["filter"] = "data"
+
+        reader = _ChunkReader(
+            self.iter_file(remote_archive, rate_limit=rate_limit, progress=progress),
+            decompress,
+        )
+        try:
+            with tarfile.open(fileobj=reader, mode="r|") as tar:
+                tar.extractall(local_dir, checked_members(tar), **extract_options)
+            reader.drain()  # the padding after the archive
+        finally:
+            # after an error, reset the connection instead of downloading the
+            # rest of the archive
+            reader.close()
+
+        return names
+
+    def put_incremental(self, local_file, remote_file, mode=None, sample_size=4096):
+        """Copy a growing file from the execute machine to the submit machine.
+
+        Only the bytes appended to local_file since it was last put are sent,
+        by writing the new tail at the end of the remote file. The already
+        transferred part is checked by comparing a sample of bytes at its
+        start and end. If the remote file does not exist, is larger than the
+        local file, or a sample does not match (e.g. the local file was
+        truncated or rewritten), the entire file is sent with putfile().
+
+        :param local_file: Path to file to be sent from the execute machine
+        :param remote_file: Path to file to be written to on the submit machine
+        :param mode: Permission mode to set [default: 0777]
+        :param sample_size: Number of bytes to compare at each sample point
+        :returns: Number of bytes sent
+
+        """
+
+        self._invalidate(remote_file)
+
+        try:
+            remote_size = self.stat(remote_file)["size"]
+        except self.DoesntExist:
+            return self.putfile(local_file, remote_file, mode)
+
+        with open(local_file, "rb") as rfd:
+            local_size = os.fstat(rfd.fileno()).st_size
+            if remote_size > local_size:
+                return self.putfile(local_file, remote_file, mode)
+
+            # compare the head and tail of what the remote side already has
+            sample_size = min(int(sample_size), remote_size)
+            samples = set([0, remote_size - sample_size])
+            fd = self._open(remote_file, "rw", mode)
+            try:
+                rewritten = False
+                for sample_offset in sorted(samples):
+                    rfd.seek(sample_offset)
+                    local_sample = rfd.read(sample_size)
+                    remote_sample = self._read(fd, sample_size, sample_offset)
+                    if remote_sample != local_sample:
+                        rewritten = True
+                        break
+                if rewritten:
+                    # the local file was rewritten, start over
+                    self._close(fd)
+                    fd = None
+                    return self.putfile(local_file, remote_file, mode)
+
+                # send the new tail
+                rfd.seek(remote_size)
+                bytes_sent = self._write_stream(fd, rfd, offset=remote_size)
+                if bytes_sent > 0:
+                    self._fsync(fd)
+            finally:
+                if fd is not None:
+                    self._close(fd)
+
+        return bytes_sent
+
     def remove(self, remote_file):
         """Remove a file from the submit machine.
 
@@ -648,6 +4086,7 @@ class HTChirp:
 
         self.unlink(remote_file)
 
+    @_control_command
     def get_job_attr(self, job_attribute):
         """Get the value of a job ClassAd attribute.
 
@@ -656,13 +4095,15 @@ class HTChirp:
 
         """
 
-        length = int(
-            self._simple_command("get_job_attr {0}\n".format(quote(job_attribute)))
-        )
-        result = self._get_fixed_data(length).decode()
+        with self._exchange():
+            length = int(
+                self._simple_command("get_job_attr {0}\n".format(quote(job_attribute)))
+            )
+            result = self._get_fixed_data(length).decode()
 
         return result
 
+    @_control_command
     def get_job_attr_delayed(self, job_attribute):
         """Get the value of a job ClassAd attribute from the local Starter.
 
@@ -673,15 +4114,17 @@ class HTChirp:
 
         """
 
-        length = int(
-            self._simple_command(
-                "get_job_attr_delayed {0}\n".format(quote(job_attribute))
+        with self._exchange():
+            length = int(
+                self._simple_command(
+                    "get_job_attr_delayed {0}\n".format(quote(job_attribute))
+                )
             )
-        )
-        result = self._get_fixed_data(length).decode()
+            result = self._get_fixed_data(length).decode()
 
         return result
 
+    @_control_command
     def set_job_attr(self, job_attribute, attribute_value):
         """Set the value of a job ClassAd attribute.
 
@@ -696,6 +4139,7 @@ class HTChirp:
             )
         )
 
+    @_control_command
     def set_job_attr_delayed(self, job_attribute, attribute_value):
         """Set the value of a job ClassAd attribute.
 
@@ -714,6 +4158,7 @@ class HTChirp:
             )
         )
 
+    @_control_command
     def ulog(self, text):
         """Log a generic string to the job log.
 
@@ -732,6 +4177,10 @@ class HTChirp:
 
         Optionally, start at an offset and/or retrieve data in strides.
 
+        If remote_path was given to prefetch(), reads without strides wait
+        for and use the prefetched copy. Otherwise, if the client has a
+        block_cache, reads without strides are served from it.
+
         :param remote_path: Path to file
         :param length: Number of bytes to read
         :param offset: Number of bytes to offset from beginning of file
@@ -741,12 +4190,123 @@ class HTChirp:
 
         """
 
-        fd = self._open(remote_path, "r")
-        data = self._read(fd, length, offset, stride_length, stride_skip)
-        self._close(fd)
+        if (stride_length, stride_skip) == (None, None):
+            prefetched = None
+            if self.prefetcher is not None:
+                prefetched = self.prefetcher._prefetched(remote_path)
+            if prefetched is not None:
+                with open(prefetched, "rb") as rfd:
+                    rfd.seek(int(offset or 0))
+                    return rfd.read(int(length))
+
+            if self.block_cache is not None:
+                return self._cached_read(remote_path, length, int(offset or 0))
+
+        (fd, key) = self._acquire_fd(remote_path, "r")
+        if (key is not None) and (offset is None):
+            offset = 0  # the position of a reused file is unknown
+        failed = True
+        try:
+            data = self._read(fd, length, offset, stride_length, stride_skip)
+            failed = False
+        finally:
+            self._release_fd(fd, key, failed)
 
         return data
 
+    def follow(
+        self,
+        remote_path,
+        from_start=False,
+        min_interval=0.1,
+        max_interval=5.0,
+        idle_timeout=None,
+        chunk_size=1048576,
+    ):
+        """Follow a growing file on the remote machine, like tail -f.
+
+        The file is kept open and its size is polled with stat, quickly while
+        it is growing and backing off to max_interval while it is not. Only
+        new bytes are read, with pread from the last offset. If the file is
+        truncated, reading starts over from the beginning. If it is replaced
+        (e.g. rotated), the rest of the old file is read before switching to
+        the new one.
+
+        No other commands may be sent between iterations, stop iterating (or
+        close() the iterator) to close the remote file.
+
+        :param remote_path: Path to file
+        :param from_start: If set to True, start with the existing contents
+            instead of only new data (a file that does not exist yet is
+            always read from the beginning once it is created)
+        :param min_interval: Shortest time between polls, in seconds
+        :param max_interval: Longest time between polls, in seconds
+        :param idle_timeout: Stop after this many seconds without new data
+            [default: never stop]
+        :param chunk_size: Maximum number of bytes per yielded chunk
+        :returns: Iterator of new data
+
+        """
+
+        fd = None
+        inode = None
+        offset = 0
+        first_poll = True
+        interval = min_interval
+        idle_since = time.time()
+
+        def read_to(fd, offset, end):
+            while (end is None) or (offset < end):
+                want = chunk_size if end is None else min(chunk_size, end - offset)
+                data = self._read(fd, want, offset)
+                if not data:
+                    break
+                offset += len(data)
+                yield data
+
+        try:
+            while True:
+                try:
+                    stats = self.stat(remote_path)
+                except self.DoesntExist:
+                    stats = None  # e.g. between rotation and recreation
+
+                grew = False
+                if stats is not None:
+                    if (fd is not None) and (stats.inode != inode):
+                        # replaced, finish the old file first
+                        for data in read_to(fd, offset, None):
+                            yield data
+                        self._close(fd)
+                        fd = None
+                        offset = 0
+                    if fd is None:
+                        if first_poll and not from_start:
+                            offset = stats.size
+                        fd = self._open(remote_path, "r")
+                        inode = stats.inode
+                    if stats.size < offset:  # truncated
+                        offset = 0
+                    for data in read_to(fd, offset, stats.size):
+                        offset += len(data)
+                        grew = True
+                        yield data
+                first_poll = False
+
+                if grew:
+                    interval = min_interval
+                    idle_since = time.time()
+                    continue
+                if (idle_timeout is not None) and (
+                    time.time() - idle_since >= idle_timeout
+                ):
+                    return
+                time.sleep(interval)
+                interval = min(interval * 2, max_interval)
+        finally:
+            if (fd is not None) and self.is_connected():
+                self._close(fd)
+
     def write(
         self,
         data,
@@ -757,13 +4317,18 @@ class HTChirp:
         offset=None,
         stride_length=None,
         stride_skip=None,
+        rate_limit=None,
+        progress=None,
+        compress=None,
+        compress_level=None,
     ):
         """Write bytes to a file on the remote matchine.
 
         Optionally, specify the number of bytes to write,
         start at an offset, and/or write data in strides.
 
-        :param data: Bytes to write
+        :param data: Bytes to write, or a readable binary file object to be
+            streamed in chunks
         :param remote_path: Path to file
         :param flags: File open modes (one or more of 'rwatcx') [default: 'w']
         :param mode: Permission mode to set [default: 0777]
@@ -771,7 +4336,15 @@ class HTChirp:
         :param offset: Number of bytes to offset from beginning of file
         :param stride_length: Number of bytes to write per stride
         :param stride_skip: Number of bytes to skip per stride
-        :returns: Number of bytes written
+        :param rate_limit: Maximum rate of this transfer, in bytes per second,
+            or a ChirpRateLimiter
+        :param progress: Callable called as progress(bytes_done, total, rate)
+            while data is sent, total is None if it is not known. When
+            compressing, bytes_done counts the uncompressed bytes.
+        :param compress: Compress the data on the fly with this method (one of
+            COMPRESSION_METHODS), length is then the uncompressed length
+        :param compress_level: Compression level [default: method's default]
+        :returns: Number of bytes written (compressed bytes, if compressing)
 
         """
 
@@ -785,15 +4358,65 @@ class HTChirp:
                 "'w' is not included in flags '{0}'".format("".join(flags))
             )
 
-        if length is None:
-            length = len(data)
-        else:
-            data = data[:length]
+        self._invalidate_data(remote_path)
+
+        total = length
+        if hasattr(data, "read"):
+            if total is None:
+                try:  # size of the rest of a local file
+                    total = os.fstat(data.fileno()).st_size - data.tell()
+                except (AttributeError, OSError, ValueError):
+                    pass
+        elif total is None:
+            total = len(data)
+
+        if compress:
+            if (offset, stride_length, stride_skip) != (None, None, None):
+                raise ValueError(
+                    "Compressed data cannot be written at an offset or in strides"
+                )
+            if not hasattr(data, "read"):
+                data = io.BytesIO(data[:length])
+            # report progress on the data read, limit the rate of data sent
+            data = _CompressingReader(
+                data,
+                compress,
+                compress_level,
+                length,
+                None if progress is None else _TransferMeter(total, (), progress),
+            )
+            (length, total, progress) = (None, None, None)
+
+        meter = self._meter(total, rate_limit, progress)
+        if (meter is not None) and not hasattr(data, "read"):
+            # send in metered chunks instead of all at once
+            data = io.BytesIO(data[:length])
+
+        (fd, key) = self._acquire_fd(remote_path, flags, mode)
+        if (key is not None) and (offset is None) and ("a" not in flags):
+            offset = 0  # the position of a reused file is unknown
+        failed = True
+        try:
+            if hasattr(data, "read"):
+                bytes_sent = self._write_stream(
+                    fd, data, length, offset, stride_length, stride_skip, meter
+                )
+                if meter is not None:
+                    meter.finish()
+            else:
+                if length is None:
+                    length = len(data)
+                else:
+                    data = data[:length]
 
-        fd = self._open(remote_path, flags, mode)
-        bytes_sent = self._write(fd, data, length, offset, stride_length, stride_skip)
-        self._fsync(fd)  # force the file to be written to disk
-        self._close(fd)
+                bytes_sent = self._write(
+                    fd, data, length, offset, stride_length, stride_skip
+                )
+            if key is None:
+                self._fsync(fd)  # force the file to be written to disk
+            failed = False
+        finally:
+            self._release_fd(fd, key, failed)
 
         return bytes_sent
 
@@ -807,6 +4430,7 @@ class HTChirp:
 
         """
 
+        self._invalidate(old_path, new_path)
         self._simple_command(
             "rename {0} {1}\n".format(quote(old_path), quote(new_path))
         )
@@ -818,6 +4442,7 @@ class HTChirp:
 
         """
 
+        self._invalidate(remote_file)
         self._simple_command("unlink {0}\n".format(quote(remote_file)))
 
     def rmdir(self, remote_path, recursive=False):
@@ -833,6 +4458,7 @@ class HTChirp:
         if recursive:
             self.rmall(remote_path)
         else:
+            self._invalidate(remote_path)
             self._simple_command("rmdir {0}\n".format(quote(remote_path)))
 
     def rmall(self, remote_path):
@@ -842,6 +4468,7 @@ class HTChirp:
 
         """
 
+        self._invalidate(remote_path)
         self._simple_command("rmall {0}\n".format(quote(remote_path)))
 
     def mkdir(self, remote_path, mode=None):
@@ -858,21 +4485,83 @@ class HTChirp:
 
         self._simple_command("mkdir {0} {1}\n".format(quote(remote_path), int(mode)))
 
-    def getfile(self, remote_file, local_file):
+    def getfile(
+        self, remote_file, local_file, sparse=False, rate_limit=None, progress=None
+    ):
         """Retrieve an entire file efficiently from the remote machine.
 
         :param remote_file: Path to file to be sent from remote machine
-        :param local_file: Path to file to be written to on local machine
+        :param local_file: Path to file to be written to on local machine, or
+            a writable file-like object, or a callable that accepts each chunk
+            of data
+        :param sparse: If set to True, skip over blocks of zeros instead of
+            writing them, leaving holes in the local file. local_file must be
+            a path or a seekable file object with no data past its current
+            position.
+        :param rate_limit: Maximum rate of this transfer, in bytes per second,
+            or a ChirpRateLimiter
+        :param progress: Callable called as progress(bytes_done, total, rate)
+            while data is received, where rate is in bytes per second
         :returns: Bytes written
 
         """
 
-        length = int(self._simple_command("getfile {0}\n".format(quote(remote_file))))
-        bytes_recv = self._get_fixed_data(length, local_file)
+        if sparse and callable(local_file) and not hasattr(local_file, "write"):
+            raise ValueError("A sparse getfile needs a path or a seekable file")
+
+        with self._exchange():
+            length = int(
+                self._simple_command("getfile {0}\n".format(quote(remote_file)))
+            )
+            meter = self._meter(length, rate_limit, progress)
+
+            if sparse and not hasattr(local_file, "write"):
+                with open(local_file, "wb") as fd:
+                    writer = _SparseWriter(fd)
+                    bytes_recv = self._get_fixed_data(length, writer, meter)
+                    writer.finish()
+            elif sparse:
+                writer = _SparseWriter(local_file)
+                bytes_recv = self._get_fixed_data(length, writer, meter)
+                writer.finish()
+            else:
+                bytes_recv = self._get_fixed_data(length, local_file, meter)
 
         return bytes_recv
 
-    def putfile(self, local_file, remote_file, mode=None):
+    def iter_file(self, remote_file, chunk_size=None, rate_limit=None, progress=None):
+        """Stream an entire file from the remote machine.
+
+        Chunks are memoryviews of a reused buffer and are only valid until the
+        next chunk is requested, copy them (e.g. with bytes()) to keep them.
+        Stopping early resets the connection. No other commands may be sent
+        until iteration is finished.
+
+        :param remote_file: Path to file to be sent from remote machine
+        :param chunk_size: Maximum number of bytes per chunk
+        :param rate_limit: Maximum rate of this transfer (see getfile())
+        :param progress: Progress callback (see getfile())
+        :returns: Iterator of memoryviews of file data
+
+        """
+
+        with self._exchange():
+            length = int(
+                self._simple_command("getfile {0}\n".format(quote(remote_file)))
+            )
+            meter = self._meter(length, rate_limit, progress)
+            for chunk in self._iter_fixed_data(length, chunk_size, meter):
+                yield chunk
+
+    def putfile(
+        self,
+        local_file,
+        remote_file,
+        mode=None,
+        sparse=False,
+        rate_limit=None,
+        progress=None,
+    ):
         """Store an entire file efficiently to the remote machine.
 
         This method will create or overwrite the file on the remote machine. If
@@ -881,10 +4570,23 @@ class HTChirp:
         :param local_file: Path to file to be sent from local machine
         :param remote_file: Path to file to be written to on remote machine
         :param mode: Permission mode to set [default: 0777]
+        :param sparse: If set to True, only send the parts of local_file that
+            hold data and skip its holes (see _putfile_sparse())
+        :param rate_limit: Maximum rate of this transfer, in bytes per second,
+            or a ChirpRateLimiter
+        :param progress: Callable called as progress(bytes_done, total, rate)
+            while data is sent, where rate is in bytes per second
         :returns: Size of written file
 
         """
 
+        self._invalidate(remote_file)
+
+        if sparse:
+            return self._putfile_sparse(
+                local_file, remote_file, mode, rate_limit, progress
+            )
+
         # check that client is connected
         self._check_connection()
 
@@ -895,22 +4597,30 @@ class HTChirp:
         # get file size
         length = os.stat(local_file).st_size
         bytes_sent = 0
+        meter = self._meter(length, rate_limit, progress)
 
-        # send the file
-        self._simple_command(
-            "putfile {0} {1} {2}\n".format(quote(remote_file), int(mode), int(length))
-        )
-        wfd = self.socket.makefile("wb")  # open socket as a file object
-        with open(local_file, "rb") as rfd:
-            data = rfd.read(self.__class__.CHIRP_LINE_MAX)
-            while data:  # write to socket CHIRP_LINE_MAX bytes at a time
-                wfd.write(data)
-                bytes_sent += len(data)
-                data = rfd.read(self.__class__.CHIRP_LINE_MAX)
-        wfd.close()
+        with self._exchange(exclusive=True):
+            # send the file, no other requests may be sent until it is done
+            self._simple_command(
+                "putfile {0} {1} {2}\n".format(
+                    quote(remote_file), int(mode), int(length)
+                )
+            )
+            with open(local_file, "rb") as rfd:
+                while bytes_sent < length:  # send chunk_size bytes at a time
+                    sent = self.socket.sendfile(
+                        rfd, bytes_sent, min(self.chunk_size, length - bytes_sent)
+                    )
+                    if sent == 0:
+                        break  # the file was truncated while sending
+                    bytes_sent += sent
+                    if meter is not None:
+                        meter.update(sent)
+            if meter is not None:
+                meter.finish()
 
-        # the chirp server will return the number of bytes it received
-        bytes_recv = int(self._simple_response())
+            # the chirp server will return the number of bytes it received
+            bytes_recv = int(self._simple_response())
 
         # check bytes
         if (bytes_recv != bytes_sent) or (bytes_recv != length):
@@ -922,47 +4632,142 @@ class HTChirp:
 
         return bytes_recv
 
-    def getlongdir(self, remote_path):
+    def _putfile_sparse(
+        self, local_file, remote_file, mode=None, rate_limit=None, progress=None
+    ):
+        """Store a sparse file to the remote machine.
+
+        The data extents of local_file are found with SEEK_DATA/SEEK_HOLE and
+        written with pwrite, then the remote file is truncated to the full
+        length. Whether the holes stay sparse on the remote machine is up to
+        its file system.
+
+        :param local_file: Path to file to be sent from local machine
+        :param remote_file: Path to file to be written to on remote machine
+        :param mode: Permission mode to set [default: 0777]
+        :param rate_limit: Maximum rate of this transfer (see putfile())
+        :param progress: Progress callback, total is the number of bytes of
+            data (see putfile())
+        :returns: Size of written file
+
+        """
+
+        length = os.stat(local_file).st_size
+        extents = _data_extents(local_file, length)
+        data_length = sum(end - start for (start, end) in extents)
+        meter = self._meter(data_length, rate_limit, progress)
+
+        bytes_sent = 0
+        with open(local_file, "rb") as rfd:
+            fd = self._open(remote_file, "wct", mode)
+            try:
+                for (start, end) in extents:
+                    rfd.seek(start)
+                    bytes_sent += self._write_stream(
+                        fd, rfd, end - start, start, meter=meter
+                    )
+                if meter is not None:
+                    meter.finish()
+                self._fsync(fd)
+            finally:
+                self._close(fd)
+        self.truncate(remote_file, length)
+
+        # check bytes
+        if bytes_sent != data_length:
+            raise RuntimeWarning(
+                "File on disk has {0} B of data, chirp server received {1} B".format(
+                    data_length, bytes_sent
+                )
+            )
+
+        return length
+
+    def getlongdir(self, remote_path, columnar=False):
         """List a directory and all its file metadata on the remote machine.
 
         :param remote_path: Path to directory
-        :returns: A dict of file metadata
-
-        """
-
-        names = [
-            "device",
-            "inode",
-            "mode",
-            "nlink",
-            "uid",
-            "gid",
-            "rdevice",
-            "size",
-            "blksize",
-            "blocks",
-            "atime",
-            "mtime",
-            "ctime",
-        ]
+        :param columnar: If set to True, return a ChirpDirColumns
+        :returns: A dict of file names and ChirpStat, unless columnar is True
+        :raises ChirpError: If the listing is truncated
 
-        length = int(
-            self._simple_command("getlongdir {0}\n".format(quote(remote_path)))
-        )
-        result = self._get_fixed_data(length).decode()
+        """
 
-        results = result.rstrip().split("\n")
-        files = results[::2]
-        stat_dicts = [
-            dict(zip(names, [int(x) for x in s.split()])) for s in results[1::2]
-        ]
-        return dict(zip(files, stat_dicts))
+        if columnar:
+            listing = ChirpDirColumns()
+            for (name, line) in self._iter_longdir_lines(remote_path):
+                listing.append(name, line)
+            return listing
+
+        return dict(self.iterlongdir(remote_path))
+
+    def _iter_longdir_lines(self, remote_path):
+        """Iterate over the (name, metadata line) pairs of a getlongdir response"""
+
+        with self._exchange():
+            length = int(
+                self._simple_command("getlongdir {0}\n".format(quote(remote_path)))
+            )
+            lines = (line for line in self._iter_lines(length) if line)
+            for name in lines:
+                line = next(lines, None)
+                if line is None:
+                    raise self.ChirpError(
+                        "Truncated getlongdir response for {0}: no metadata for "
+                        "{1}".format(remote_path, name)
+                    )
+                yield (name, line)
+
+    def iterlongdir(self, remote_path):
+        """Iterate over a directory and its file metadata on the remote machine.
+
+        Entries are parsed and yielded as the listing arrives. No other
+        commands may be sent until iteration is finished, stopping early
+        resets the connection.
+
+        :param remote_path: Path to directory
+        :returns: Iterator of (file name, ChirpStat) tuples
+        :raises ChirpError: If the listing is truncated
+
+        """
+
+        lines = self._iter_longdir_lines(remote_path)
+        try:
+            for (name, line) in lines:
+                yield (name, ChirpStat.from_line(line))
+        finally:
+            lines.close()
+
+    def iterdir(self, remote_path):
+        """Iterate over a directory on the remote machine.
+
+        Names are yielded as the listing arrives. No other commands may be
+        sent until iteration is finished, stopping early resets the
+        connection.
+
+        :param remote_path: Path to directory
+        :returns: Iterator of file names
+
+        """
+
+        with self._exchange():
+            length = int(
+                self._simple_command("getdir {0}\n".format(quote(remote_path)))
+            )
+            lines = self._iter_lines(length)
+            try:
+                for name in lines:
+                    if name:
+                        yield name
+            finally:
+                lines.close()
 
     def getdir(self, remote_path, stat_dict=False):
         """List a directory on the remote machine.
 
         :param remote_path: Path to directory
-        :param stat_dict: If set to True, return a dict of file metadata
+        :param stat_dict: If set to True, return a dict of file names and
+            ChirpStat (see getlongdir())
         :returns: List of files, unless stat_dict is True
 
         """
@@ -970,14 +4775,367 @@ class HTChirp:
         if stat_dict == True:
             return self.getlongdir(remote_path)
         else:
-            length = int(
-                self._simple_command("getdir {0}\n".format(quote(remote_path)))
+            return list(self.iterdir(remote_path))
+
+    def scandir(self, remote_path):
+        """List a directory on the remote machine with file metadata.
+
+        Like os.scandir(), but the entries are read at once and the '.' and
+        '..' entries are left out.
+
+        :param remote_path: Path to directory
+        :returns: List of ChirpDirEntry
+
+        """
+
+        return [
+            ChirpDirEntry(remote_path, name, stats)
+            for (name, stats) in self.iterlongdir(remote_path)
+            if name not in (".", "..")
+        ]
+
+    def _scandir_many(self, remote_paths, workers, clients):
+        """List several directories, over parallel connections if workers > 1
+
+        :param remote_paths: List of paths to directories
+        :param workers: Maximum number of connections to use (see _workers())
+        :param clients: List of connected clones to reuse, new clones are
+            appended to it (the caller must disconnect them)
+        :returns: List of (path, list of ChirpDirEntry or ChirpError)
+
+        """
+
+        def scandir(client, remote_path):
+            try:
+                return (remote_path, self._run(client.scandir, remote_path))
+            except self.ChirpError as e:
+                return (remote_path, e)
+
+        workers = self._workers(workers, 4)
+        if workers <= 1 or len(remote_paths) <= 1:
+            return [scandir(self, remote_path) for remote_path in remote_paths]
+
+        lock = threading.Lock()
+        free = list(clients)
+
+        def task(remote_path):
+            with lock:
+                client = free.pop() if free else None
+            if client is None:
+                client = self._clone()
+                client.connect()
+                with lock:
+                    clients.append(client)
+            try:
+                return scandir(client, remote_path)
+            finally:
+                with lock:
+                    free.append(client)
+
+        with ThreadPoolExecutor(min(workers, len(remote_paths))) as executor:
+            return list(executor.map(task, remote_paths))
+
+    def walk(self, top, topdown=True, onerror=None, workers=None, followlinks=False):
+        """Walk a directory tree on the remote machine, like os.walk().
+
+        Unlike os.walk(), the tree is walked breadth-first: it is listed one
+        level at a time, with the directories of each level listed in parallel
+        over up to `workers` extra connections. As with os.walk(), when
+        topdown is True, dirnames may be modified in place to skip
+        directories, and symbolic links to directories are listed in dirnames
+        but not walked into unless followlinks is True. A directory that was
+        already walked (e.g. through a link cycle) is never walked again.
+
+        :param top: Path to top directory
+        :param topdown: If set to False, yield directories after their
+            subdirectories
+        :param onerror: Function to call with the ChirpError raised when a
+            directory cannot be listed [default: skip the directory]
+        :param workers: Maximum number of directories to list at once
+            [default: set by the concurrency controller, or 4]
+        :param followlinks: If set to True, walk into symbolic links to
+            directories
+        :returns: Iterator of (dirpath, dirnames, filenames) tuples
+
+        """
+
+        clients = []
+        bottom_up = []
+        seen = set()  # (device, inode) of the directories walked into
+        try:
+            top_stats = self.stat(top)
+            seen.add((top_stats.device, top_stats.inode))
+        except self.ChirpError:
+            pass  # reported by listing it
+        try:
+            level = [top]
+            while level:
+                next_level = []
+                for (dirpath, entries) in self._scandir_many(level, workers, clients):
+                    if isinstance(entries, self.ChirpError):
+                        if onerror is not None:
+                            onerror(entries)
+                        continue
+                    subdirs = dict(
+                        (entry.name, entry) for entry in entries if entry.is_dir()
+                    )
+                    dirnames = list(subdirs)
+                    filenames = [entry.name for entry in entries if not entry.is_dir()]
+                    if topdown:
+                        yield (dirpath, dirnames, filenames)
+                    else:
+                        bottom_up.append((dirpath, dirnames, filenames))
+                    for dirname in dirnames:
+                        entry = subdirs.get(dirname)
+                        if entry is not None:  # else added by the caller
+                            ident = (entry.stat().device, entry.stat().inode)
+                            if ident in seen:
+                                continue
+                            seen.add(ident)
+                        next_level.append(posixpath.join(dirpath, dirname))
+                if next_level and not followlinks:
+                    # listings stat through links, lstat to find them
+                    next_level = [
+                        path
+                        for (path, stats) in zip(
+                            next_level, self.lstat_many(next_level)
+                        )
+                        if isinstance(stats, self.ChirpError)
+                        or not stat.S_ISLNK(stats.mode)
+                    ]
+                level = next_level
+        finally:
+            for client in clients:
+                client.disconnect()
+
+        for result in reversed(bottom_up):
+            yield result
+
+    def _copy(self, reader, src, dst, mode=None, preserve=False, max_inflight=8):
+        """Copy a remote file, reading it with another connected client
+
+        Files larger than chunk_size are read by a thread streaming getfile on
+        reader, while this client writes them in chunks of chunk_size bytes,
+        so reads and writes overlap with at most max_inflight chunks held in
+        memory.
+
+        :returns: Number of bytes copied
+        :raises ChirpError: If the server writes fewer bytes than sent
+
+        """
+
+        stats = reader.stat(src)
+        try:
+            dst_stats = self.stat(dst)
+        except self.DoesntExist:
+            dst_stats = None
+        if (dst_stats is not None) and (
+            (dst_stats["device"], dst_stats["inode"])
+            == (stats["device"], stats["inode"])
+        ):
+            # opening dst would truncate src
+            raise self.InvalidRequest("{0} and {1} are the same file".format(src, dst))
+        if preserve and (mode is None):
+            mode = stats["mode"] & 0o7777
+
+        self._invalidate(dst)
+        fd = self._open(dst, "wct", mode)
+
+        def write(data):
+            wb = self._write(fd, data, len(data))
+            if wb < len(data):
+                raise self.ChirpError(
+                    "Only {0} bytes of {1} bytes were written to {2}".format(
+                        wb, len(data), dst
+                    )
+                )
+            return wb
+
+        try:
+            bytes_copied = 0
+            if stats["size"] <= self.chunk_size:
+                # a single round trip each way, not worth a thread
+                data = io.BytesIO()
+                reader.getfile(src, data)
+                if data.tell() > 0:
+                    bytes_copied = write(data.getvalue())
+            else:
+                chunks = queue.Queue(max(1, int(max_inflight)))
+                stop = threading.Event()
+
+                def put(item):
+                    while not stop.is_set():
+                        try:
+                            chunks.put(item, timeout=0.1)
+                            return True
+                        except queue.Full:
+                            pass
+                    return False
+
+                def read():
+                    try:
+                        # collect received chunks into writes of chunk_size
+                        buffer = bytearray()
+                        for chunk in reader.iter_file(src):
+                            buffer += chunk
+                            while len(buffer) >= self.chunk_size:
+                                if not put(bytes(buffer[: self.chunk_size])):
+                                    return  # stopping early resets the connection
+                                del buffer[: self.chunk_size]
+                        if buffer:
+                            put(bytes(buffer))
+                        put(None)
+                    except Exception as e:
+                        put(e)
+
+                thread = threading.Thread(target=read)
+                thread.daemon = True
+                thread.start()
+                try:
+                    while True:
+                        chunk = chunks.get()
+                        if chunk is None:
+                            break
+                        elif isinstance(chunk, Exception):
+                            raise chunk
+                        bytes_copied += write(chunk)
+                finally:
+                    stop.set()
+                    thread.join()
+            self._fsync(fd)  # force the file to be written to disk
+        finally:
+            self._close(fd)
+
+        if preserve:
+            self.chmod(dst, mode)
+            self.utime(dst, stats["atime"], stats["mtime"])
+
+        return bytes_copied
+
+    def copy(self, src, dst, mode=None, preserve=False, max_inflight=8):
+        """Copy a file on the remote machine to another remote path.
+
+        Chirp has no copy command, so the file is streamed through this
+        machine without being stored on local disk: a second connection reads
+        it while this one writes it.
+
+        :param src: Path to the file to copy
+        :param dst: Path to the copy, which is created or truncated
+        :param mode: Permission mode to set [default: 0777, or the mode of
+            src if preserve is set]
+        :param preserve: If set to True, also copy the permission mode and
+            the access and modification times of src
+        :param max_inflight: Maximum number of chunks (of chunk_size bytes)
+            read but not yet written
+        :returns: Number of bytes copied
+        :raises InvalidRequest: If src and dst are the same file
+
+        """
+
+        reader = self._clone()
+        reader.connect()
+        try:
+            return self._copy(reader, src, dst, mode, preserve, max_inflight)
+        finally:
+            reader.disconnect()
+
+    def copytree(self, src, dst, preserve=False, workers=None, max_inflight=8):
+        """Recursively copy a directory on the remote machine (see copy()).
+
+        Up to `workers` files are copied at once, each over a pair of extra
+        connections. Directories that already exist are reused, and files
+        in them are overwritten. Symbolic links are followed, but a directory
+        reached again through a link is only created, not copied again.
+
+        :param src: Path to the directory to copy
+        :param dst: Path to the copy
+        :param preserve: If set to True, also copy permission modes and
+            access and modification times
+        :param workers: Maximum number of files to copy at once
+            [default: set by the concurrency controller, or 4]
+        :param max_inflight: Maximum number of chunks in memory per file
+        :returns: Number of bytes copied
+        :raises InvalidRequest: If dst is src or a path inside it
+
+        """
+
+        # the walk would otherwise also copy the copy as it is created
+        src_prefix = posixpath.normpath(src).rstrip("/") + "/"
+        if (posixpath.normpath(dst) + "/").startswith(src_prefix):
+            raise self.InvalidRequest(
+                "Cannot copy {0} into itself ({1})".format(src, dst)
             )
-            result = self._get_fixed_data(length).decode()
 
-            files = result.rstrip().split("\n")
-            return files
+        def makedir(src_dir, dst_dir):
+            mode = self.stat(src_dir)["mode"] & 0o7777 if preserve else None
+            try:
+                self.mkdir(dst_dir, mode)
+            except self.AlreadyExists:
+                pass
+            if preserve:
+                self.chmod(dst_dir, mode)
+
+        makedir(src, dst)
+        dirs = [(src, dst)]
+        files = []
+        for (dirpath, dirnames, filenames) in self.walk(
+            src, workers=workers, followlinks=True
+        ):
+            target = posixpath.normpath(
+                posixpath.join(dst, posixpath.relpath(dirpath, src))
+            )
+            for dirname in dirnames:
+                dirs.append(
+                    (posixpath.join(dirpath, dirname), posixpath.join(target, dirname))
+                )
+                makedir(*dirs[-1])
+            for filename in filenames:
+                files.append(
+                    (
+                        posixpath.join(dirpath, filename),
+                        posixpath.join(target, filename),
+                    )
+                )
+
+        lock = threading.Lock()
+        clients = []
+        free = []
+
+        def task(paths):
+            with lock:
+                pair = free.pop() if free else None
+            if pair is None:
+                pair = (self._clone(), self._clone())
+                with lock:
+                    clients.extend(pair)
+                for client in pair:
+                    client.connect()
+            bytes_copied = self._run(
+                pair[0]._copy, pair[1], paths[0], paths[1], None, preserve, max_inflight
+            )
+            if self.concurrency is not None:
+                self.concurrency.transferred(bytes_copied)
+            with lock:
+                free.append(pair)  # only reuse clients that did not fail
+            return bytes_copied
 
+        try:
+            workers = min(self._workers(workers, 4), len(files) or 1)
+            with ThreadPoolExecutor(workers) as executor:
+                bytes_copied = sum(executor.map(task, files))
+        finally:
+            for client in clients:
+                client.disconnect()
+
+        if preserve:
+            # after the files, as adding them changed the modification times
+            for (src_dir, dst_dir) in reversed(dirs):
+                stats = self.stat(src_dir)
+                self.utime(dst_dir, stats["atime"], stats["mtime"])
+
+        return bytes_copied
+
+    @_control_command
     def whoami(self):
         """Get the user's current identity with respect to this server.
 
@@ -985,13 +5143,17 @@ class HTChirp:
 
         """
 
-        length = int(
-            self._simple_command("whoami {0}\n".format(self.__class__.CHIRP_LINE_MAX))
-        )
-        result = self._get_fixed_data(length).decode()
+        with self._exchange():
+            length = int(
+                self._simple_command(
+                    "whoami {0}\n".format(self.__class__.CHIRP_LINE_MAX)
+                )
+            )
+            result = self._get_fixed_data(length).decode()
 
         return result
 
+    @_control_command
     def whoareyou(self, remote_host):
         """Get the server's identity with respect to the remote host.
 
@@ -1000,14 +5162,15 @@ class HTChirp:
 
         """
 
-        length = int(
-            self._simple_command(
-                "whoareyou {0} {1}\n".format(
-                    quote(remote_host), self.__class__.CHIRP_LINE_MAX
+        with self._exchange():
+            length = int(
+                self._simple_command(
+                    "whoareyou {0} {1}\n".format(
+                        quote(remote_host), self.__class__.CHIRP_LINE_MAX
+                    )
                 )
             )
-        )
-        result = self._get_fixed_data(length).decode()
+            result = self._get_fixed_data(length).decode()
 
         return result
 
@@ -1047,104 +5210,66 @@ class HTChirp:
 
         """
 
-        length = self._simple_command(
-            "readlink {0} {1}\n".format(
-                quote(remote_path), self.__class__.CHIRP_LINE_MAX
+        with self._exchange():
+            length = self._simple_command(
+                "readlink {0} {1}\n".format(
+                    quote(remote_path), self.__class__.CHIRP_LINE_MAX
+                )
             )
-        )
-        result = self._get_fixed_data(length)
+            result = self._get_fixed_data(length)
 
         return result
 
+    @_control_command
     def stat(self, remote_path):
         """Get metadata for file on the remote machine.
 
         If remote_path is a symbolic link, examine its target.
 
         :param remote_path: Path to file
-        :returns: Dict of file metadata
-
-        """
-
-        names = [
-            "device",
-            "inode",
-            "mode",
-            "nlink",
-            "uid",
-            "gid",
-            "rdevice",
-            "size",
-            "blksize",
-            "blocks",
-            "atime",
-            "mtime",
-            "ctime",
-        ]
+        :returns: ChirpStat of file metadata
+
+        """
 
-        response = self._simple_command("stat {0}\n".format(quote(remote_path)))
-        result = str(self._get_line_data()).rstrip()
-        while len(result.split()) < len(names):
-            result += " " + str(self._get_line_data()).rstrip()
+        with self._exchange():
+            response = self._simple_command("stat {0}\n".format(quote(remote_path)))
+            result = self._get_stat_fields(len(ChirpStat._fields))
 
-        results = [int(x) for x in result.split()]
-        return dict(zip(names, results))
+        return ChirpStat.from_line(result)
 
+    @_control_command
     def lstat(self, remote_path):
         """Get metadata for file on the remote machine.
 
         If remote path is a symbolic link, examine the link.
 
         :param remote_path: Path to file
-        :returns: Dict of file metadata
-
-        """
-
-        names = [
-            "device",
-            "inode",
-            "mode",
-            "nlink",
-            "uid",
-            "gid",
-            "rdevice",
-            "size",
-            "blksize",
-            "blocks",
-            "atime",
-            "mtime",
-            "ctime",
-        ]
+        :returns: ChirpStat of file metadata
+
+        """
 
-        response = self._simple_command("lstat {0}\n".format(quote(remote_path)))
-        result = str(self._get_line_data()).rstrip()
-        while len(result.split()) < len(names):
-            result += " " + str(self._get_line_data()).rstrip()
+        with self._exchange():
+            response = self._simple_command("lstat {0}\n".format(quote(remote_path)))
+            result = self._get_stat_fields(len(ChirpStat._fields))
 
-        results = [int(x) for x in result.split()]
-        stats = dict(zip(names, results))
-        return stats
+        return ChirpStat.from_line(result)
 
+    @_control_command
     def statfs(self, remote_path):
         """Get metadata for a file system on the remote machine.
 
         :param remote_path: Path to examine
-        :returns: Dict of filesystem metadata
+        :returns: ChirpStatFS of filesystem metadata
 
         """
 
-        names = ["type", "bsize", "blocks", "bfree", "bavail", "files", "free"]
-        names = ["f_" + x for x in names]
+        with self._exchange():
+            response = self._simple_command("statfs {0}\n".format(quote(remote_path)))
+            result = self._get_stat_fields(len(ChirpStatFS._fields))
 
-        response = self._simple_command("statfs {0}\n".format(quote(remote_path)))
-        result = self._get_line_data().rstrip()
-        while len(result.split()) < len(names):
-            result += " " + self._get_line_data().rstrip()
-
-        results = [int(x) for x in result.split()]
-        stats = dict(zip(names, results))
-        return stats
+        return ChirpStatFS.from_line(result)
 
+    @_control_command
     def access(self, remote_path, mode_str):
         """Check access permissions.
 
@@ -1154,6 +5279,14 @@ class HTChirp:
 
         """
 
+        mode = self._access_mode(mode_str)
+
+        self._simple_command("access {0} {1}\n".format(quote(remote_path), int(mode)))
+
+    @staticmethod
+    def _access_mode(mode_str):
+        """Convert access modes (one or more of 'frwx') to a mode number"""
+
         modes = {"f": 0, "r": stat.S_IROTH, "w": stat.S_IWOTH, "x": stat.S_IXOTH}
 
         mode = 0
@@ -1161,8 +5294,137 @@ class HTChirp:
             if m not in modes:
                 raise ValueError("mode '{0}' not in (fxwr)".format(m))
             mode = mode | modes[m]
+        return mode
 
-        self._simple_command("access {0} {1}\n".format(quote(remote_path), int(mode)))
+    def stat_many(self, remote_paths, window=None, listing_threshold=32):
+        """Get metadata for many files on the remote machine.
+
+        The stat commands are pipelined (see lstat_many()). When at least
+        listing_threshold of the paths are in the same directory, that
+        directory is listed once with getlongdir instead, except for entries
+        that are symbolic links.
+
+        :param remote_paths: List of paths to files
+        :param window: Maximum number of commands sent before reading
+            [default: set by the concurrency controller, or 64]
+        :param listing_threshold: Number of paths in one directory for which a
+            listing is used, 0 to never use listings
+        :returns: List with a ChirpStat, or the ChirpError raised, for each path
+
+        """
+
+        remote_paths = list(remote_paths)
+        results = [None] * len(remote_paths)
+        pending = set(range(len(remote_paths)))
+
+        if listing_threshold:
+            by_parent = {}
+            for (i, remote_path) in enumerate(remote_paths):
+                (parent, name) = posixpath.split(remote_path)
+                if name and name not in (".", ".."):
+                    by_parent.setdefault(parent or ".", []).append(i)
+            for (parent, indices) in by_parent.items():
+                if len(indices) < listing_threshold:
+                    continue
+                try:
+                    listing = self.getlongdir(parent)
+                except self.ChirpError:
+                    continue  # stat the paths one at a time instead
+                for i in indices:
+                    stats = listing.get(posixpath.basename(remote_paths[i]))
+                    if stats is None:
+                        results[i] = self.DoesntExist(
+                            "There is no object by that name."
+                        )
+                        pending.discard(i)
+                    elif not stat.S_ISLNK(stats.mode):
+                        results[i] = stats
+                        pending.discard(i)
+
+        pending = sorted(pending)
+        stats = self._stat_many("stat", [remote_paths[i] for i in pending], window)
+        for (i, result) in zip(pending, stats):
+            results[i] = result
+
+        return results
+
+    def lstat_many(self, remote_paths, window=None):
+        """Get metadata for many files on the remote machine.
+
+        The lstat commands are pipelined: up to `window` of them are sent
+        before the responses are read, so a round trip is paid per window
+        instead of per path. A path that cannot be examined does not stop the
+        others.
+
+        :param remote_paths: List of paths to files
+        :param window: Maximum number of commands sent before reading
+            [default: set by the concurrency controller, or 64]
+        :returns: List with a ChirpStat, or the ChirpError raised, for each path
+
+        """
+
+        return self._stat_many("lstat", list(remote_paths), window)
+
+    def _stat_many(self, command, remote_paths, window):
+        """Pipeline stat or lstat commands (see lstat_many())"""
+
+        cmds = [
+            "{0} {1}\n".format(command, quote(remote_path))
+            for remote_path in remote_paths
+        ]
+        return self._pipeline(
+            cmds,
+            lambda response: ChirpStat.from_line(
+                self._get_stat_fields(len(ChirpStat._fields))
+            ),
+            window,
+        )
+
+    def access_many(self, remote_paths, mode_str, window=None):
+        """Check access permissions for many files.
+
+        The access commands are pipelined (see lstat_many()).
+
+        :param remote_paths: List of paths to examine
+        :param mode_str: Mode to check (one or more of 'frwx')
+        :param window: Maximum number of commands sent before reading
+            [default: set by the concurrency controller, or 64]
+        :returns: List with True if authorized, False if not authorized, or
+            any other ChirpError raised, for each path
+
+        """
+
+        mode = self._access_mode(mode_str)
+        cmds = [
+            "access {0} {1}\n".format(quote(remote_path), int(mode))
+            for remote_path in remote_paths
+        ]
+        results = self._pipeline(cmds, lambda response: True, window)
+        return [
+            False if isinstance(result, self.NotAuthorized) else result
+            for result in results
+        ]
+
+    def exists_many(self, remote_paths, window=None, listing_threshold=32):
+        """Check if many files exist on the remote machine.
+
+        :param remote_paths: List of paths to examine
+        :param window: Maximum number of commands sent before reading
+            [default: set by the concurrency controller, or 64]
+        :param listing_threshold: See stat_many()
+        :returns: List with True if the path exists, False if it (or one of
+            its parents) does not, or any other ChirpError raised, for each
+            path
+
+        """
+
+        results = self.stat_many(remote_paths, window, listing_threshold)
+        for (i, result) in enumerate(results):
+            if isinstance(result, ChirpStat):
+                results[i] = True
+            elif isinstance(result, (self.DoesntExist, self.NotDir)):
+                results[i] = False
+        return results
 
     def chmod(self, remote_path, mode):
         """Change permission mode of a path on the remote machine.
@@ -1212,6 +5474,7 @@ class HTChirp:
 
         """
 
+        self._invalidate(remote_path)
         self._simple_command(
             "truncate {0} {1}\n".format(quote(remote_path), int(length))
         )
@@ -1292,6 +5555,157 @@ class HTChirp:
         pass
 
 
+def _parse_size(size):
+    """Parse a size in bytes with an optional K, M or G (binary) suffix"""
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    size = str(size).strip().upper().rstrip("B")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def _format_size(size):
+    """Format a size in bytes with a binary suffix, e.g. 16 MiB"""
+    for (unit, factor) in (("GiB", 1 << 30), ("MiB", 1 << 20), ("KiB", 1 << 10)):
+        if size >= factor and size % factor == 0:
+            return "{0} {1}".format(size // factor, unit)
+    return "{0} B".format(size)
+
+
+def _timings(seconds):
+    """Summarize a list of durations, in seconds"""
+    seconds = sorted(seconds)
+    return {
+        "min": seconds[0],
+        "median": seconds[len(seconds) // 2],
+        "max": seconds[-1],
+        "count": len(seconds),
+    }
+
+
+def _chirp_bench(chirp, remote_dir="", sizes=(4096, 1048576, 16777216), count=10):
+    """Measure the latency and throughput of a Chirp server from a job
+
+    Scratch files named htchirp-bench-* are written in remote_dir and
+    removed afterwards.
+
+    :param chirp: Connected HTChirp client
+    :param remote_dir: Remote directory for the scratch files [default: the
+        working directory of the Chirp server]
+    :param sizes: Sizes of the files sent with putfile and read with getfile
+    :param count: Number of times each measurement is repeated
+    :returns: Dict of results, times are in seconds and rates in bytes or
+        commands per second
+
+    """
+
+    count = max(1, int(count))
+    scratch = posixpath.join(
+        remote_dir, "htchirp-bench-{0}-{1}".format(socket.gethostname(), os.getpid())
+    )
+    results = {"server": "{0}:{1}".format(chirp.host, chirp.port)}
+
+    # connect and authenticate
+    seconds = []
+    for _ in range(count):
+        client = chirp._clone()
+        start = time.time()
+        client.connect()
+        seconds.append(time.time() - start)
+        client.disconnect()
+    results["connect"] = _timings(seconds)
+
+    # round trips of commands that do no work on the server
+    for (name, command) in (
+        ("whoami", chirp.whoami),
+        ("access", lambda: chirp.access(remote_dir or ".", "f")),
+    ):
+        seconds = []
+        for _ in range(count):
+            start = time.time()
+            command()
+            seconds.append(time.time() - start)
+        results[name] = _timings(seconds)
+
+    # pipelined commands
+    commands = 64 * count
+    start = time.time()
+    chirp.access_many([remote_dir or "."] * commands, "f", window=64)
+    elapsed = time.time() - start
+    results["pipelined"] = {
+        "commands": commands,
+        "window": 64,
+        "seconds": elapsed,
+        "rate": commands / elapsed if elapsed > 0 else None,
+    }
+
+    # bulk transfers
+    results["transfers"] = []
+    (fd, local_file) = tempfile.mkstemp(prefix="htchirp-bench-")
+    os.close(fd)
+    block = os.urandom(65536)  # incompressible, in case of compression
+    try:
+        for size in sizes:
+            with open(local_file, "wb") as f:
+                for offset in range(0, size, len(block)):
+                    f.write(block[: size - offset])
+            transfer = {"size": size}
+            for (name, command) in (
+                ("putfile", lambda: chirp.putfile(local_file, scratch)),
+                ("getfile", lambda: chirp.getfile(scratch, lambda data: None)),
+            ):
+                seconds = []
+                for _ in range(max(1, min(count, (256 << 20) // max(size, 1)))):
+                    start = time.time()
+                    command()
+                    seconds.append(time.time() - start)
+                transfer[name] = _timings(seconds)
+                transfer[name]["rate"] = (
+                    size / transfer[name]["median"]
+                    if transfer[name]["median"] > 0
+                    else None
+                )
+            results["transfers"].append(transfer)
+    finally:
+        os.unlink(local_file)
+        try:
+            chirp.unlink(scratch)
+        except chirp.DoesntExist:
+            pass
+
+    return results
+
+
+def _bench_summary(results):
+    """Format the results of _chirp_bench() for humans"""
+
+    def ms(timings):
+        return "min {0:8.3f} ms, median {1:8.3f} ms".format(
+            timings["min"] * 1000, timings["median"] * 1000
+        )
+
+    lines = [
+        "Chirp server {0}".format(results["server"]),
+        "  connect+auth      {0}".format(ms(results["connect"])),
+        "  whoami            {0}".format(ms(results["whoami"])),
+        "  access            {0}".format(ms(results["access"])),
+        "  pipelined access  {0:.0f} commands/s (window of {1})".format(
+            results["pipelined"]["rate"] or 0, results["pipelined"]["window"]
+        ),
+    ]
+    for transfer in results["transfers"]:
+        for name in ("putfile", "getfile"):
+            lines.append(
+                "  {0} {1:<8}  {2}, {3:.1f} MB/s".format(
+                    name,
+                    _format_size(transfer["size"]),
+                    ms(transfer[name]),
+                    (transfer[name]["rate"] or 0) / 1e6,
+                )
+            )
+    return "\n".join(lines)
+
+
 def condor_chirp(chirp_args, return_exit_code=False):
     """Call HTChirp methods using condor_chirp-style commands
 
@@ -1309,6 +5723,7 @@ def condor_chirp(chirp_args, return_exit_code=False):
 
     CONDOR_CHIRP_METHODS = [
         "access",
+        "bench",
         "chmod",
         "chown",
         "fetch",
@@ -1445,6 +5860,14 @@ def condor_chirp(chirp_args, return_exit_code=False):
     utime RemotePath AccessTime ModifyTime
       Change the access to AccessTime and modification time to ModifyTime of
       RemotePath.
+
+    bench [-json] [-sizes size,...] [-count count] [RemoteDirectory]
+      Measure the connection to the Chirp server: the time to connect and
+      authenticate, the round trip time of whoami and access, the rate of
+      pipelined commands, and the throughput of putfile and getfile for files
+      of each size (default 4K,1M,16M). Each measurement is repeated count
+      times (default 10). Scratch files are written in RemoteDirectory and
+      removed afterwards. With -json, print the results as JSON.
 """
 
     # Base args
@@ -1464,6 +5887,9 @@ def condor_chirp(chirp_args, return_exit_code=False):
     subparser.add_argument("-r", dest="recursive", action="store_true")
     subparser.add_argument("-l", dest="long", action="store_true")
     subparser.add_argument("-s", dest="symbolic", action="store_true")
+    subparser.add_argument("-json", dest="json", action="store_true")
+    subparser.add_argument("-sizes", dest="sizes")
+    subparser.add_argument("-count", dest="count", type=int)
 
     # Parse args
     if len(chirp_args) > 0:
@@ -1495,6 +5921,7 @@ def condor_chirp(chirp_args, return_exit_code=False):
     command = base_args.command[0]
     args = cmd_args.args
     kwargs = {}
+    open_files = []
 
     # Munge commands for inconsistencies between HTChirp and condor_chirp
     if command == "put":
@@ -1513,11 +5940,11 @@ def condor_chirp(chirp_args, return_exit_code=False):
             kwargs["stride_length"] = cmd_args.stride[0]
             kwargs["stride_skip"] = cmd_args.stride[1]
     elif command == "write":
-        # swap order of args and pass raw data
+        # swap order of args and pass the local file to be streamed
         if len(args) >= 2:
             args[0], args[1] = args[1], args[0]
-            args[0] = open(os.path.realpath(args[0]), "r").read()
-        length = None
+            args[0] = open(os.path.realpath(args[0]), "rb")
+            open_files.append(args[0])
         kwargs = {
             "offset": cmd_args.offset,
         }
@@ -1550,23 +5977,40 @@ def condor_chirp(chirp_args, return_exit_code=False):
         if len(args) >= 3:
             args[1] = int(args[1])  # actime
             args[2] = int(args[2])  # mtime
+    elif command == "bench":
+        if cmd_args.sizes is not None:
+            kwargs["sizes"] = [_parse_size(size) for size in cmd_args.sizes.split(",")]
+        if cmd_args.count is not None:
+            kwargs["count"] = cmd_args.count
 
     # Run the command
     try:
         with HTChirp() as chirp:
-            result = getattr(chirp, command)(*args, **kwargs)
+            if command == "bench":
+                result = _chirp_bench(chirp, *args, **kwargs)
+            else:
+                result = getattr(chirp, command)(*args, **kwargs)
     except Exception as e:
         if return_exit_code:
             sys.stderr.write(str(e) + "\n")
             return 1
         else:
             raise
+    finally:
+        for f in open_files:
+            f.close()
 
     # Return result
     if return_exit_code and (command in ["fetch", "put", "write"]):
         # These HTChirp methods return bytes read/written
         # But condor_chirp returns nothing for these commands
         return 0
+    elif return_exit_code and (command == "bench"):
+        if cmd_args.json:
+            print(json.dumps(result, indent=2))
+        else:
+            print(_bench_summary(result))
+        return 0
     elif return_exit_code:
         _condor_chirp_print(result)
         return 0
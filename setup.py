@@ -17,8 +17,13 @@ setup(
     keywords='htcondor chirp',
     license='ASL 2.0',
     packages=['htchirp'],
+    python_requires='>=3.6',
+    extras_require={
+        'fsspec': ['fsspec'],
+    },
     entry_points = {
         'console_scripts': ['condor_htchirp=htchirp.cli:main'],
+        'fsspec.specs': ['chirp=htchirp.fs:ChirpFileSystem'],
     },
     project_urls={
         'Bug Reports': 'https://github.com/htcondor/htchirp/issues',
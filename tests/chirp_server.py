@@ -0,0 +1,349 @@
+"""Fake Chirp server serving a local directory, for tests
+
+Implements the subset of the Chirp protocol used by htchirp, one thread per
+connection, with paths resolved under a root directory. Commands received
+are counted in ChirpServer.counts.
+"""
+
+import errno
+import os
+import shutil
+import socket
+import threading
+import time
+
+COOKIE = "secret"
+
+ERRORS = {
+    errno.EACCES: -2,
+    errno.ENOENT: -3,
+    errno.EEXIST: -4,
+    errno.EMFILE: -9,
+    errno.EISDIR: -13,
+    errno.ENOTDIR: -14,
+    errno.ENOTEMPTY: -15,
+}
+MAX_OPEN = 64
+
+
+def split_args(line):
+    """Split a command line on unescaped spaces and unquote the arguments"""
+
+    args = [[]]
+    chars = iter(line)
+    for char in chars:
+        if char == "\\":
+            args[-1].append(next(chars, ""))
+        elif char == " ":
+            args.append([])
+        else:
+            args[-1].append(char)
+    return ["".join(arg) for arg in args]
+
+
+def stat_line(stats):
+    fields = (
+        stats.st_dev,
+        stats.st_ino,
+        stats.st_mode,
+        stats.st_nlink,
+        stats.st_uid,
+        stats.st_gid,
+        stats.st_rdev,
+        stats.st_size,
+        stats.st_blksize,
+        stats.st_blocks,
+        stats.st_atime,
+        stats.st_mtime,
+        stats.st_ctime,
+    )
+    return " ".join(str(int(field)) for field in fields) + "\n"
+
+
+def open_flags(flags):
+    if "r" in flags and "w" in flags:
+        mode = os.O_RDWR
+    elif "w" in flags:
+        mode = os.O_WRONLY
+    else:
+        mode = os.O_RDONLY
+    for (flag, value) in (
+        ("a", os.O_APPEND),
+        ("t", os.O_TRUNC),
+        ("c", os.O_CREAT),
+        ("x", os.O_EXCL),
+    ):
+        if flag in flags:
+            mode |= value
+    return mode
+
+
+class ChirpConnection(threading.Thread):
+    daemon = True
+
+    def __init__(self, server, sock):
+        threading.Thread.__init__(self)
+        self.server = server
+        self.sock = sock
+        self.buffer = b""
+        self.fds = {}
+
+    def path(self, path):
+        return os.path.join(self.server.root, path.lstrip("/"))
+
+    def recv_line(self):
+        while b"\n" not in self.buffer:
+            data = self.sock.recv(65536)
+            if not data:
+                raise EOFError
+            self.buffer += data
+        (line, self.buffer) = self.buffer.split(b"\n", 1)
+        return line.decode()
+
+    def recv_exact(self, length):
+        data = bytearray(self.buffer[:length])
+        self.buffer = self.buffer[length:]
+        while len(data) < length:
+            chunk = self.sock.recv(min(1048576, length - len(data)))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return bytes(data)
+
+    def send(self, response, data=b""):
+        self.sock.sendall(str(response).encode() + b"\n" + data)
+
+    def send_data(self, data):
+        self.send(len(data), data)
+
+    def run(self):
+        try:
+            while True:
+                args = split_args(self.recv_line())
+                if self.server.delay:
+                    time.sleep(self.server.delay)
+                with self.server.lock:
+                    counts = self.server.counts
+                    counts[args[0]] = counts.get(args[0], 0) + 1
+                try:
+                    getattr(self, "do_" + args[0], self.unknown)(*args[1:])
+                except OSError as e:
+                    self.send(ERRORS.get(e.errno, -127))
+        except (EOFError, OSError):
+            pass
+        finally:
+            for fd in self.fds.values():
+                os.close(fd)
+            self.sock.close()
+
+    def unknown(self, *args):
+        self.send(-8)
+
+    def do_cookie(self, cookie):
+        self.send(0 if cookie == COOKIE else -1)
+
+    def do_whoami(self, *args):
+        self.send_data(b"CONDOR")
+
+    do_whoareyou = do_whoami
+
+    def do_open(self, path, flags, mode):
+        if len(self.fds) >= MAX_OPEN:
+            self.send(-9)
+            return
+        fd = os.open(self.path(path), open_flags(flags), int(mode))
+        number = max(self.fds) + 1 if self.fds else 3
+        self.fds[number] = fd
+        self.send(number, stat_line(os.fstat(fd)).encode())
+
+    def do_close(self, fd):
+        os.close(self.fds.pop(int(fd)))
+        self.send(0)
+
+    def do_read(self, fd, length, offset=None, stride_length=None, stride_skip=None):
+        fd = self.fds.get(int(fd))
+        if fd is None:
+            self.send(-12)
+            return
+        length = int(length)
+        if offset is None:
+            data = os.read(fd, length)
+        elif stride_length is None:
+            data = os.pread(fd, length, int(offset))
+        else:
+            (offset, stride_length) = (int(offset), int(stride_length))
+            data = b""
+            while len(data) < length:
+                chunk = os.pread(fd, min(stride_length, length - len(data)), offset)
+                if not chunk:
+                    break
+                data += chunk
+                offset += int(stride_skip)
+        self.send_data(data)
+
+    do_pread = do_sread = do_read
+
+    def do_write(self, fd, length, offset=None, stride_length=None, stride_skip=None):
+        fd = self.fds.get(int(fd))
+        data = self.recv_exact(int(length))
+        if fd is None:
+            self.send(-12)
+            return
+        if offset is None:
+            written = os.write(fd, data)
+        elif stride_length is None:
+            written = os.pwrite(fd, data, int(offset))
+        else:
+            (offset, stride_length) = (int(offset), int(stride_length))
+            written = 0
+            while written < len(data):
+                chunk = data[written : written + stride_length]
+                written += os.pwrite(fd, chunk, offset)
+                offset += int(stride_skip)
+        self.send(written)
+
+    do_pwrite = do_swrite = do_write
+
+    def do_fsync(self, fd):
+        self.send(0)
+
+    def do_lseek(self, fd, offset, whence):
+        self.send(os.lseek(self.fds[int(fd)], int(offset), int(whence)))
+
+    def do_getfile(self, path):
+        with open(self.path(path), "rb") as f:
+            self.send_data(f.read())
+
+    def do_putfile(self, path, mode, length):
+        self.send(0)
+        data = self.recv_exact(int(length))
+        with open(self.path(path), "wb") as f:
+            f.write(data)
+        os.chmod(self.path(path), int(mode))
+        self.send(len(data))
+
+    def do_getdir(self, path, stats=False):
+        directory = self.path(path)
+        lines = []
+        for name in [".", ".."] + sorted(os.listdir(directory)):
+            lines.append(name + "\n")
+            if stats:
+                lines.append(stat_line(os.stat(os.path.join(directory, name))))
+        self.send_data("".join(lines).encode())
+
+    def do_getlongdir(self, path):
+        self.do_getdir(path, stats=True)
+
+    def do_stat(self, path):
+        self.send(0, stat_line(os.stat(self.path(path))).encode())
+
+    def do_lstat(self, path):
+        self.send(0, stat_line(os.lstat(self.path(path))).encode())
+
+    def do_statfs(self, path):
+        s = os.statvfs(self.path(path))
+        fields = (0, s.f_bsize, s.f_blocks, s.f_bfree, s.f_bavail, s.f_files, s.f_ffree)
+        self.send(0, (" ".join(str(field) for field in fields) + "\n").encode())
+
+    def do_access(self, path, mode):
+        path = self.path(path)
+        if not os.path.exists(path):
+            self.send(-3)
+        else:
+            self.send(0 if os.access(path, int(mode) or os.F_OK) else -2)
+
+    def do_unlink(self, path):
+        os.unlink(self.path(path))
+        self.send(0)
+
+    def do_rename(self, old_path, new_path):
+        os.rename(self.path(old_path), self.path(new_path))
+        self.send(0)
+
+    def do_link(self, old_path, new_path):
+        os.link(self.path(old_path), self.path(new_path))
+        self.send(0)
+
+    def do_symlink(self, old_path, new_path):
+        os.symlink(old_path, self.path(new_path))
+        self.send(0)
+
+    def do_readlink(self, path, length=None):
+        self.send_data(os.readlink(self.path(path)).encode())
+
+    def do_mkdir(self, path, mode):
+        os.mkdir(self.path(path), int(mode))
+        self.send(0)
+
+    def do_rmdir(self, path):
+        os.rmdir(self.path(path))
+        self.send(0)
+
+    def do_rmall(self, path):
+        shutil.rmtree(self.path(path))
+        self.send(0)
+
+    def do_truncate(self, path, length):
+        os.truncate(self.path(path), int(length))
+        self.send(0)
+
+    def do_utime(self, path, atime, mtime):
+        os.utime(self.path(path), (int(atime), int(mtime)))
+        self.send(0)
+
+    def do_chmod(self, path, mode):
+        os.chmod(self.path(path), int(mode))
+        self.send(0)
+
+    def do_chown(self, path, uid, gid):
+        self.send(0)
+
+    do_lchown = do_chown
+
+    def do_set_job_attr(self, name, expr):
+        self.server.attrs[name] = expr
+        self.send(0)
+
+    do_set_job_attr_delayed = do_set_job_attr
+
+    def do_get_job_attr(self, name):
+        self.send_data(self.server.attrs.get(name, "UNDEFINED").encode())
+
+    do_get_job_attr_delayed = do_get_job_attr
+
+    def do_ulog(self, message):
+        self.server.log.append(message)
+        self.send(0)
+
+
+class ChirpServer(object):
+    """Serve root over the Chirp protocol on a local port"""
+
+    def __init__(self, root, delay=0.0):
+        self.root = str(root)
+        self.delay = delay
+        self.counts = {}
+        self.attrs = {}
+        self.log = []
+        self.lock = threading.Lock()
+
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(64)
+        self.host, self.port = self.sock.getsockname()
+
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                (sock, _) = self.sock.accept()
+            except OSError:
+                return  # closed
+            ChirpConnection(self, sock).start()
+
+    def close(self):
+        self.sock.close()
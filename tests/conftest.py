@@ -0,0 +1,41 @@
+import pytest
+
+from htchirp import HTChirp
+
+from chirp_server import COOKIE, ChirpServer
+
+
+@pytest.fixture
+def root(tmp_path):
+    """Directory served by the fake Chirp server"""
+    path = tmp_path / "root"
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def server(root):
+    server = ChirpServer(root)
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def connect(server):
+    """Open clients to the fake server, closed at the end of the test"""
+    clients = []
+
+    def connect(**kwargs):
+        chirp = HTChirp(server.host, server.port, cookie=COOKIE, **kwargs)
+        chirp.connect()
+        clients.append(chirp)
+        return chirp
+
+    yield connect
+    for chirp in clients:
+        chirp.disconnect()
+
+
+@pytest.fixture
+def chirp(connect):
+    return connect()
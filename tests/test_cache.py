@@ -0,0 +1,119 @@
+import io
+import os
+import socket
+import stat
+import time
+
+import pytest
+
+from htchirp import ChirpBlockCache, ChirpFileCache, HTChirp
+
+
+def test_block_cache_invalidated_by_write(root, connect):
+    data = os.urandom(100000)
+    (root / "blocks.bin").write_bytes(data)
+    cache = ChirpBlockCache(max_size=20000, block_size=4096, validate_interval=60)
+    chirp = connect(block_cache=cache)
+
+    for offset in range(0, len(data), 7000):
+        assert chirp.read("blocks.bin", 9000, offset) == data[offset : offset + 9000]
+    assert cache.size <= cache.max_size
+
+    chirp.write(b"ZZZZ", "blocks.bin", "w", offset=0)
+    assert chirp.read("blocks.bin", 10, 0) == b"ZZZZ" + data[4:10]
+
+
+@pytest.fixture
+def remote_files(root):
+    for i in range(3):
+        (root / "f{0}.bin".format(i)).write_bytes(os.urandom(1000))
+
+
+def cached(cache):
+    return [name for name in os.listdir(cache.directory) if not name.startswith(".")]
+
+
+def test_file_cache_eviction(tmp_path, connect, remote_files):
+    cache = ChirpFileCache(str(tmp_path / "cache"), max_size=1500)
+    chirp = connect(file_cache=cache)
+
+    chirp.fetch("f0.bin", str(tmp_path / "f0.out"))
+    key = cache._key("f0.bin", chirp.stat("f0.bin"))
+    assert os.path.exists(os.path.join(cache.directory, key))
+    assert stat.S_IMODE(os.stat(str(tmp_path / "f0.out")).st_mode) == 0o444
+
+    # an entry in use is kept, stale partial downloads are removed
+    in_use = cache._lock(key, shared=True)
+    stale = tmp_path / "cache" / ".tmp-stale"
+    stale.write_text("x")
+    os.utime(str(stale), (time.time() - 7200, time.time() - 7200))
+    fresh = tmp_path / "cache" / ".tmp-fresh"
+    fresh.write_text("x")
+    chirp.fetch("f1.bin", str(tmp_path / "f1.out"))
+    assert os.path.exists(os.path.join(cache.directory, key))
+    assert not stale.exists() and fresh.exists()
+
+    in_use.close()
+    chirp.fetch("f2.bin", str(tmp_path / "f2.out"))
+    assert not os.path.exists(os.path.join(cache.directory, key))
+
+    # lock files go away with their entries
+    entries = [name for name in cached(cache) if not name.endswith(".lock")]
+    locks = [name[: -len(".lock")] for name in cached(cache) if name.endswith(".lock")]
+    assert sorted(locks) == sorted(entries)
+
+
+def test_file_cache_hit(tmp_path, root, connect, remote_files):
+    cache = ChirpFileCache(str(tmp_path / "cache"))
+    chirp = connect(file_cache=cache)
+
+    for name in ["a.out", "b.out"]:
+        assert chirp.fetch("f0.bin", str(tmp_path / name)) == 1000
+        assert (tmp_path / name).read_bytes() == (root / "f0.bin").read_bytes()
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_prefetched_copy_not_used_after_change(root, connect):
+    for i in range(4):
+        (root / "p{0}".format(i)).write_bytes(b"old")
+    chirp = connect()
+    prefetcher = chirp.prefetch(["p{0}".format(i) for i in range(4)], workers=1)
+    try:
+        prefetcher.wait("p3")
+
+        chirp.write(b"new0", "p0", "wct")
+        assert chirp.read("p0", 10, 0) == b"new0"
+
+        chirp.truncate("p1", 1)
+        assert chirp.read("p1", 10, 0) == b"o"
+
+        chirp.rename("p0", "p2")
+        contents = io.BytesIO()
+        chirp.fetch("p2", contents)
+        assert contents.getvalue() == b"new0"
+    finally:
+        prefetcher.close()
+
+
+def test_fd_cache_invalidation(tmp_path, root, connect, monkeypatch):
+    (root / "fd.bin").write_bytes(b"old data")
+    (tmp_path / "new.bin").write_bytes(b"new data!")
+    chirp = connect(fd_cache=8)
+
+    chirp.read("fd.bin", 3, 0)
+    assert [key[0] for key in chirp._cached_fds] == ["fd.bin"]
+    chirp.putfile(str(tmp_path / "new.bin"), "fd.bin")
+    assert not chirp._cached_fds
+    assert chirp.read("fd.bin", 9, 0) == b"new data!"
+    chirp.truncate("fd.bin", 3)
+    assert not chirp._cached_fds
+
+    # a failed read releases its descriptor
+    def timeout(self, *args):
+        raise socket.timeout("timed out")
+
+    chirp.read("fd.bin", 3, 0)
+    monkeypatch.setattr(HTChirp, "_read", timeout)
+    with pytest.raises(socket.timeout):
+        chirp.read("fd.bin", 3, 0)
+    assert all(users == 0 for (_, users) in chirp._cached_fds.values())
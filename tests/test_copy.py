@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from htchirp import HTChirp
+
+
+@pytest.fixture
+def tree(root):
+    (root / "tree" / "sub").mkdir(parents=True)
+    (root / "tree" / "a.bin").write_bytes(b"data" * 1000)
+    os.link(str(root / "tree" / "a.bin"), str(root / "tree" / "hard.bin"))
+    return root / "tree"
+
+
+def test_copy(root, chirp, tree):
+    assert chirp.copy("tree/a.bin", "b.bin") == 4000
+    assert (root / "b.bin").read_bytes() == b"data" * 1000
+
+
+@pytest.mark.parametrize("dst", ["tree/a.bin", "tree/./a.bin", "tree/hard.bin"])
+def test_copy_to_same_file(chirp, tree, dst):
+    with pytest.raises(HTChirp.InvalidRequest):
+        chirp.copy("tree/a.bin", dst)
+    assert (tree / "a.bin").read_bytes() == b"data" * 1000
+
+
+@pytest.mark.parametrize("dst", ["tree", "tree/", "tree/sub/copy"])
+def test_copytree_into_itself(chirp, tree, dst):
+    with pytest.raises(HTChirp.InvalidRequest):
+        chirp.copytree("tree", dst)
+    assert not (tree / "sub" / "copy").exists()
+
+
+def test_copytree(root, chirp, tree):
+    assert chirp.copytree("tree", "copy") == 8000
+    assert (root / "copy" / "hard.bin").read_bytes() == b"data" * 1000
+    assert (root / "copy" / "sub").is_dir()
+
+
+def test_symlink_cycle(root, chirp):
+    (root / "top" / "a" / "b").mkdir(parents=True)
+    (root / "top" / "a" / "b" / "f").write_text("f")
+    os.symlink("../..", str(root / "top" / "a" / "b" / "up"))
+    os.symlink("a", str(root / "top" / "alias"))
+
+    walked = list(chirp.walk("top"))
+    assert [path for (path, _, _) in walked] == ["top", "top/a", "top/a/b"]
+    walked = list(chirp.walk("top", followlinks=True))
+    assert [path for (path, _, _) in walked] == ["top", "top/a", "top/a/b"]
+
+    assert chirp.copytree("top", "copy") == 1
+    assert (root / "copy" / "a" / "b" / "f").read_text() == "f"
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+
+from htchirp import ChirpLogShipper
+
+
+def later(*steps):
+    """Run (delay, function) steps in a background thread"""
+
+    def run():
+        for (delay, function) in steps:
+            time.sleep(delay)
+            function()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def append(path, data):
+    with open(str(path), "ab") as f:
+        f.write(data)
+
+
+def test_follow_rotation(root, chirp):
+    log = root / "status.log"
+    log.write_bytes(b"old\n")
+
+    def rotate():
+        os.rename(str(log), str(log) + ".1")
+        append(str(log) + ".1", b"last old\n")
+        log.write_bytes(b"new\n")
+
+    writer = later(
+        (0.1, lambda: append(log, b"one\n")),
+        (0.1, lambda: append(log, b"two\n")),
+        (0.1, rotate),
+        (0.3, lambda: log.write_bytes(b"T\n")),  # truncated and rewritten
+    )
+    out = b"".join(
+        chirp.follow(
+            "status.log", min_interval=0.02, max_interval=0.05, idle_timeout=0.5
+        )
+    )
+    writer.join()
+    assert out == b"one\ntwo\nlast old\nnew\nT\n"
+    assert chirp.whoami() == "CONDOR"
+
+
+def test_follow_file_created_later(root, chirp):
+    log = root / "late.log"
+    writer = later(
+        (0.1, lambda: log.write_bytes(b"first\n")),
+        (0.1, lambda: append(log, b"second\n")),
+    )
+    out = b"".join(
+        chirp.follow("late.log", min_interval=0.02, max_interval=0.05, idle_timeout=0.5)
+    )
+    writer.join()
+    assert out == b"first\nsecond\n"
+
+
+def test_ship_logs_rotation(tmp_path, root, chirp):
+    (root / "app.log").write_bytes(b"EXISTING\n")
+    log = tmp_path / "app.log"
+    log.write_bytes(b"")
+    shipper = chirp.ship_logs(
+        [(str(log), "app.log")], max_delay=0.02, poll_interval=0.02
+    )
+    try:
+        append(log, b"one\n")
+        assert shipper.flush(timeout=5)
+        os.rename(str(log), str(log) + ".1")
+        log.write_bytes(b"rotated\n")
+        assert shipper.flush(timeout=5)
+    finally:
+        shipper.stop(5)
+    assert (root / "app.log").read_bytes() == b"EXISTING\none\nrotated\n"
+    assert not shipper.errors
+
+
+def test_ship_logs_copytruncate(tmp_path, root, chirp):
+    log = tmp_path / "ct.log"
+    log.write_bytes(b"")
+    shipper = chirp.ship_logs(
+        [(str(log), "ct.log")], max_delay=0.02, poll_interval=0.02
+    )
+    try:
+        append(log, b"A" * 100)
+        assert shipper.flush(timeout=5)
+        # data written since the truncation is not skipped
+        with open(str(log), "r+b") as f:
+            f.truncate(0)
+            f.write(b"B" * 50)
+        time.sleep(0.1)
+        append(log, b"C" * 10)
+        assert shipper.flush(timeout=5)
+    finally:
+        shipper.stop(5)
+    assert (root / "ct.log").read_bytes() == b"A" * 100 + b"B" * 50 + b"C" * 10
+
+
+def test_flush_without_running_shipper(tmp_path, chirp):
+    log = tmp_path / "flush.log"
+    log.write_bytes(b"data\n")
+    shipper = ChirpLogShipper(chirp, [(str(log), "flush.log")])
+    start = time.time()
+    assert shipper.flush() is False  # not started
+    shipper.start()
+    assert shipper.flush(5)
+    shipper.stop(5)
+    append(log, b"more\n")
+    assert shipper.flush() is False  # stopped
+    assert time.time() - start < 5
@@ -0,0 +1,56 @@
+import pytest
+
+from htchirp import ChirpConcurrency, HTChirp
+
+from chirp_server import ChirpConnection
+
+
+@pytest.fixture
+def files(root):
+    for i in range(10):
+        (root / "f{0}".format(i)).write_text("x" * i)
+    return ["f{0}".format(i) for i in range(10)]
+
+
+def test_lstat_many_errors_do_not_stop_others(chirp, files):
+    results = chirp.lstat_many(files[:5] + ["missing"] + files[5:], window=4)
+    assert isinstance(results[5], HTChirp.DoesntExist)
+    sizes = [stats["size"] for stats in results[:5] + results[6:]]
+    assert sizes == list(range(10))
+
+
+def test_failed_reader_resets_connection(chirp, files):
+    calls = []
+
+    def read_result(response):
+        calls.append(response)
+        if len(calls) == 3:
+            raise ValueError("garbled")
+        return response
+
+    cmds = ["stat {0}\n".format(path) for path in files]
+    with pytest.raises(ValueError):
+        chirp._pipeline(cmds, read_result, 10)
+
+    # the unread responses were dropped with the old connection
+    assert chirp.whoami() == "CONDOR"
+    assert chirp.stat("f7")["size"] == 7
+
+
+def test_overloaded_server_shrinks_window(connect, files, monkeypatch):
+    lstat = ChirpConnection.do_lstat
+
+    def do_lstat(self, path):
+        if self.buffer.count(b"\n") > 40:
+            self.send(-11)  # too deep a backlog
+        else:
+            lstat(self, path)
+
+    monkeypatch.setattr(ChirpConnection, "do_lstat", do_lstat)
+    concurrency = ChirpConcurrency(interval=0.02, max_window=512)
+    chirp = connect(concurrency=concurrency)
+
+    results = chirp.lstat_many(files * 200)
+    assert not [result for result in results if isinstance(result, Exception)]
+    cuts = [d for d in concurrency.decisions if d["reason"] == "overloaded"]
+    assert cuts and cuts[0]["to"] < cuts[0]["from"]
@@ -0,0 +1,76 @@
+import json
+import pickle
+
+from htchirp import ChirpStat, ChirpStatFS
+
+FIELDS = [
+    "device",
+    "inode",
+    "mode",
+    "nlink",
+    "uid",
+    "gid",
+    "rdevice",
+    "size",
+    "blksize",
+    "blocks",
+    "atime",
+    "mtime",
+    "ctime",
+]
+LINE = "64768 1234 33188 1 1000 1000 0 4096 4096 8 1700000000 1700000001 1700000002"
+
+
+def old_dict():
+    # what stat() returned before ChirpStat
+    return dict(zip(FIELDS, [int(x) for x in LINE.split()]))
+
+
+def test_stat_is_a_dict():
+    stats = ChirpStat.from_line(LINE)
+    assert isinstance(stats, dict)
+    assert stats == old_dict()
+    assert old_dict() == stats
+    assert list(stats) == FIELDS
+    assert len(stats) == len(FIELDS)
+    assert "size" in stats and "st_size" not in stats
+    assert stats["size"] == 4096
+    assert stats.get("missing", 5) == 5
+    assert sorted(stats.keys()) == sorted(FIELDS)
+    assert dict(stats) == old_dict()
+    assert json.loads(json.dumps(stats)) == old_dict()
+
+
+def test_stat_attributes():
+    stats = ChirpStat.from_line(LINE)
+    assert stats.size == stats.st_size == 4096
+    assert stats.inode == stats.st_ino == 1234
+    assert stats.mtime == stats.st_mtime == 1700000001
+    try:
+        stats.missing
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("missing field did not raise AttributeError")
+
+
+def test_stat_pickle():
+    stats = ChirpStat.from_line(LINE)
+    copy = pickle.loads(pickle.dumps(stats))
+    assert type(copy) is ChirpStat
+    assert copy == stats and copy.size == 4096
+
+
+def test_statfs():
+    stats = ChirpStatFS.from_line("61267 4096 1000 500 400 100 50")
+    assert stats == {
+        "f_type": 61267,
+        "f_bsize": 4096,
+        "f_blocks": 1000,
+        "f_bfree": 500,
+        "f_bavail": 400,
+        "f_files": 100,
+        "f_free": 50,
+    }
+    assert stats.f_bavail == 400
+    assert stats.f_ffree == stats["f_free"] == 50
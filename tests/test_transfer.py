@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+from htchirp import ChirpBlockCache, HTChirp
+
+
+def cap_reads(monkeypatch, limit):
+    """Make the server return at most limit bytes per read"""
+    read = HTChirp._read
+
+    def capped(self, fd, length, offset=None, *args):
+        return read(self, fd, min(length, limit), offset, *args)
+
+    monkeypatch.setattr(HTChirp, "_read", capped)
+
+
+def short_writes(monkeypatch, fraction):
+    """Make the server write only part of each request"""
+    write = HTChirp._write
+
+    def short(self, fd, data, length, *args):
+        length = max(1, int(length * fraction))
+        return write(self, fd, data[:length], length, *args)
+
+    monkeypatch.setattr(HTChirp, "_write", short)
+
+
+def test_read_write(root, chirp):
+    data = os.urandom(100000)
+    assert chirp.write(data, "file.bin", "wct") == len(data)
+    assert (root / "file.bin").read_bytes() == data
+    assert chirp.read("file.bin", 1000, 5000) == data[5000:6000]
+
+
+def test_short_reads_through_block_cache(root, connect, monkeypatch):
+    data = os.urandom(100000)
+    (root / "short.bin").write_bytes(data)
+    chirp = connect(block_cache=ChirpBlockCache(block_size=4096, validate_interval=60))
+
+    cap_reads(monkeypatch, 5000)
+    for (offset, length) in [(0, 20000), (5000, 30000), (90000, 20000)]:
+        assert chirp.read("short.bin", length, offset) == data[offset : offset + length]
+
+
+def test_partial_blocks_are_not_cached(root, connect, monkeypatch):
+    data = os.urandom(100000)
+    (root / "short.bin").write_bytes(data)
+    chirp = connect(block_cache=ChirpBlockCache(block_size=4096, validate_interval=60))
+
+    cap_reads(monkeypatch, 1000)
+    partial = chirp.read("short.bin", 9000, 40960)
+    assert 0 < len(partial) < 9000
+    assert partial == data[40960 : 40960 + len(partial)]
+
+    monkeypatch.undo()
+    assert chirp.read("short.bin", 9000, 40960) == data[40960:49960]
+
+
+def test_copy_short_write(root, connect, monkeypatch):
+    data = os.urandom(3 << 20)
+    (root / "src.bin").write_bytes(data)
+    chirp = connect(chunk_size=1 << 20)
+    assert chirp.copy("src.bin", "dst.bin") == len(data)
+    assert (root / "dst.bin").read_bytes() == data
+
+    short_writes(monkeypatch, 0.5)
+    for size in [100, len(data)]:
+        (root / "src.bin").write_bytes(data[:size])
+        with pytest.raises(HTChirp.ChirpError):
+            chirp.copy("src.bin", "dst.bin")
+    monkeypatch.undo()
+    assert chirp.whoami() == "CONDOR"
+
+
+def test_fs_upload_retries_short_writes(root, server, monkeypatch):
+    pytest.importorskip("fsspec")
+    from htchirp.fs import ChirpFileSystem
+
+    fs = ChirpFileSystem(
+        host=server.host, port=server.port, cookie="secret", skip_instance_cache=True
+    )
+    data = os.urandom(300000)
+    short_writes(monkeypatch, 0.3)
+    with fs.open("fs.bin", "wb", block_size=65536) as f:
+        f.write(data)
+    assert (root / "fs.bin").read_bytes() == data
+
+    monkeypatch.setattr(HTChirp, "_write", lambda self, fd, data, length, *args: 0)
+    with pytest.raises(IOError):
+        with fs.open("fs.bin", "wb") as f:
+            f.write(b"abc")